@@ -12,7 +12,10 @@ It can also make use of the global route planner to follow a specifed route
 import carla
 from shapely.geometry import Polygon
 
-from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner import (
+    GlobalRoutePlanner,
+    get_global_route_planner,
+)
 from agents.navigation.local_planner import LocalPlanner, RoadOption
 from agents.tools.misc import (
     compute_distance,
@@ -20,6 +23,7 @@ from agents.tools.misc import (
     get_trafficlight_trigger_location,
     is_within_distance,
 )
+from agents.tools.world_snapshot import get_world_snapshot
 
 
 class BasicAgent(object):
@@ -101,9 +105,11 @@ class BasicAgent(object):
                 self._global_planner = grp_inst
             else:
                 print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+                self._global_planner = get_global_route_planner(
+                    self._map, self._sampling_resolution
+                )
         else:
-            self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._global_planner = get_global_route_planner(self._map, self._sampling_resolution)
 
         # Get the static elements of the scene
         self._lights_list = self._world.get_actors().filter("*traffic_light*")
@@ -204,7 +210,8 @@ class BasicAgent(object):
         hazard_detected = False
 
         # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
+        snapshot = get_world_snapshot(self._world)
+        vehicle_list = snapshot.get_actors(snapshot.filter("*vehicle*"))
 
         vehicle_speed = get_speed(self._vehicle) / 3.6
 
@@ -373,13 +380,17 @@ class BasicAgent(object):
         if self._ignore_vehicles:
             return (False, None, -1)
 
-        if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+        # Every agent reads the actors from the snapshot of the current tick
+        snapshot = get_world_snapshot(self._world)
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
+        ego_index = snapshot.index_of(self._vehicle.id)
+        if ego_index is None:
+            ego_transform = self._vehicle.get_transform()
+        else:
+            ego_transform = snapshot.get_transform(ego_index)
         ego_location = ego_transform.location
         ego_wpt = self._map.get_waypoint(ego_location)
 
@@ -401,11 +412,45 @@ class BasicAgent(object):
         # Get the route bounding box
         route_polygon = get_route_polygon()
 
+        # General approach for junctions and vehicles invading other lanes due to the offset,
+        # only the actors whose bounding box touches the route are visited
+        if use_bbs and route_polygon:
+            if vehicle_list:
+                targets = {target_vehicle.id: target_vehicle for target_vehicle in vehicle_list}
+            else:
+                vehicle_indices = set(snapshot.filter("*vehicle*").tolist())
+            for target_index in snapshot.query_obstacles(route_polygon).tolist():
+                target_id = int(snapshot.ids[target_index])
+                if target_id == self._vehicle.id:
+                    continue
+                if vehicle_list:
+                    if target_id not in targets:
+                        continue
+                    target_vehicle = targets[target_id]
+                elif target_index in vehicle_indices:
+                    target_vehicle = snapshot.get_actor(target_index)
+                else:
+                    continue
+                target_location = snapshot.get_location(target_index)
+                if target_location.distance(ego_location) > max_distance:
+                    continue
+                return (True, target_vehicle, compute_distance(target_location, ego_location))
+            return (False, None, -1)
+
+        if not vehicle_list:
+            vehicle_list = snapshot.get_actors(snapshot.filter("*vehicle*"))
+        # Actors whose bounding box touches the route, queried once from the spatial index
+        route_obstacles = None
+
         for target_vehicle in vehicle_list:
             if target_vehicle.id == self._vehicle.id:
                 continue
 
-            target_transform = target_vehicle.get_transform()
+            target_index = snapshot.index_of(target_vehicle.id)
+            if target_index is None:
+                continue
+
+            target_transform = snapshot.get_transform(target_index)
             if target_transform.location.distance(ego_location) > max_distance:
                 continue
 
@@ -413,19 +458,17 @@ class BasicAgent(object):
                 target_transform.location, lane_type=carla.LaneType.Any
             )
 
-            # General approach for junctions and vehicles invading other lanes due to the offset
-            if (use_bbs or target_wpt.is_junction) and route_polygon:
+            # Same as above for the targets in a junction
+            if target_wpt.is_junction and route_polygon:
 
-                target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                target_polygon = Polygon(target_list)
+                if route_obstacles is None:
+                    route_obstacles = set(snapshot.query_obstacles(route_polygon).tolist())
 
-                if route_polygon.intersects(target_polygon):
+                if target_index in route_obstacles:
                     return (
                         True,
                         target_vehicle,
-                        compute_distance(target_vehicle.get_location(), ego_location),
+                        compute_distance(target_transform.location, ego_location),
                     )
 
             # Simplified approach, using only the plan waypoints (similar to TM)
@@ -445,7 +488,7 @@ class BasicAgent(object):
                         continue
 
                 target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
+                target_extent = snapshot.extent[target_index, 0]
                 target_rear_transform = target_transform
                 target_rear_transform.location -= carla.Location(
                     x=target_extent * target_forward_vector.x,
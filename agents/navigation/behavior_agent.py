@@ -18,6 +18,7 @@ from agents.navigation.basic_agent import BasicAgent
 from agents.navigation.behavior_types import Aggressive, Cautious, Normal
 from agents.navigation.local_planner import RoadOption
 from agents.tools.misc import get_speed, positive
+from agents.tools.world_snapshot import get_world_snapshot
 
 DISTANCE_FOR_INTERFERENCE = 15
 WAITING_SPEED = 2.0
@@ -100,8 +101,8 @@ class BehaviorAgent(BasicAgent):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
+        snapshot = get_world_snapshot(self._world)
+        lights_list = snapshot.get_actors(snapshot.filter("*traffic_light*"))
         affected, _ = self._affected_by_traffic_light(lights_list)
 
         return affected
@@ -177,12 +178,11 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-
-        def dist(v):
-            return v.get_location().distance(waypoint.transform.location)
-
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        snapshot = get_world_snapshot(self._world)
+        vehicle_indices = snapshot.filter("*vehicle*")
+        distances = snapshot.distances_to(waypoint.transform.location, vehicle_indices)
+        nearby = (distances < 45) & (snapshot.ids[vehicle_indices] != self._vehicle.id)
+        vehicle_list = snapshot.get_actors(vehicle_indices[nearby])
 
         if self._direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
@@ -229,12 +229,10 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-
-        def dist(w):
-            return w.get_location().distance(waypoint.transform.location)
-
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        snapshot = get_world_snapshot(self._world)
+        walker_indices = snapshot.filter("*walker.pedestrian*")
+        distances = snapshot.distances_to(waypoint.transform.location, walker_indices)
+        walker_list = snapshot.get_actors(walker_indices[distances < 10])
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(
@@ -8,7 +8,10 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+import hashlib
 import math
+import os
+import pickle
 
 import carla
 import networkx as nx
@@ -23,10 +26,10 @@ class GlobalRoutePlanner(object):
     This class provides a very high level route plan.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, topology=None):
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
-        self._topology = None
+        self._topology = topology
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
@@ -35,7 +38,8 @@ class GlobalRoutePlanner(object):
         self._previous_decision = RoadOption.VOID
 
         # Build the graph
-        self._build_topology()
+        if self._topology is None:
+            self._build_topology()
         self._build_graph()
         self._find_loose_ends()
         self._lane_change_link()
@@ -45,6 +49,11 @@ class GlobalRoutePlanner(object):
         This method returns list of (carla.Waypoint, RoadOption)
         from origin to destination
         """
+        # The planner is shared through get_global_route_planner, so the turn
+        # decision state of a previously traced route must not leak into this one
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
         route_trace = []
         route = self._path_search(origin, destination)
         current_waypoint = self._wmap.get_waypoint(origin)
@@ -132,6 +141,10 @@ class GlobalRoutePlanner(object):
                 seg_dict["path"].append(next_wps[0])
             self._topology.append(seg_dict)
 
+    def get_topology(self):
+        """Get method for the processed topology, see `_build_topology`"""
+        return self._topology
+
     def _build_graph(self):
         """
         This function builds a networkx graph representation of topology, creating several class attributes:
@@ -468,3 +481,110 @@ class GlobalRoutePlanner(object):
                 closest_index = i
 
         return closest_index
+
+
+_PLANNER_REGISTRY = {}
+_PLANNER_CACHE_DIR = None
+
+
+def set_route_planner_cache_dir(cache_dir):
+    """
+    Sets the folder where processed topologies are stored, so that a new process
+    can rebuild its planners without tracing the map again. `None` disables it.
+    """
+    global _PLANNER_CACHE_DIR
+    _PLANNER_CACHE_DIR = cache_dir
+
+
+def _waypoint_to_key(waypoint):
+    return (waypoint.road_id, waypoint.lane_id, waypoint.s)
+
+
+def _key_to_waypoint(wmap, key):
+    waypoint = wmap.get_waypoint_xodr(*key)
+    if waypoint is None:
+        raise KeyError(key)
+    return waypoint
+
+
+def _topology_cache_path(cache_dir, wmap, sampling_resolution):
+    map_name = wmap.name.rsplit("/", 1)[-1]
+    return os.path.join(cache_dir, f"topology_{map_name}_{sampling_resolution}.pkl")
+
+
+def _opendrive_hash(wmap):
+    return hashlib.sha256(wmap.to_opendrive().encode("utf-8")).hexdigest()
+
+
+def _load_topology(cache_path, wmap, opendrive_hash):
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, "rb") as f:
+        saved_hash, saved_topology = pickle.load(f)
+    if saved_hash != opendrive_hash:
+        return None
+    topology = []
+    try:
+        for segment in saved_topology:
+            topology.append(
+                {
+                    "entry": _key_to_waypoint(wmap, segment["entry"]),
+                    "exit": _key_to_waypoint(wmap, segment["exit"]),
+                    "entryxyz": segment["entryxyz"],
+                    "exitxyz": segment["exitxyz"],
+                    "path": [_key_to_waypoint(wmap, key) for key in segment["path"]],
+                }
+            )
+    except KeyError:
+        return None
+    return topology
+
+
+def _save_topology(cache_path, topology, opendrive_hash):
+    saved_topology = [
+        {
+            "entry": _waypoint_to_key(segment["entry"]),
+            "exit": _waypoint_to_key(segment["exit"]),
+            "entryxyz": segment["entryxyz"],
+            "exitxyz": segment["exitxyz"],
+            "path": [_waypoint_to_key(waypoint) for waypoint in segment["path"]],
+        }
+        for segment in topology
+    ]
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "wb") as f:
+        pickle.dump((opendrive_hash, saved_topology), f)
+
+
+def get_global_route_planner(wmap, sampling_resolution, cache_dir=None):
+    """
+    Returns the GlobalRoutePlanner shared by the whole process for the given map
+    and sampling resolution, building it only the first time it is requested.
+    Waypoints are stored on disk as (road_id, lane_id, s) so the topology can
+    be restored with `get_waypoint_xodr` instead of tracing every segment.
+
+        :param wmap: carla.Map instance
+        :param sampling_resolution: resolution of the planner, in meters
+        :param cache_dir: folder of the topology cache, defaults to `set_route_planner_cache_dir`
+    """
+    key = (wmap.name, float(sampling_resolution))
+    if key in _PLANNER_REGISTRY:
+        return _PLANNER_REGISTRY[key]
+
+    cache_dir = cache_dir if cache_dir is not None else _PLANNER_CACHE_DIR
+    topology = None
+    if cache_dir is not None:
+        cache_path = _topology_cache_path(cache_dir, wmap, sampling_resolution)
+        opendrive_hash = _opendrive_hash(wmap)
+        topology = _load_topology(cache_path, wmap, opendrive_hash)
+
+    planner = GlobalRoutePlanner(wmap, sampling_resolution, topology=topology)
+    if cache_dir is not None and topology is None:
+        _save_topology(cache_path, planner.get_topology(), opendrive_hash)
+    _PLANNER_REGISTRY[key] = planner
+    return planner
+
+
+def clear_global_route_planners():
+    """Drops every planner of the registry, e.g. after the maps have been changed"""
+    _PLANNER_REGISTRY.clear()
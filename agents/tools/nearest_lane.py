@@ -0,0 +1,308 @@
+"""Module answering map.get_waypoint queries in-process from a KD-tree of lane samples."""
+
+import hashlib
+import os
+
+import carla
+import numpy as np
+from scipy.spatial import cKDTree
+
+DEFAULT_SAMPLING_DISTANCE = 1.0
+NUM_CANDIDATES = 8
+
+_SERVICE_REGISTRY = {}
+_SERVICE_CACHE_DIR = None
+
+SAMPLE_FIELDS = (
+    "location",
+    "yaw",
+    "road_id",
+    "section_id",
+    "lane_id",
+    "s",
+    "lane_width",
+    "lane_type",
+)
+
+
+def _opendrive_hash(wmap):
+    return hashlib.sha256(wmap.to_opendrive().encode("utf-8")).hexdigest()
+
+
+def _outer_lanes(waypoint):
+    """Yield the lanes on the right of `waypoint`, from the nearest to the road border"""
+    lane = waypoint.get_right_lane()
+    while lane is not None:
+        yield lane
+        lane = lane.get_right_lane()
+
+
+def sample_waypoints(wmap, distance=DEFAULT_SAMPLING_DISTANCE):
+    """
+    Samples every lane of the map: the driving lanes come from `generate_waypoints`,
+    the other lane types (sidewalk, shoulder, parking, ...) are reached from them by
+    walking towards the road borders at the same s.
+
+        :param wmap: carla.Map instance
+        :param distance: distance between two samples of a lane, in meters
+        :return: (dictionary of arrays with the keys of SAMPLE_FIELDS, list of carla.Waypoint)
+    """
+    waypoints = []
+    seen = set()
+
+    def add(waypoint):
+        key = (waypoint.road_id, waypoint.section_id, waypoint.lane_id, round(waypoint.s, 2))
+        if key not in seen:
+            seen.add(key)
+            waypoints.append(waypoint)
+
+    driving = wmap.generate_waypoints(distance)
+    for waypoint in driving:
+        add(waypoint)
+    for waypoint in driving:
+        # Right is always towards the border, the lanes across the center line are reached
+        # through the left lane of the innermost driving lane
+        borders = [waypoint]
+        left_lane = waypoint.get_left_lane()
+        if left_lane is not None and left_lane.lane_id * waypoint.lane_id < 0:
+            borders.append(left_lane)
+        for border in borders:
+            if border.lane_type != carla.LaneType.Driving:
+                add(border)
+            for lane in _outer_lanes(border):
+                if lane.lane_type != carla.LaneType.Driving:
+                    add(lane)
+
+    samples = {
+        "location": np.array(
+            [
+                [
+                    waypoint.transform.location.x,
+                    waypoint.transform.location.y,
+                    waypoint.transform.location.z,
+                ]
+                for waypoint in waypoints
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 3),
+        "yaw": np.array([waypoint.transform.rotation.yaw for waypoint in waypoints]),
+        "road_id": np.array([waypoint.road_id for waypoint in waypoints], dtype=np.int64),
+        "section_id": np.array([waypoint.section_id for waypoint in waypoints], dtype=np.int64),
+        "lane_id": np.array([waypoint.lane_id for waypoint in waypoints], dtype=np.int64),
+        "s": np.array([waypoint.s for waypoint in waypoints], dtype=np.float64),
+        "lane_width": np.array([waypoint.lane_width for waypoint in waypoints]),
+        "lane_type": np.array([int(waypoint.lane_type) for waypoint in waypoints], dtype=np.int64),
+    }
+    return samples, waypoints
+
+
+def save_waypoint_dump(path, samples, distance, opendrive_hash=""):
+    """Writes lane samples (e.g. from `sample_waypoints`) to a .npz file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, distance=distance, opendrive_hash=opendrive_hash, **samples)
+    os.replace(tmp_path, path)
+
+
+def load_waypoint_dump(path):
+    """Returns (samples, distance, opendrive_hash) stored by `save_waypoint_dump`"""
+    with np.load(path) as data:
+        samples = {field: data[field] for field in SAMPLE_FIELDS}
+        return samples, float(data["distance"]), str(data["opendrive_hash"])
+
+
+class NearestLaneService(object):
+    """
+    Nearest-lane queries answered from a cKDTree of lane samples, one tree per lane type.
+
+    A query location is matched to the sample whose lane centerline passes closest to it,
+    among the NUM_CANDIDATES nearest samples, so a location near a lane border is assigned to
+    the lane containing it rather than to the closest sample. The returned waypoint has the
+    road / section / lane ids of that sample and is moved along the lane to the projection
+    of the location, like `carla.Map.get_waypoint` does.
+    """
+
+    def __init__(self, samples, distance, wmap=None, waypoints=None):
+        """
+        :param samples: dictionary of arrays, see `sample_waypoints`
+        :param distance: distance between two samples of a lane, in meters
+        :param wmap: carla.Map the samples come from, needed to return carla.Waypoint
+        :param waypoints: carla.Waypoint of each sample, rebuilt from `wmap` when missing
+        """
+        self.samples = samples
+        self.distance = distance
+        self.map = wmap
+        self.waypoints = waypoints if waypoints is not None else [None] * len(samples["s"])
+        yaw = np.radians(samples["yaw"])
+        self.forward = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+        self.trees = {}
+
+    @classmethod
+    def from_map(cls, wmap, distance=DEFAULT_SAMPLING_DISTANCE):
+        samples, waypoints = sample_waypoints(wmap, distance)
+        return cls(samples, distance, wmap, waypoints)
+
+    def _get_tree(self, lane_type):
+        lane_type = int(lane_type)
+        if lane_type not in self.trees:
+            indices = np.flatnonzero(self.samples["lane_type"] & lane_type)
+            tree = cKDTree(self.samples["location"][indices, :2]) if len(indices) > 0 else None
+            self.trees[lane_type] = (tree, indices)
+        return self.trees[lane_type]
+
+    def query(self, locations, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """
+        Vectorized lookup of the nearest lane samples.
+
+            :param locations: array of shape (N, 3) (or (N, 2), then the height is ignored)
+            :param project_to_road: when False, locations outside every lane get no sample
+            :param lane_type: carla.LaneType (or a mask of them) to consider
+            :return: (sample index or -1, signed distance along the lane to the projection)
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(len(locations), -1)
+        matched = np.full(len(locations), -1, dtype=np.int64)
+        offsets = np.zeros(len(locations))
+        tree, indices = self._get_tree(lane_type)
+        if tree is None or len(locations) == 0:
+            return matched, offsets
+
+        k = min(NUM_CANDIDATES, len(indices))
+        _, candidates = tree.query(locations[:, :2], k=k)
+        candidates = indices[candidates.reshape(len(locations), k)]
+
+        delta = locations[:, None, :2] - self.samples["location"][candidates, :2]
+        forward = self.forward[candidates]
+        longitudinal = np.sum(delta * forward, axis=2)
+        lateral = np.abs(delta[..., 0] * forward[..., 1] - delta[..., 1] * forward[..., 0])
+        score = lateral**2
+        if locations.shape[1] > 2:
+            score = score + (locations[:, None, 2] - self.samples["location"][candidates, 2]) ** 2
+        # A sample only covers the lane around it, the others are used if nothing covers it
+        score[np.abs(longitudinal) > 0.5 * self.distance + 1e-3] += np.inf
+        best = np.argmin(score, axis=1)
+        uncovered = ~np.isfinite(score[np.arange(len(locations)), best])
+        best[uncovered] = 0
+
+        rows = np.arange(len(locations))
+        matched[:] = candidates[rows, best]
+        offsets[:] = longitudinal[rows, best]
+        if not project_to_road:
+            inside = lateral[rows, best] <= 0.5 * self.samples["lane_width"][matched]
+            inside &= np.abs(offsets) <= self.distance
+            matched[~inside] = -1
+        return matched, offsets
+
+    def get_sample_waypoint(self, index):
+        waypoint = self.waypoints[index]
+        if waypoint is None:
+            waypoint = self.map.get_waypoint_xodr(
+                int(self.samples["road_id"][index]),
+                int(self.samples["lane_id"][index]),
+                float(self.samples["s"][index]),
+            )
+            self.waypoints[index] = waypoint
+        return waypoint
+
+    def _to_waypoint(self, index, offset):
+        if index < 0:
+            return None
+        waypoint = self.get_sample_waypoint(index)
+        if waypoint is None or abs(offset) < 1e-2:
+            return waypoint
+        # The s of the lane grows against the driving direction on the left lanes
+        s = waypoint.s + (offset if waypoint.lane_id < 0 else -offset)
+        projected = self.map.get_waypoint_xodr(waypoint.road_id, waypoint.lane_id, s)
+        if projected is None or projected.section_id != waypoint.section_id:
+            return waypoint
+        return projected
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """Same as `carla.Map.get_waypoint`, without the call to the map"""
+        matched, offsets = self.query(
+            [[location.x, location.y, location.z]], project_to_road, lane_type
+        )
+        return self._to_waypoint(matched[0], offsets[0])
+
+    def get_waypoints(self, locations, project_to_road=True, lane_type=carla.LaneType.Driving):
+        """Batched `get_waypoint` for a list of carla.Location"""
+        matched, offsets = self.query(
+            [[location.x, location.y, location.z] for location in locations],
+            project_to_road,
+            lane_type,
+        )
+        return [self._to_waypoint(index, offset) for index, offset in zip(matched, offsets)]
+
+
+def check_against_dump(service, reference, lane_type=carla.LaneType.Driving):
+    """
+    Compares the lane ids returned by the service with a reference dump, typically
+    `sample_waypoints` of the same map with a finer distance, without any simulator.
+
+        :param service: NearestLaneService to check
+        :param reference: samples dictionary, e.g. the first item of `load_waypoint_dump`
+        :return: dictionary with the ratio of matching (road_id, lane_id) and the mean and
+            max distance between the reference samples and their matched samples
+    """
+    selected = np.flatnonzero(reference["lane_type"] & int(lane_type))
+    matched, _ = service.query(reference["location"][selected], True, lane_type)
+    # -1 when no sample of the lane type was found, which counts as a wrong lane
+    found = matched >= 0
+    matched, selected = matched[found], selected[found]
+    same_lane = (service.samples["road_id"][matched] == reference["road_id"][selected]) & (
+        service.samples["lane_id"][matched] == reference["lane_id"][selected]
+    )
+    errors = np.linalg.norm(
+        service.samples["location"][matched, :2] - reference["location"][selected, :2], axis=1
+    )
+    return {
+        "num_queries": len(found),
+        "lane_accuracy": float(np.sum(same_lane) / len(found)) if len(found) > 0 else 1.0,
+        "mean_distance": float(np.mean(errors)) if len(errors) > 0 else 0.0,
+        "max_distance": float(np.max(errors)) if len(errors) > 0 else 0.0,
+    }
+
+
+def set_nearest_lane_cache_dir(cache_dir):
+    """
+    Sets the folder where the lane samples of each map are stored, so that a new process
+    can build its service without sampling the map again. `None` disables it.
+    """
+    global _SERVICE_CACHE_DIR
+    _SERVICE_CACHE_DIR = cache_dir
+
+
+def get_nearest_lane_service(wmap, distance=DEFAULT_SAMPLING_DISTANCE, cache_dir=None):
+    """
+    Returns the NearestLaneService shared by the whole process for the given map and
+    sampling distance, sampling the map only the first time it is requested.
+
+        :param wmap: carla.Map instance
+        :param distance: distance between two samples of a lane, in meters
+        :param cache_dir: folder of the sample dumps, defaults to `set_nearest_lane_cache_dir`
+    """
+    key = (wmap.name, float(distance))
+    if key in _SERVICE_REGISTRY:
+        return _SERVICE_REGISTRY[key]
+
+    cache_dir = cache_dir if cache_dir is not None else _SERVICE_CACHE_DIR
+    service = None
+    if cache_dir is not None:
+        map_name = wmap.name.rsplit("/", 1)[-1]
+        cache_path = os.path.join(cache_dir, f"lanes_{map_name}_{float(distance)}.npz")
+        opendrive_hash = _opendrive_hash(wmap)
+        if os.path.exists(cache_path):
+            samples, _, saved_hash = load_waypoint_dump(cache_path)
+            if saved_hash == opendrive_hash:
+                service = NearestLaneService(samples, distance, wmap)
+
+    if service is None:
+        service = NearestLaneService.from_map(wmap, distance)
+        if cache_dir is not None:
+            save_waypoint_dump(cache_path, service.samples, distance, opendrive_hash)
+    _SERVICE_REGISTRY[key] = service
+    return service
+
+
+def clear_nearest_lane_services():
+    """Drops every service of the registry, e.g. after the maps have been changed"""
+    _SERVICE_REGISTRY.clear()
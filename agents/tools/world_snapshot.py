@@ -0,0 +1,200 @@
+"""Module caching the state of every actor of the world once per tick, for all the agents."""
+
+import fnmatch
+
+import carla
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+_SNAPSHOT_REGISTRY = {}
+
+
+class WorldSnapshot(object):
+    """
+    State of the actors at one frame, stored in NumPy arrays indexed like `ids`:
+    - location (N, 3), rotation (N, 3) as pitch / yaw / roll in degrees, velocity (N, 3)
+    - extent (N, 3) and bounding box center (N, 3) in the actor frame, zeros when unknown
+    - type_ids, the blueprint id of each actor
+
+    Positions and velocities come from `world.get_snapshot()`. The type ids, bounding boxes
+    and actor handles do not change during the life of an actor, so they are kept between
+    frames and only the actors appearing in a frame are fetched, with one `get_actors` call.
+    The bounding boxes of the frame are put in a STRtree on first use, see `query_obstacles`.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.location = np.zeros((0, 3))
+        self.rotation = np.zeros((0, 3))
+        self.velocity = np.zeros((0, 3))
+        self.extent = np.zeros((0, 3))
+        self.center = np.zeros((0, 3))
+        self.type_ids = []
+        self.actors = {}  # id -> carla.Actor
+        self.static_info = {}  # id -> (type_id, extent, center)
+        self.id_to_index = {}
+        self.filter_cache = {}
+        self.obstacle_tree = None
+        self.obstacle_indices = None
+
+    def update(self, world):
+        """Refreshes the arrays if the world has moved to another frame since the last update"""
+        snapshot = world.get_snapshot()
+        if snapshot.frame == self.frame:
+            return self
+
+        actor_snapshots = {actor_snapshot.id: actor_snapshot for actor_snapshot in snapshot}
+        ids = list(actor_snapshots)
+        new_ids = [actor_id for actor_id in ids if actor_id not in self.static_info]
+        if len(new_ids) > 0:
+            for actor in world.get_actors(new_ids):
+                bounding_box = getattr(actor, "bounding_box", None)
+                if bounding_box is None:
+                    extent, center = (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+                else:
+                    extent = (bounding_box.extent.x, bounding_box.extent.y, bounding_box.extent.z)
+                    center = (
+                        bounding_box.location.x,
+                        bounding_box.location.y,
+                        bounding_box.location.z,
+                    )
+                self.actors[actor.id] = actor
+                self.static_info[actor.id] = (actor.type_id, extent, center)
+        # Forget the destroyed actors, and the ones the server did not return
+        ids = [actor_id for actor_id in ids if actor_id in self.static_info]
+        alive = set(ids)
+        for actor_id in list(self.static_info):
+            if actor_id not in alive:
+                del self.static_info[actor_id]
+                self.actors.pop(actor_id, None)
+
+        num_actors = len(ids)
+        self.location = np.zeros((num_actors, 3))
+        self.rotation = np.zeros((num_actors, 3))
+        self.velocity = np.zeros((num_actors, 3))
+        for index, actor_id in enumerate(ids):
+            actor_snapshot = actor_snapshots[actor_id]
+            transform = actor_snapshot.get_transform()
+            velocity = actor_snapshot.get_velocity()
+            self.location[index] = (
+                transform.location.x,
+                transform.location.y,
+                transform.location.z,
+            )
+            self.rotation[index] = (
+                transform.rotation.pitch,
+                transform.rotation.yaw,
+                transform.rotation.roll,
+            )
+            self.velocity[index] = (velocity.x, velocity.y, velocity.z)
+
+        self.frame = snapshot.frame
+        self.ids = np.array(ids, dtype=np.int64)
+        self.type_ids = [self.static_info[actor_id][0] for actor_id in ids]
+        self.extent = np.array(
+            [self.static_info[actor_id][1] for actor_id in ids], dtype=np.float64
+        ).reshape(-1, 3)
+        self.center = np.array(
+            [self.static_info[actor_id][2] for actor_id in ids], dtype=np.float64
+        ).reshape(-1, 3)
+        self.id_to_index = {actor_id: index for index, actor_id in enumerate(ids)}
+        self.filter_cache = {}
+        self.obstacle_tree = None
+        self.obstacle_indices = None
+        return self
+
+    def filter(self, wildcard_pattern):
+        """Indices of the actors whose type id matches the pattern, like `ActorList.filter`"""
+        if wildcard_pattern not in self.filter_cache:
+            self.filter_cache[wildcard_pattern] = np.array(
+                [
+                    index
+                    for index, type_id in enumerate(self.type_ids)
+                    if fnmatch.fnmatchcase(type_id, wildcard_pattern)
+                ],
+                dtype=np.int64,
+            )
+        return self.filter_cache[wildcard_pattern]
+
+    def index_of(self, actor_id):
+        return self.id_to_index.get(actor_id)
+
+    def get_actor(self, index):
+        return self.actors[int(self.ids[index])]
+
+    def get_actors(self, indices):
+        return [self.get_actor(index) for index in indices]
+
+    def get_location(self, index):
+        return carla.Location(*self.location[index])
+
+    def get_transform(self, index):
+        pitch, yaw, roll = self.rotation[index]
+        return carla.Transform(
+            carla.Location(*self.location[index]),
+            carla.Rotation(pitch=pitch, yaw=yaw, roll=roll),
+        )
+
+    def get_speed(self, index):
+        """Speed of the actor in Km/h, like `agents.tools.misc.get_speed`"""
+        return 3.6 * float(np.linalg.norm(self.velocity[index]))
+
+    def distances_to(self, location, indices):
+        """3D distances between the actors at `indices` and a carla.Location"""
+        return np.linalg.norm(
+            self.location[indices] - np.array([location.x, location.y, location.z]), axis=1
+        )
+
+    def get_bounding_box_polygons(self, indices):
+        """Shapely polygons of the bottom faces of the bounding boxes at `indices`"""
+        indices = np.asarray(indices, dtype=np.int64)
+        yaw = np.radians(self.rotation[indices, 1])
+        forward = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+        right = np.stack([-np.sin(yaw), np.cos(yaw)], axis=1)
+        center = (
+            self.location[indices, :2]
+            + self.center[indices, 0:1] * forward
+            + self.center[indices, 1:2] * right
+        )
+        along = self.extent[indices, 0:1] * forward
+        across = self.extent[indices, 1:2] * right
+        corners = np.stack(
+            [
+                center + along + across,
+                center + along - across,
+                center - along - across,
+                center - along + across,
+            ],
+            axis=1,
+        )
+        return shapely.polygons(corners)
+
+    def query_obstacles(self, polygon):
+        """
+        Indices of the actors whose bounding box intersects `polygon`, in index order.
+        Only the actors having a bounding box are considered, and the tree is built once
+        per frame, so each query costs O(log N + k) for k hits.
+        """
+        if self.obstacle_tree is None:
+            self.obstacle_indices = np.flatnonzero(np.all(self.extent[:, :2] > 0, axis=1))
+            self.obstacle_tree = STRtree(self.get_bounding_box_polygons(self.obstacle_indices))
+        shapely.prepare(polygon)
+        hits = self.obstacle_tree.query(polygon, predicate="intersects")
+        return np.sort(self.obstacle_indices[hits])
+
+
+def get_world_snapshot(world):
+    """
+    Returns the WorldSnapshot of the current frame of `world`, shared by the whole process,
+    so that the actors are read once per tick whatever the number of agents.
+    """
+    if world.id not in _SNAPSHOT_REGISTRY:
+        _SNAPSHOT_REGISTRY[world.id] = WorldSnapshot()
+    return _SNAPSHOT_REGISTRY[world.id].update(world)
+
+
+def clear_world_snapshots():
+    """Drops the snapshots of every world, e.g. after the world has been reloaded"""
+    _SNAPSHOT_REGISTRY.clear()
@@ -1,12 +1,18 @@
 import glob
+import hashlib
 import os
 import pickle
 import random
 from typing import List
 
+import networkx as nx
+
 from .graph_utils import create_graph_from_files
+from .opendrive_geometry import OpenDriveGeometry
+from .road_index import RoadAttributeIndex
 
 REMOVE_NODE_WITH_LESS_POINTS = 6
+GRAPH_CACHE_VERSION = 2
 
 
 def format_town_name(town_name):
@@ -14,25 +20,155 @@ def format_town_name(town_name):
     return f"Town{town_num.zfill(2)}"
 
 
+def hash_file(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_lane_info(right_waypoints, left_waypoints, direction):
+    """Whether the `direction` side of a road has an opposite side, and how many points its second
+    lane (the first one if it has a single lane) has. None when that side has no driving point.
+
+    The points are either `carla.Waypoint`s or `LanePoint`s, only `lane_id` is read.
+    """
+    search_waypoints = right_waypoints if direction == "right" else left_waypoints
+    opposite_waypoints = left_waypoints if direction == "right" else right_waypoints
+    if len(search_waypoints) == 0:
+        return None
+    unique_lane_id = list(sorted(set(waypoint.lane_id for waypoint in search_waypoints)))
+    lane_id = unique_lane_id[1] if len(unique_lane_id) > 1 else unique_lane_id[0]
+    return {
+        "have_opposite": len(opposite_waypoints) > 0,
+        "num_of_waypoints": len(
+            [waypoint for waypoint in search_waypoints if waypoint.lane_id == lane_id]
+        ),
+    }
+
+
+def shift_town_graph(graph, junction_dict, offset):
+    """Move the node ids of a single town graph by `offset`, including the ids stored as attributes"""
+    graph = nx.relabel_nodes(graph, lambda node_id: node_id + offset, copy=True)
+    for _, node in graph.nodes(data=True):
+        for key in ("predecessor", "successor"):
+            if node[key] is not None:
+                node[key] += offset
+    junction_dict = {
+        junction_id: {
+            connection_id: (incoming_road + offset, connecting_road + offset, contact_point)
+            for connection_id, (
+                incoming_road,
+                connecting_road,
+                contact_point,
+            ) in connections.items()
+        }
+        for junction_id, connections in junction_dict.items()
+    }
+    return graph, junction_dict
+
+
 class GraphManager:
-    def __init__(self, input_folder, use_cache=False, cache_dir=None):
+    """Road graph of the towns in `input_folder`.
 
-        if (
-            use_cache
-            and cache_dir is not None
-            and os.path.exists(os.path.join(cache_dir, "graph.pkl"))
-        ):
-            with open(os.path.join(cache_dir, "graph.pkl"), "rb") as f:
-                self.graph, self.large_junction_dict = pickle.load(f)
-            self.road_compute = False
-        else:
-            self.graph, self.large_junction_dict = create_graph_from_files(
-                glob.glob(os.path.join(input_folder, "*.xodr"))
-            )
-            self.road_compute = True
+    Each town is cached as `{cache_dir}/{town_name}.pkl`, together with the SHA-256 of its .xodr
+    file and `GRAPH_CACHE_VERSION`, so only the towns whose map changed are parsed again. Towns are
+    merged into `self.graph` when requested with `load_towns`, by default all of them.
+    """
+
+    def __init__(self, input_folder, use_cache=False, cache_dir=None, towns=None):
         self.use_cache = use_cache
         self.cache_dir = cache_dir
         self.town_name = None
+        self.town_files = {
+            os.path.basename(file_path).split(".")[0]: file_path
+            for file_path in glob.glob(os.path.join(input_folder, "*.xodr"))
+        }
+        self.town_hash = {}
+        self.town_nodes = {}  # town name -> (offset, number of nodes)
+        self.town_to_compute = set()
+        self.town_geometry = {}
+        # town name -> [(node idx, direction, num of waypoints, middle lane point)] that still need
+        # the turn directions from CARLA
+        self.town_direction_queries = {}
+
+        self.graph = nx.DiGraph()
+        self.large_junction_dict = {}
+        self.load_towns(sorted(self.town_files) if towns is None else towns)
+
+    @property
+    def road_compute(self):
+        return len(self.town_to_compute) > 0
+
+    def get_cache_path(self, town_name):
+        return os.path.join(self.cache_dir, f"{town_name}.pkl")
+
+    def load_town_cache(self, town_name):
+        if not self.use_cache or self.cache_dir is None:
+            return None
+        cache_path = self.get_cache_path(town_name)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        if (
+            cache.get("version") != GRAPH_CACHE_VERSION
+            or cache.get("xodr_hash") != self.town_hash[town_name]
+        ):
+            return None
+        return cache["graph"], cache["junction_dict"]
+
+    def save_town_cache(self, town_name):
+        offset, number_of_nodes = self.town_nodes[town_name]
+        town_node_ids = range(offset, offset + number_of_nodes)
+        graph = nx.DiGraph()
+        graph.add_nodes_from((node_id, self.graph.nodes[node_id]) for node_id in town_node_ids)
+        graph.add_edges_from(self.graph.edges(town_node_ids, data=True))
+        graph, junction_dict = shift_town_graph(graph, self.large_junction_dict[town_name], -offset)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.get_cache_path(town_name), "wb") as f:
+            pickle.dump(
+                {
+                    "version": GRAPH_CACHE_VERSION,
+                    "xodr_hash": self.town_hash[town_name],
+                    "graph": graph,
+                    "junction_dict": junction_dict,
+                },
+                f,
+            )
+
+    def load_towns(self, town_names):
+        """Merge the given towns into the graph, reading the cache or parsing the .xodr files"""
+        new_towns = [
+            town_name
+            for town_name in town_names
+            if town_name not in self.town_nodes and town_name in self.town_files
+        ]
+        if len(new_towns) == 0:
+            return
+
+        missing_towns = []
+        town_graphs = {}
+        for town_name in new_towns:
+            self.town_hash[town_name] = hash_file(self.town_files[town_name])
+            cache = self.load_town_cache(town_name)
+            if cache is None:
+                missing_towns.append(town_name)
+            else:
+                town_graphs[town_name] = cache
+
+        for town_name in missing_towns:
+            graph, large_junction_dict = create_graph_from_files([self.town_files[town_name]])
+            town_graphs[town_name] = (graph, large_junction_dict[town_name])
+
+        for town_name in new_towns:
+            offset = self.graph.number_of_nodes()
+            graph, junction_dict = shift_town_graph(*town_graphs[town_name], offset)
+            self.graph.update(graph)
+            self.large_junction_dict[town_name] = junction_dict
+            self.town_nodes[town_name] = (offset, graph.number_of_nodes())
+        for town_name in missing_towns:
+            self.compute_lane_info(town_name)
+            self.town_to_compute.add(town_name)
+        self.road_index = RoadAttributeIndex(self.graph)
 
     def get_node_info(self, town_name, road_id):
         for _, node in self.graph.nodes(data=True):
@@ -40,72 +176,92 @@ class GraphManager:
                 return node
         return None
 
-    def get_intersection_info(self, client, vehicle_manager):
-        if not self.road_compute:
-            return
-        town_name_to_road_indices = {}
+    def get_town_geometry(self, town_name):
+        if town_name not in self.town_geometry:
+            self.town_geometry[town_name] = OpenDriveGeometry(self.town_files[town_name])
+        return self.town_geometry[town_name]
+
+    def compute_lane_info(self, town_name):
+        """Fill the lane counts and `have_opposite` of a town offline.
+
+        The driving points come from the OpenDRIVE geometry instead of the CARLA map, so only the
+        turn directions are left to `get_intersection_info`.
+        """
+        town_geometry = self.get_town_geometry(town_name)
+        offset, number_of_nodes = self.town_nodes[town_name]
+        direction_queries = []
         node_idx_to_remove = []
-        for node_idx, node in self.graph.nodes(data=True):
+        for node_idx in range(offset, offset + number_of_nodes):
+            node = self.graph.nodes[node_idx]
             if node["is_junction"]:
                 node_idx_to_remove.append(node_idx)
                 continue
-            town_name = node["town_name"]
-            if town_name not in town_name_to_road_indices:
-                town_name_to_road_indices[town_name] = []
+            road_id = int(node["road_id"])
+            directions = []
             if node["number_of_right_lane"] > 0:
-                town_name_to_road_indices[town_name].append(
-                    (int(node["road_id"]), node_idx, "right")
-                )
+                directions.append("right")
             if node["number_of_left_lane"] > 0:
-                town_name_to_road_indices[town_name].append(
-                    (int(node["road_id"]), node_idx, "left")
-                )
-
-        for town in town_name_to_road_indices:
-            client.load_map(format_town_name(town))
-            for road_id, node_idx, direction in town_name_to_road_indices[town]:
-                # Sample point from the road with road id
-                right_waypoints, left_waypoints = (
-                    vehicle_manager.world_manager.get_left_right_driving_points(road_id)
-                )
-                if direction == "left" and len(left_waypoints) == 0:
-                    print(f"{road_id} {town} {direction}")
-                    self.graph.nodes[node_idx]["number_of_left_lane"] = 0
+                directions.append("left")
+            # Sample point from the road with road id
+            right_waypoints, left_waypoints = town_geometry.get_left_right_driving_points(road_id)
+            for direction in directions:
+                lane_info = get_lane_info(right_waypoints, left_waypoints, direction)
+                if lane_info is None:
+                    print(f"{road_id} {town_name} {direction}")
+                    node[f"number_of_{direction}_lane"] = 0
                     continue
-                elif direction == "right" and len(right_waypoints) == 0:
-                    print(f"{road_id} {town} {direction}")
-                    self.graph.nodes[node_idx]["number_of_right_lane"] = 0
-                    continue
-
-                if (direction == "right" and len(left_waypoints) > 0) or (
-                    direction == "left" and len(right_waypoints) > 0
-                ):
-                    self.graph.nodes[node_idx][f"{direction}_extra"]["have_opposite"] = True
 
-                search_waypoints = right_waypoints if direction == "right" else left_waypoints
-                unique_lane_id = set()
-                for waypoint in search_waypoints:
-                    unique_lane_id.add(waypoint.lane_id)
-                unique_lane_id = list(sorted(unique_lane_id))
-                lane_id = unique_lane_id[1] if len(unique_lane_id) > 1 else unique_lane_id[0]
-
-                num_of_waypoints = len(
-                    [waypoint for waypoint in search_waypoints if waypoint.lane_id == lane_id]
-                )
+                if lane_info["have_opposite"]:
+                    node[f"{direction}_extra"]["have_opposite"] = True
 
+                num_of_waypoints = lane_info["num_of_waypoints"]
                 if num_of_waypoints < REMOVE_NODE_WITH_LESS_POINTS:
-                    self.graph.nodes[node_idx][f"number_of_{direction}_lane"] = 0
-                    if (
-                        self.graph.nodes[node_idx]["number_of_right_lane"] == 0
-                        and self.graph.nodes[node_idx]["number_of_left_lane"] == 0
-                    ):
+                    node[f"number_of_{direction}_lane"] = 0
+                    if node["number_of_right_lane"] == 0 and node["number_of_left_lane"] == 0:
                         node_idx_to_remove.append(node_idx)
                     continue
 
-                search_waypoints.sort(key=lambda x: x.s)
-                direction_dict = vehicle_manager.get_left_straight_right(
-                    search_waypoints[len(search_waypoints) // 2]
+                search_waypoints = sorted(
+                    right_waypoints if direction == "right" else left_waypoints,
+                    key=lambda x: x.s,
+                )
+                direction_queries.append(
+                    (
+                        node_idx,
+                        direction,
+                        num_of_waypoints,
+                        search_waypoints[len(search_waypoints) // 2],
+                    )
+                )
+
+        # self.graph.remove_nodes_from(node_idx_to_remove)
+        self.town_direction_queries[town_name] = direction_queries
+
+    def get_intersection_info(self, client, vehicle_manager):
+        """Fill the turn directions of the new towns, which needs the CARLA map of each town"""
+        if not self.road_compute:
+            return
+        for town in sorted(self.town_to_compute):
+            # A town merged on request by `CarlaClient.set_manager` is already the loaded one
+            if (
+                client.world is None
+                or client.world.get_map().name.rsplit("/", 1)[-1] != format_town_name(town)
+            ):
+                client.load_map(format_town_name(town))
+            world_manager = vehicle_manager.world_manager
+            for (
+                node_idx,
+                direction,
+                num_of_waypoints,
+                lane_point,
+            ) in self.town_direction_queries.pop(town):
+                # the waypoint of the lane itself, projecting x, y may snap to another lane
+                waypoint = world_manager.get_waypoint_from_road_lane_s(
+                    lane_point.road_id, lane_point.lane_id, lane_point.s
                 )
+                if waypoint is None:
+                    continue
+                direction_dict = vehicle_manager.get_left_straight_right(waypoint)
                 if direction_dict is None:
                     continue
                 self.graph.nodes[node_idx][f"{direction}_extra"]["can_turn_left"] = (
@@ -130,12 +286,11 @@ class GraphManager:
                     "num_of_waypoints"
                 ] = num_of_waypoints
 
-        # self.graph.remove_nodes_from(node_idx_to_remove)
         if self.use_cache and self.cache_dir is not None:
-            os.makedirs(self.cache_dir, exist_ok=True)
-            with open(os.path.join(self.cache_dir, "graph.pkl"), "wb") as f:
-                pickle.dump((self.graph, self.large_junction_dict), f)
-        self.road_compute = False
+            for town_name in self.town_to_compute:
+                self.save_town_cache(town_name)
+        self.town_to_compute.clear()
+        self.road_index = RoadAttributeIndex(self.graph)
 
     def set_town_name(self, town_name):
         self.town_name = town_name
@@ -0,0 +1,299 @@
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import numpy as np
+
+# Same as `misc.constant.DISTANCE_FOR_ROUTE`, which the waypoint index samples the roads with
+DEFAULT_SAMPLING_DISTANCE = 2.0
+# CARLA starts and stops sampling a road at this distance from its ends
+EPSILON = 10.0 * np.finfo(np.float64).eps
+# Step used to integrate the curves that have no closed form (spiral, poly3, paramPoly3)
+INTEGRATION_STEP = 0.05
+
+# A sampled point in the CARLA frame (y and yaw are mirrored from OpenDRIVE), yaw in degrees
+LanePoint = namedtuple("LanePoint", ["road_id", "section_id", "lane_id", "s", "x", "y", "yaw"])
+
+
+def polynomial(coefficients, ds):
+    a, b, c, d = coefficients
+    return a + ds * (b + ds * (c + ds * d))
+
+
+def polynomial_derivative(coefficients, ds):
+    _, b, c, d = coefficients
+    return b + ds * (2 * c + ds * 3 * d)
+
+
+def read_coefficients(element, names=("a", "b", "c", "d")):
+    return tuple(float(element.get(name, 0.0)) for name in names)
+
+
+def evaluate_piecewise(records, s):
+    """Evaluate a list of (start s, coefficients) polynomials, each valid until the next start"""
+    s = np.asarray(s, dtype=np.float64)
+    if len(records) == 0:
+        return np.zeros_like(s)
+    starts = np.array([start for start, _ in records])
+    record_idx = np.clip(np.searchsorted(starts, s, side="right") - 1, 0, len(records) - 1)
+    values = np.empty_like(s)
+    for idx in np.unique(record_idx):
+        mask = record_idx == idx
+        start, coefficients = records[idx]
+        values[mask] = polynomial(coefficients, s[mask] - start)
+    return values
+
+
+class PlanViewGeometry:
+    """One `<geometry>` record of a road reference line.
+
+    `evaluate(ds)` returns the OpenDRIVE x, y and heading (radians) at the distances `ds` from the
+    start of the record. Lines and arcs have a closed form; spirals, poly3 and paramPoly3 are
+    integrated on a fine grid and reparametrized by arc length, as CARLA does.
+    """
+
+    def __init__(self, element):
+        self.s = float(element.get("s"))
+        self.x = float(element.get("x"))
+        self.y = float(element.get("y"))
+        self.hdg = float(element.get("hdg"))
+        self.length = float(element.get("length"))
+
+        shape = element[0]
+        self.kind = shape.tag
+        if self.kind == "line":
+            pass
+        elif self.kind == "arc":
+            self.curvature = float(shape.get("curvature"))
+        elif self.kind == "spiral":
+            self.curv_start = float(shape.get("curvStart"))
+            self.curv_end = float(shape.get("curvEnd"))
+            self.build_spiral()
+        elif self.kind == "poly3":
+            # v(u) in the local frame, sampled over u until the arc length is reached
+            coefficients = read_coefficients(shape)
+            self.build_parametric(
+                (0.0, 1.0, 0.0, 0.0), coefficients, max_p=self.length, grow_until_length=True
+            )
+        elif self.kind == "paramPoly3":
+            u_coefficients = read_coefficients(shape, ("aU", "bU", "cU", "dU"))
+            v_coefficients = read_coefficients(shape, ("aV", "bV", "cV", "dV"))
+            max_p = 1.0 if shape.get("pRange") == "normalized" else self.length
+            self.build_parametric(u_coefficients, v_coefficients, max_p=max_p)
+        else:
+            raise ValueError(f"Unsupported geometry type: {self.kind}")
+
+    def build_spiral(self):
+        ds = np.linspace(0.0, self.length, max(2, int(np.ceil(self.length / INTEGRATION_STEP)) + 1))
+        rate = (self.curv_end - self.curv_start) / self.length if self.length > 0 else 0.0
+        heading = self.curv_start * ds + 0.5 * rate * ds**2
+        self.table_ds = ds
+        self.table_u = cumulative_trapezoid(np.cos(heading), ds)
+        self.table_v = cumulative_trapezoid(np.sin(heading), ds)
+        self.table_heading = heading
+
+    def build_parametric(self, u_coefficients, v_coefficients, max_p, grow_until_length=False):
+        num = max(2, int(np.ceil(self.length / INTEGRATION_STEP)) + 1)
+        while True:
+            p = np.linspace(0.0, max_p, num)
+            du = polynomial_derivative(u_coefficients, p)
+            dv = polynomial_derivative(v_coefficients, p)
+            arc_length = cumulative_trapezoid(np.hypot(du, dv), p)
+            # A poly3 is given in u, whose range is only bounded by the length of the record
+            if not grow_until_length or arc_length[-1] >= self.length or max_p > 4 * self.length:
+                break
+            max_p *= 2
+            num *= 2
+        self.table_ds = arc_length
+        self.table_u = polynomial(u_coefficients, p)
+        self.table_v = polynomial(v_coefficients, p)
+        self.table_heading = np.unwrap(np.arctan2(dv, du))
+
+    def evaluate(self, ds):
+        ds = np.clip(np.asarray(ds, dtype=np.float64), 0.0, self.length)
+        cos_hdg, sin_hdg = np.cos(self.hdg), np.sin(self.hdg)
+        if self.kind == "line":
+            return self.x + ds * cos_hdg, self.y + ds * sin_hdg, np.full_like(ds, self.hdg)
+        if self.kind == "arc":
+            k = self.curvature
+            if abs(k) < 1e-12:
+                return self.x + ds * cos_hdg, self.y + ds * sin_hdg, np.full_like(ds, self.hdg)
+            heading = self.hdg + k * ds
+            x = self.x + (np.sin(heading) - sin_hdg) / k
+            y = self.y + (cos_hdg - np.cos(heading)) / k
+            return x, y, heading
+
+        u = np.interp(ds, self.table_ds, self.table_u)
+        v = np.interp(ds, self.table_ds, self.table_v)
+        heading = self.hdg + np.interp(ds, self.table_ds, self.table_heading)
+        x = self.x + u * cos_hdg - v * sin_hdg
+        y = self.y + u * sin_hdg + v * cos_hdg
+        return x, y, heading
+
+
+def cumulative_trapezoid(values, grid):
+    result = np.zeros_like(grid)
+    result[1:] = np.cumsum(0.5 * (values[1:] + values[:-1]) * np.diff(grid))
+    return result
+
+
+class RoadGeometry:
+    """Reference line, lane offset and lane sections of one `<road>` element.
+
+    The lane sections are lists of `{"s", "end", "lanes"}` where `lanes` maps the lane id to its
+    type and `<width>` polynomials (relative to the start of the section).
+    """
+
+    def __init__(self, road):
+        self.road_id = int(road.get("id"))
+        self.length = float(road.get("length"))
+        self.is_junction = road.get("junction") != "-1"
+        self.geometries = sorted(
+            (PlanViewGeometry(geometry) for geometry in road.findall("planView/geometry")),
+            key=lambda geometry: geometry.s,
+        )
+        self.geometry_starts = np.array([geometry.s for geometry in self.geometries])
+        self.lane_offsets = [
+            (float(offset.get("s")), read_coefficients(offset))
+            for offset in road.findall("lanes/laneOffset")
+        ]
+        self.lane_sections = []
+        for lane_section in road.findall("lanes/laneSection"):
+            lanes = {}
+            for lane in lane_section.findall("left/lane") + lane_section.findall("right/lane"):
+                lanes[int(lane.get("id"))] = {
+                    "type": lane.get("type"),
+                    "widths": [
+                        (float(width.get("sOffset")), read_coefficients(width))
+                        for width in lane.findall("width")
+                    ],
+                }
+            self.lane_sections.append({"s": float(lane_section.get("s")), "lanes": lanes})
+        for idx, lane_section in enumerate(self.lane_sections):
+            lane_section["end"] = (
+                self.lane_sections[idx + 1]["s"]
+                if idx + 1 < len(self.lane_sections)
+                else self.length
+            )
+        self.section_starts = np.array([lane_section["s"] for lane_section in self.lane_sections])
+
+    def get_section_indices(self, s):
+        return np.clip(
+            np.searchsorted(self.section_starts, s, side="right") - 1,
+            0,
+            len(self.lane_sections) - 1,
+        )
+
+    def reference_line(self, s):
+        s = np.asarray(s, dtype=np.float64)
+        geometry_idx = np.clip(
+            np.searchsorted(self.geometry_starts, s, side="right") - 1,
+            0,
+            len(self.geometries) - 1,
+        )
+        x, y, heading = np.empty_like(s), np.empty_like(s), np.empty_like(s)
+        for idx in np.unique(geometry_idx):
+            mask = geometry_idx == idx
+            geometry = self.geometries[idx]
+            x[mask], y[mask], heading[mask] = geometry.evaluate(s[mask] - geometry.s)
+        return x, y, heading
+
+    def lane_width(self, section_idx, lane_id, s):
+        lane_section = self.lane_sections[section_idx]
+        return evaluate_piecewise(lane_section["lanes"][lane_id]["widths"], s - lane_section["s"])
+
+    def lane_center_offset(self, section_idx, lane_id, s):
+        """Lateral offset t of the center of `lane_id` in the lane section at `s`"""
+        s = np.asarray(s, dtype=np.float64)
+        sign = 1 if lane_id > 0 else -1
+        t = evaluate_piecewise(self.lane_offsets, s)
+        for inner_id in range(sign, lane_id, sign):
+            t = t + sign * self.lane_width(section_idx, inner_id, s)
+        return t + sign * 0.5 * self.lane_width(section_idx, lane_id, s)
+
+    def lane_points(self, section_idx, lane_id, s):
+        """Lane center points at `s` as CARLA (x, y, yaw in degrees)"""
+        x, y, heading = self.reference_line(s)
+        t = self.lane_center_offset(section_idx, lane_id, s)
+        x = x - t * np.sin(heading)
+        y = y + t * np.cos(heading)
+        yaw = np.degrees(heading)
+        if lane_id > 0:
+            # Left lanes are driven against the reference line
+            yaw = yaw + 180.0
+        return x, -y, -yaw
+
+    def sample_driving_points(self, distance=DEFAULT_SAMPLING_DISTANCE):
+        """Driving lane points every `distance` meters, in the order of `Map.generate_waypoints`"""
+        s = np.arange(EPSILON, self.length - EPSILON, distance)
+        if len(s) == 0:
+            return []
+        section_indices = self.get_section_indices(s)
+        per_lane = {}
+        for section_idx in np.unique(section_indices):
+            section_s = s[section_indices == section_idx]
+            for lane_id, lane in self.lane_sections[section_idx]["lanes"].items():
+                if lane["type"] != "driving":
+                    continue
+                x, y, yaw = self.lane_points(section_idx, lane_id, section_s)
+                per_lane[(section_idx, lane_id)] = dict(zip(section_s, zip(x, y, yaw)))
+
+        points = []
+        for value, section_idx in zip(s, section_indices):
+            # CARLA visits the lanes of a section by increasing lane id
+            for lane_id in sorted(self.lane_sections[section_idx]["lanes"]):
+                if (section_idx, lane_id) not in per_lane:
+                    continue
+                x, y, yaw = per_lane[(section_idx, lane_id)][value]
+                points.append(
+                    LanePoint(
+                        self.road_id,
+                        int(section_idx),
+                        lane_id,
+                        float(value),
+                        float(x),
+                        float(y),
+                        float(yaw),
+                    )
+                )
+        return points
+
+
+class OpenDriveGeometry:
+    """Offline replacement of the CARLA map queries used to build the road graph.
+
+    `get_left_right_driving_points` mirrors `WorldManager.get_left_right_driving_points` and
+    returns `LanePoint`s instead of `carla.Waypoint`s. The points are not projected back to the
+    closest lane, which CARLA does through `Map.get_waypoint`, so they only differ from the live
+    ones where lanes of different roads overlap.
+    """
+
+    def __init__(self, file_path, distance=DEFAULT_SAMPLING_DISTANCE):
+        self.distance = distance
+        root = ET.parse(file_path).getroot()
+        self.roads = {}
+        for road in root.findall("road"):
+            road_geometry = RoadGeometry(road)
+            self.roads[road_geometry.road_id] = road_geometry
+        self.road_to_points = {}
+
+    def get_driving_points(self, road_id):
+        road_id = int(road_id)
+        if road_id not in self.road_to_points:
+            road = self.roads.get(road_id)
+            self.road_to_points[road_id] = (
+                [] if road is None else road.sample_driving_points(self.distance)
+            )
+        return self.road_to_points[road_id]
+
+    def get_left_right_driving_points(self, road_id):
+        if not isinstance(road_id, (list, tuple)):
+            road_id = [road_id]
+        right_driving_points = []
+        left_driving_points = []
+        for road in road_id:
+            for driving_point in self.get_driving_points(road):
+                if driving_point.lane_id < 0:
+                    right_driving_points.append(driving_point)
+                elif driving_point.lane_id > 0:
+                    left_driving_points.append(driving_point)
+        return right_driving_points, left_driving_points
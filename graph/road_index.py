@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+import networkx as nx
+
+SIDES = ("left", "right")
+
+
+def iterate_bits(mask):
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class RoadAttributeIndex:
+    """Inverted index from road attributes to the graph nodes having them.
+
+    Every non-junction node gets a position following the node order of the graph, and each
+    attribute is stored as a bitset (a Python int) over those positions, separately for the left
+    and the right side of the road:
+    - signals / objects: name -> nodes having it on that side ("t" < 0 is the right side)
+    - number_of_lane: number of driving lanes -> nodes
+
+    Junction nodes are not indexed since they are never retrieved. The `{side}_extra` flags are
+    not indexed either: `retrieve_roads` does not filter on them, they are only returned with each
+    match and scored by the caller.
+    """
+
+    def __init__(self, graph: nx.DiGraph):
+        self.node_ids = []
+        self.signals = {side: defaultdict(int) for side in SIDES}
+        self.objects = {side: defaultdict(int) for side in SIDES}
+        self.number_of_lane = {side: defaultdict(int) for side in SIDES}
+
+        for node_id, node_info in graph.nodes(data=True):
+            if node_info["is_junction"]:
+                continue
+            bit = 1 << len(self.node_ids)
+            self.node_ids.append(node_id)
+            for attribute in ("signals", "objects"):
+                for target in node_info[attribute]:
+                    side = "right" if target["t"] < 0 else "left"
+                    getattr(self, attribute)[side][target["name"]] |= bit
+            for side in SIDES:
+                self.number_of_lane[side][node_info[f"number_of_{side}_lane"]] |= bit
+
+    def any_of(self, attribute, side, names):
+        """Nodes having at least one of `names` on the given side"""
+        table = getattr(self, attribute)[side]
+        mask = 0
+        for name in names:
+            mask |= table.get(name, 0)
+        return mask
+
+    def at_least_lanes(self, side, number_of_lane):
+        mask = 0
+        for count, nodes in self.number_of_lane[side].items():
+            if count >= number_of_lane:
+                mask |= nodes
+        return mask
@@ -30,6 +30,10 @@ class CyclistManager:
         self.agent_model_manager = agent_model_manager
         self.world_manager = world_manager
         self.graph_manager = graph_manager
+        self.reset()
+
+    def reset(self):
+        """Forget the agents of the previous scene, their actors must be destroyed already"""
         self.cyclists = []
         self.cyclist_agent = []
         self.front_pos_id_to_waypoint = {}
@@ -48,8 +52,8 @@ class CyclistManager:
         move_one_more_forward = waypoint.next(DISTANCE_FOR_ROUTE)
         if move_one_more_forward is None or len(move_one_more_forward) == 0:
             return None
-        move_one_more_forward = self.world_manager.map.get_waypoint(
-            move_one_more_forward[0].transform.location
+        move_one_more_forward = self.world_manager.get_waypoint_from_location(
+            move_one_more_forward[0].transform.location, carla.LaneType.Driving
         )
         previous_vector = make_vector(waypoint, move_one_more_forward)
         if not move_one_more_forward.is_junction:
@@ -178,12 +182,15 @@ class CyclistManager:
         new_spawn_point = carla.Transform(
             spawn_point.transform.location + carla.Location(z=2), spawn_point.transform.rotation
         )
-        cyclist = self.world_manager.spawn_actor(cyclist_bp, new_spawn_point)
 
-        if cyclist is not None:
+        def on_spawn(cyclist):
             self.cyclists.append(cyclist)
-            agent = self.create_cyclist_agent(cyclist, agent, ego_agent, ego_car_point, spawn_point)
-            self.cyclist_agent.append(agent)
+            cyclist_agent = self.create_cyclist_agent(
+                cyclist, agent, ego_agent, ego_car_point, spawn_point
+            )
+            self.cyclist_agent.append(cyclist_agent)
+
+        self.world_manager.spawn_actor_later(cyclist_bp, new_spawn_point, on_spawn)
 
     def check_cyclist_spawn_type(self, waypoint, target_road_type=None):
         for road_type in ["Sidewalk", "Shoulder", "Driving"]:
@@ -32,6 +32,10 @@ class PedestrianManager:
     ):
         self.agent_model_manager = agent_model_manager
         self.world_manager = world_manager
+        self.reset()
+
+    def reset(self):
+        """Forget the agents of the previous scene, their actors must be destroyed already"""
         self.pedestrian_list = []
         self.walker_controller_list = []
         self.ai_controller_list = []
@@ -61,17 +65,52 @@ class PedestrianManager:
         new_spawn_point = carla.Transform(
             spawn_point.transform.location + carla.Location(z=2), spawn_point.transform.rotation
         )
-        walker = self.world_manager.spawn_actor(walker_bp, new_spawn_point)
+        self.world_manager.spawn_actor_later(
+            walker_bp,
+            new_spawn_point,
+            lambda walker: self.setup_pedestrian(
+                walker, agent, spawn_point, ego_agent, ego_car_point
+            ),
+        )
 
-        if walker is not None:
-            self.pedestrian_list.append(walker)
-            walker_controller = PedestrianAgent(
-                walker, agent["behavior"], agent["action"] == "block_the_ego"
-            )
-            walker_controller.set_ego_agent(ego_agent._vehicle, factor=1.0)
-            walker_controller.set_ego_vector(ego_car_point)
-            if agent["action"] != "stop":
-                if agent["action"] == "cross_the_road":
+    def setup_pedestrian(self, walker, agent, spawn_point, ego_agent, ego_car_point):
+        self.pedestrian_list.append(walker)
+        walker_controller = PedestrianAgent(
+            walker, agent["behavior"], agent["action"] == "block_the_ego"
+        )
+        walker_controller.set_ego_agent(ego_agent._vehicle, factor=1.0)
+        walker_controller.set_ego_vector(ego_car_point)
+        if agent["action"] != "stop":
+            if agent["action"] == "cross_the_road":
+                find_point = get_different_lane(spawn_point)
+                destination = self.world_manager.get_waypoint_from_location_with_ensure(
+                    find_point,
+                    [
+                        carla.LaneType.Sidewalk,
+                        carla.LaneType.Shoulder,
+                        carla.LaneType.Driving,
+                    ],
+                )
+                if agent["relative_to_ego"] == "near_the_crosswalk":
+                    controller_bp = self.agent_model_manager.get_blueprint_from_name(
+                        "controller.ai.walker"
+                    )
+                    self.world_manager.spawn_actor_later(
+                        controller_bp,
+                        carla.Transform(),
+                        lambda controller: self.setup_ai_controller(
+                            controller, walker_controller, agent, destination
+                        ),
+                        attach_to=walker,
+                    )
+
+            elif agent["action"] == "block_the_ego":
+                if agent["relative_to_ego"] != "at_the_destination":
+                    ego_lane_id = ego_car_point.lane_id
+                else:
+                    ego_lane_id = ego_agent.destination_waypoint.lane_id
+                different_direction = spawn_point.lane_id * ego_lane_id < 0
+                if different_direction:
                     find_point = get_different_lane(spawn_point)
                     destination = self.world_manager.get_waypoint_from_location_with_ensure(
                         find_point,
@@ -81,60 +120,36 @@ class PedestrianManager:
                             carla.LaneType.Driving,
                         ],
                     )
-                    if agent["relative_to_ego"] == "near_the_crosswalk":
-                        controller_bp = self.agent_model_manager.get_blueprint_from_name(
-                            "controller.ai.walker"
-                        )
-                        controller = self.world_manager.spawn_actor(
-                            controller_bp, carla.Transform(), walker
-                        )
-                        controller.start()
-                        if destination.lane_type != carla.LaneType.Sidewalk:
-                            controller.go_to_location(
-                                self.world_manager.world.get_random_location_from_navigation()
-                            )
-                        else:
-                            location = destination.transform.location
-                            controller.go_to_location(
-                                carla.Location(x=location.x, y=location.y, z=0.0)
-                            )
-                        controller.set_max_speed(PEDESTRIAN_TYPE[agent["behavior"]])
-                        walker_controller.set_controller(controller)
-                        self.ai_controller_list.append(controller)
-
-                elif agent["action"] == "block_the_ego":
-                    if agent["relative_to_ego"] != "at_the_destination":
-                        ego_lane_id = ego_car_point.lane_id
-                    else:
-                        ego_lane_id = ego_agent.destination_waypoint.lane_id
-                    different_direction = spawn_point.lane_id * ego_lane_id < 0
-                    if different_direction:
-                        find_point = get_different_lane(spawn_point)
-                        destination = self.world_manager.get_waypoint_from_location_with_ensure(
-                            find_point,
-                            [
-                                carla.LaneType.Sidewalk,
-                                carla.LaneType.Shoulder,
-                                carla.LaneType.Driving,
-                            ],
-                        )
+                else:
+                    destination = spawn_point
+                cur_depth = 0
+                while destination.lane_id != ego_lane_id and cur_depth < MAX_DEPTH:
+                    new_des = destination.get_left_lane()
+                    if new_des is None:
+                        break
                     else:
-                        destination = spawn_point
-                    cur_depth = 0
-                    while destination.lane_id != ego_lane_id and cur_depth < MAX_DEPTH:
-                        new_des = destination.get_left_lane()
-                        if new_des is None:
-                            break
-                        else:
-                            destination = new_des
-                        cur_depth += 1
-                elif agent["action"] == "on_the_sidewalk":
-                    destination = random.choice(
-                        get_points_to_front(spawn_point)[1:] + get_points_to_end(spawn_point)[1:]
-                    )
+                        destination = new_des
+                    cur_depth += 1
+            elif agent["action"] == "on_the_sidewalk":
+                destination = random.choice(
+                    get_points_to_front(spawn_point)[1:] + get_points_to_end(spawn_point)[1:]
+                )
+
+            walker_controller.set_destination(destination.transform.location)
+        self.walker_controller_list.append(walker_controller)
 
-                walker_controller.set_destination(destination.transform.location)
-            self.walker_controller_list.append(walker_controller)
+    def setup_ai_controller(self, controller, walker_controller, agent, destination):
+        controller.start()
+        if destination.lane_type != carla.LaneType.Sidewalk:
+            controller.go_to_location(
+                self.world_manager.world.get_random_location_from_navigation()
+            )
+        else:
+            location = destination.transform.location
+            controller.go_to_location(carla.Location(x=location.x, y=location.y, z=0.0))
+        controller.set_max_speed(PEDESTRIAN_TYPE[agent["behavior"]])
+        walker_controller.set_controller(controller)
+        self.ai_controller_list.append(controller)
 
     def check_walker_spawn_type(self, waypoint, target_road_type=None):
         for road_type in ["Sidewalk", "Shoulder", "Driving"]:
@@ -58,6 +58,10 @@ class VehicleManager:
         self.graph_manager = graph_manager
         self.agent_model_manager = agent_model_manager
         self.world_manager = world_manager
+        self.reset()
+
+    def reset(self):
+        """Forget the agents of the previous scene, their actors must be destroyed already"""
         self.vehicles = []
         self.vehicle_agent: List[BehaviorAgent] = []
 
@@ -84,8 +88,8 @@ class VehicleManager:
         move_one_more_forward = waypoint.next(DISTANCE_FOR_ROUTE)
         if move_one_more_forward is None or len(move_one_more_forward) == 0:
             return None
-        move_one_more_forward = self.world_manager.map.get_waypoint(
-            move_one_more_forward[0].transform.location
+        move_one_more_forward = self.world_manager.get_waypoint_from_location(
+            move_one_more_forward[0].transform.location, carla.LaneType.Driving
         )
         previous_vector = make_vector(waypoint, move_one_more_forward)
         if not move_one_more_forward.is_junction:
@@ -252,6 +256,12 @@ class VehicleManager:
         self.back_required = self.count_points_required("back", agent_info)
 
     def spawn_car(self, spawn_point, model: str = "vehicle.lincoln.mkz_2017", agent_info=None):
+        """Spawn a car at `spawn_point`, or on the lane next to it if that fails.
+
+        Return the waypoint the car was spawned from. Inside a spawn batch the car is only spawned
+        at `flush_spawn_batch`, so None is returned.
+        """
+        batched = self.world_manager.spawn_requests is not None
         if model == "random":
             ego_vehicle_bp = self.agent_model_manager.get_blueprint_from_type(agent_info["type"])
         else:
@@ -259,25 +269,34 @@ class VehicleManager:
         new_spawn_point = carla.Transform(
             spawn_point.transform.location + carla.Location(z=0.1), spawn_point.transform.rotation
         )
-        vehicle = self.world_manager.spawn_actor(ego_vehicle_bp, new_spawn_point)
-        if vehicle is None:
+        final_spawn_point = [spawn_point]
+
+        def on_spawn(vehicle):
+            self.vehicles.append(vehicle)
+            agent = self.create_vehicle_agent(vehicle, agent_info)
+            self.vehicle_agent.append(agent)
+
+        def on_failure():
             # Move the spawn point a little bit left or right
+            retry_point = spawn_point
             if agent_info["relative_to_ego"].endswith("left"):
-                spawn_point = spawn_point.get_left_lane()
+                retry_point = retry_point.get_left_lane()
             elif agent_info["relative_to_ego"].endswith("right"):
-                spawn_point = spawn_point.get_right_lane()
-            if spawn_point is not None:
+                retry_point = retry_point.get_right_lane()
+            final_spawn_point[0] = retry_point
+            if retry_point is not None:
                 new_spawn_point = carla.Transform(
-                    spawn_point.transform.location + carla.Location(z=0.1),
-                    spawn_point.transform.rotation,
+                    retry_point.transform.location + carla.Location(z=0.1),
+                    retry_point.transform.rotation,
                 )
-                vehicle = self.world_manager.spawn_actor(ego_vehicle_bp, new_spawn_point)
+                self.world_manager.spawn_actor_later(ego_vehicle_bp, new_spawn_point, on_spawn)
 
-        if vehicle is not None:
-            self.vehicles.append(vehicle)
-            agent = self.create_vehicle_agent(vehicle, agent_info)
-            self.vehicle_agent.append(agent)
-        return spawn_point
+        self.world_manager.spawn_actor_later(
+            ego_vehicle_bp, new_spawn_point, on_spawn, on_failure=on_failure
+        )
+        if batched:
+            return None
+        return final_spawn_point[0]
 
     def spawn_car_from_selected_waypoint(self, agent_info, direction):
         pos_id_to_waypoint = getattr(self, f"{direction}_pos_id_to_waypoint")
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+import carla
+import numpy as np
+
+from misc.constant import DISTANCE_FOR_ROUTE
+
+
+class WaypointIndex:
+    """Waypoints of a map bucketed by (road_id, section_id, lane_id, lane_type).
+
+    The driving waypoints are generated once from `map.generate_waypoints` and projected to the
+    driving lane, the same way `WorldManager` used to do on every call. Other lane types (sidewalk,
+    shoulder) are obtained by projecting those driving waypoints and are built lazily on first use.
+    Each bucket keeps the waypoints together with NumPy arrays of their locations and yaws, and the
+    road a bucket was sampled from, so the per-road getters only touch the buckets of that road.
+    """
+
+    def __init__(self, map, distance=DISTANCE_FOR_ROUTE):
+        self.map = map
+        self.distance = distance
+        self.buckets = {}
+        # (source road id, lane type) -> list of bucket keys, in insertion order
+        self.road_to_keys = defaultdict(list)
+        self.built_lane_types = set()
+        self.driving_waypoints = []
+        self.build(carla.LaneType.Driving)
+
+    def build(self, lane_type):
+        if lane_type in self.built_lane_types:
+            return
+        if lane_type == carla.LaneType.Driving:
+            for waypoint in self.map.generate_waypoints(distance=self.distance):
+                waypoint = self.map.get_waypoint(waypoint.transform.location)
+                if waypoint is not None:
+                    self.driving_waypoints.append(waypoint)
+            source_waypoints = self.driving_waypoints
+            projected = self.driving_waypoints
+        else:
+            source_waypoints = []
+            projected = []
+            for waypoint in self.driving_waypoints:
+                projected_waypoint = self.map.get_waypoint(
+                    waypoint.transform.location,
+                    project_to_road=True,
+                    lane_type=lane_type,
+                )
+                if projected_waypoint is not None:
+                    source_waypoints.append(waypoint)
+                    projected.append(projected_waypoint)
+
+        staging = defaultdict(lambda: ([], [], []))
+        for order, (source, waypoint) in enumerate(zip(source_waypoints, projected)):
+            key = (waypoint.road_id, waypoint.section_id, waypoint.lane_id, lane_type)
+            waypoints, orders, sources = staging[key]
+            waypoints.append(waypoint)
+            orders.append(order)
+            sources.append(source.road_id)
+
+        for key, (waypoints, orders, sources) in staging.items():
+            sources = np.array(sources, dtype=np.int64)
+            self.buckets[key] = {
+                "waypoints": waypoints,
+                "locations": np.array(
+                    [
+                        [
+                            waypoint.transform.location.x,
+                            waypoint.transform.location.y,
+                            waypoint.transform.location.z,
+                        ]
+                        for waypoint in waypoints
+                    ],
+                    dtype=np.float64,
+                ).reshape(-1, 3),
+                "yaws": np.array(
+                    [waypoint.transform.rotation.yaw for waypoint in waypoints], dtype=np.float64
+                ),
+                "order": np.array(orders, dtype=np.int64),
+                "source_road_id": sources,
+            }
+            for source_road_id in np.unique(sources):
+                self.road_to_keys[(int(source_road_id), lane_type)].append(key)
+        self.built_lane_types.add(lane_type)
+
+    def get_waypoints_from_road(self, road_id, lane_type=carla.LaneType.Driving):
+        """Return the waypoints sampled from `road_id`, in `generate_waypoints` order."""
+        self.build(lane_type)
+        road_id = int(road_id)
+        waypoints = []
+        orders = []
+        for key in self.road_to_keys.get((road_id, lane_type), []):
+            bucket = self.buckets[key]
+            for idx in np.flatnonzero(bucket["source_road_id"] == road_id):
+                waypoints.append(bucket["waypoints"][idx])
+                orders.append(bucket["order"][idx])
+        return [waypoints[idx] for idx in np.argsort(orders, kind="stable")]
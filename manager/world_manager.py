@@ -1,16 +1,35 @@
 import carla
 
+from agents.tools.nearest_lane import get_nearest_lane_service
 from misc.constant import DISTANCE_FOR_ROUTE
 
+from .waypoint_index import WaypointIndex
+
 
 class WorldManager:
-    def __init__(self, world=None):
+    def __init__(self, world=None, client=None):
         self.world = world
-        self.map = world.get_map() if world is not None else None
+        self.client = client
+        self.spawn_requests = None
+        self.map = None
+        self.waypoint_index = None
+        self.nearest_lane_service = None
+        self.map_name_to_waypoint_index = {}
+        if world is not None:
+            self.set_map(world.get_map())
 
     def set_world(self, world):
         self.world = world
-        self.map = world.get_map()
+        self.set_map(world.get_map())
+
+    def set_map(self, map):
+        self.map = map
+        if map.name not in self.map_name_to_waypoint_index:
+            self.map_name_to_waypoint_index[map.name] = WaypointIndex(
+                map, distance=DISTANCE_FOR_ROUTE
+            )
+        self.waypoint_index = self.map_name_to_waypoint_index[map.name]
+        self.nearest_lane_service = get_nearest_lane_service(map)
 
     def get_random_location_from_navigation(self):
         return self.world.get_random_location_from_navigation()
@@ -29,12 +48,23 @@ class WorldManager:
         )
 
     def get_waypoint_from_location(self, location, lane_type):
-        return self.map.get_waypoint(
+        return self.nearest_lane_service.get_waypoint(
             location,
             project_to_road=True,
             lane_type=lane_type,
         )
 
+    def get_waypoint_from_road_lane_s(self, road_id, lane_id, s):
+        """The waypoint of a lane at its OpenDRIVE coordinate s, without projecting a location"""
+        waypoint = self.map.get_waypoint_xodr(road_id, lane_id, s)
+        if waypoint is not None:
+            return waypoint
+        # s outside of the lane sections known to CARLA, closest sampled point of the lane
+        driving_points = self.get_driving_points_with_road_and_lane_id(road_id, lane_id)
+        if len(driving_points) == 0:
+            return None
+        return min(driving_points, key=lambda waypoint: abs(waypoint.s - s))
+
     def get_waypoint_from_location_with_ensure(self, location, lane_type_list):
         for lane_type in lane_type_list:
             waypoint = self.get_waypoint_from_location(location, lane_type)
@@ -43,42 +73,16 @@ class WorldManager:
         return self.get_waypoint_from_location(location, carla.LaneType.Driving)
 
     def get_all_waypoints_from_road(self, road_id):
-        all_waypoints = self.map.generate_waypoints(distance=DISTANCE_FOR_ROUTE)
-        road_waypoints = []
-        for waypoint in all_waypoints:
-            waypoint = self.map.get_waypoint(waypoint.transform.location)
-            if waypoint is not None and waypoint.road_id == road_id:
-                road_waypoints.append(waypoint)
-        return road_waypoints
+        return self.waypoint_index.get_waypoints_from_road(road_id, carla.LaneType.Driving)
 
     def compute_distance(self, location1, location2):
         return location1.distance(location2)
 
     def get_side_walk(self, road_id):
-        road_waypoints = self.get_all_waypoints_from_road(road_id)
-        side_walk_points = []
-        for waypoint in road_waypoints:
-            side_walk_point = self.map.get_waypoint(
-                waypoint.transform.location,
-                project_to_road=True,
-                lane_type=carla.LaneType.Sidewalk,
-            )
-            if side_walk_point is not None:
-                side_walk_points.append(side_walk_point)
-        return side_walk_points
+        return self.waypoint_index.get_waypoints_from_road(road_id, carla.LaneType.Sidewalk)
 
     def get_shoulder(self, road_id):
-        road_waypoints = self.get_all_waypoints_from_road(road_id)
-        shoulder_points = []
-        for waypoint in road_waypoints:
-            shoulder_point = self.map.get_waypoint(
-                waypoint.transform.location,
-                project_to_road=True,
-                lane_type=carla.LaneType.Shoulder,
-            )
-            if shoulder_point is not None:
-                shoulder_points.append(shoulder_point)
-        return shoulder_points
+        return self.waypoint_index.get_waypoints_from_road(road_id, carla.LaneType.Shoulder)
 
     def get_driving(self, road_id):
         road_waypoints = self.get_all_waypoints_from_road(road_id)
@@ -138,3 +142,70 @@ class WorldManager:
         if actor is not None and tick:
             self.world.tick()
         return actor
+
+    def reset(self):
+        """Drop the spawns queued by an unfinished batch"""
+        self.spawn_requests = None
+
+    def start_spawn_batch(self):
+        """Queue the following `spawn_actor_later` calls until `flush_spawn_batch`"""
+        self.spawn_requests = []
+
+    def spawn_actor_later(self, blueprint, transform, on_spawn, attach_to=None, on_failure=None):
+        """Spawn the actor now, or at the next `flush_spawn_batch` if a batch is started.
+
+        `on_spawn(actor)` or `on_failure()` is called once the result is known. They can request
+        other spawns (e.g. a retry or a controller attached to the actor), which are sent in the
+        next round of the same flush.
+        """
+        if self.spawn_requests is None:
+            actor = self.spawn_actor(blueprint, transform, attach_to)
+            if actor is not None:
+                on_spawn(actor)
+            elif on_failure is not None:
+                on_failure()
+            return
+        self.spawn_requests.append((blueprint, transform, attach_to, on_spawn, on_failure))
+
+    def flush_spawn_batch(self):
+        """Spawn the queued actors with one `apply_batch_sync` and one tick per round"""
+        try:
+            self._spawn_queued_requests()
+        finally:
+            # A failed flush must not leave the following spawns queued forever
+            self.spawn_requests = None
+
+    def _spawn_queued_requests(self):
+        while self.spawn_requests:
+            requests, self.spawn_requests = self.spawn_requests, []
+            if self.client is None:
+                actors = [
+                    self.spawn_actor(blueprint, transform, attach_to)
+                    for blueprint, transform, attach_to, *_ in requests
+                ]
+            else:
+                commands = []
+                for blueprint, transform, attach_to, *_ in requests:
+                    if attach_to is None:
+                        commands.append(carla.command.SpawnActor(blueprint, transform))
+                    else:
+                        commands.append(
+                            carla.command.SpawnActor(blueprint, transform, attach_to.id)
+                        )
+                responses = self.client.apply_batch_sync(commands, True)
+                actor_ids = [response.actor_id for response in responses if not response.error]
+                id_to_actor = (
+                    {actor.id: actor for actor in self.world.get_actors(actor_ids)}
+                    if len(actor_ids) > 0
+                    else {}
+                )
+                actors = [
+                    None if response.error else id_to_actor.get(response.actor_id)
+                    for response in responses
+                ]
+
+            for (*_, on_spawn, on_failure), actor in zip(requests, actors):
+                if actor is not None:
+                    on_spawn(actor)
+                elif on_failure is not None:
+                    on_failure()
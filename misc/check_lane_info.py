@@ -0,0 +1,156 @@
+import argparse
+import glob
+import json
+import os
+import sys
+
+import tabulate
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from graph.graph_manager import REMOVE_NODE_WITH_LESS_POINTS, format_town_name, get_lane_info
+from graph.graph_utils import create_graph_from_files
+from graph.opendrive_geometry import OpenDriveGeometry
+from misc.constant import DISTANCE_FOR_ROUTE
+
+FIELDS = ("number_of_lane", "have_opposite", "num_of_waypoints")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the offline lane info of the road graph with the one from CARLA"
+    )
+    parser.add_argument("--map-folder", type=str, default="maps", help="The map folder")
+    parser.add_argument(
+        "--dump-dir", type=str, default="lane_info_dump", help="Folder of the CARLA dumps"
+    )
+    parser.add_argument(
+        "--dump",
+        action="store_true",
+        default=False,
+        help="Dump the lane info from a running CARLA server instead of comparing",
+    )
+    parser.add_argument("--ip-address", type=str, default="localhost", help="The ip address")
+    parser.add_argument("--port", type=int, default=2000, help="The port")
+    parser.add_argument(
+        "--verbose", action="store_true", default=False, help="Print every mismatching road"
+    )
+    return parser.parse_args()
+
+
+def lane_info_of_town(town_file, get_left_right_driving_points):
+    """{road_id: {direction: lane info}} of the non-junction roads of a town, computed like
+    `GraphManager.compute_lane_info` from the points returned by `get_left_right_driving_points`"""
+    graph, _ = create_graph_from_files([town_file])
+    lane_info = {}
+    for _, node in graph.nodes(data=True):
+        if node["is_junction"]:
+            continue
+        road_id = int(node["road_id"])
+        right_waypoints, left_waypoints = get_left_right_driving_points(road_id)
+        road_info = {}
+        for direction in ("right", "left"):
+            number_of_lane = node[f"number_of_{direction}_lane"]
+            if number_of_lane == 0:
+                continue
+            info = get_lane_info(right_waypoints, left_waypoints, direction)
+            if info is None:
+                road_info[direction] = {
+                    "number_of_lane": 0,
+                    "have_opposite": False,
+                    "num_of_waypoints": 0,
+                }
+                continue
+            if info["num_of_waypoints"] < REMOVE_NODE_WITH_LESS_POINTS:
+                number_of_lane = 0
+            road_info[direction] = {"number_of_lane": number_of_lane, **info}
+        lane_info[str(road_id)] = road_info
+    return lane_info
+
+
+def carla_driving_points(world_map):
+    """`get_left_right_driving_points` of the original `WorldManager`: the waypoints of
+    `generate_waypoints`, snapped to their closest lane with `get_waypoint`"""
+    road_to_points = {}
+    for waypoint in world_map.generate_waypoints(distance=DISTANCE_FOR_ROUTE):
+        waypoint = world_map.get_waypoint(waypoint.transform.location)
+        if waypoint is not None:
+            road_to_points.setdefault(waypoint.road_id, []).append(waypoint)
+
+    def get_left_right_driving_points(road_id):
+        points = road_to_points.get(road_id, [])
+        right_driving_points = [point for point in points if point.lane_id < 0]
+        left_driving_points = [point for point in points if point.lane_id > 0]
+        return right_driving_points, left_driving_points
+
+    return get_left_right_driving_points
+
+
+def dump_carla_lane_info(town_files, dump_dir, ip_address, port):
+    import carla
+
+    client = carla.Client(ip_address, port)
+    client.set_timeout(60.0)
+    os.makedirs(dump_dir, exist_ok=True)
+    for town_name, town_file in town_files.items():
+        world = client.load_world(format_town_name(town_name))
+        lane_info = lane_info_of_town(town_file, carla_driving_points(world.get_map()))
+        with open(os.path.join(dump_dir, f"{town_name}.json"), "w") as f:
+            json.dump(lane_info, f, indent=2)
+        print(f"Dumped {len(lane_info)} roads of {town_name}")
+
+
+def compare_lane_info(offline, reference):
+    """Number of (road, direction) pairs, and the ones differing from the reference per field"""
+    num_pairs = 0
+    mismatches = {field: [] for field in FIELDS}
+    for road_id in sorted(set(offline) | set(reference), key=int):
+        for direction in ("right", "left"):
+            offline_info = offline.get(road_id, {}).get(direction)
+            reference_info = reference.get(road_id, {}).get(direction)
+            if offline_info is None and reference_info is None:
+                continue
+            num_pairs += 1
+            for field in FIELDS:
+                offline_value = None if offline_info is None else offline_info[field]
+                reference_value = None if reference_info is None else reference_info[field]
+                if offline_value != reference_value:
+                    mismatches[field].append(
+                        (road_id, direction, offline_value, reference_value)
+                    )
+    return num_pairs, mismatches
+
+
+def check_lane_info(town_files, dump_dir, verbose=False):
+    rows = []
+    for town_name, town_file in town_files.items():
+        dump_path = os.path.join(dump_dir, f"{town_name}.json")
+        if not os.path.exists(dump_path):
+            print(f"No CARLA dump for {town_name}, run with --dump first")
+            continue
+        with open(dump_path, "r") as f:
+            reference = json.load(f)
+        offline = lane_info_of_town(
+            town_file, OpenDriveGeometry(town_file).get_left_right_driving_points
+        )
+        num_pairs, mismatches = compare_lane_info(offline, reference)
+        rows.append([town_name, num_pairs] + [len(mismatches[field]) for field in FIELDS])
+        if verbose:
+            for field in FIELDS:
+                for road_id, direction, offline_value, reference_value in mismatches[field]:
+                    print(
+                        f"{town_name} road {road_id} {direction} {field}: "
+                        f"offline {offline_value}, CARLA {reference_value}"
+                    )
+    print(tabulate.tabulate(rows, headers=["Town", "Road sides", *FIELDS]))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    town_files = {
+        os.path.basename(file_path).split(".")[0]: file_path
+        for file_path in sorted(glob.glob(os.path.join(args.map_folder, "*.xodr")))
+    }
+    if args.dump:
+        dump_carla_lane_info(town_files, args.dump_dir, args.ip_address, args.port)
+    else:
+        check_lane_info(town_files, args.dump_dir, verbose=args.verbose)
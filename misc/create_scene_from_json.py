@@ -3,13 +3,12 @@ import json
 import os
 import random
 import sys
-import time
 
 import numpy as np
 from colorama import Fore, Style
-from PIL import Image
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from misc.frame_writer import FrameWriter
 from scene_utils.scene_client import CarlaClient
 
 EGO_SETUP = {
@@ -79,12 +78,14 @@ def scene_generation(
     map_folder="maps",
     return_ego=False,
 ):
+    frame_writer = FrameWriter()
     carla_client = CarlaClient(
         input_folder=map_folder,
         host=ip_address,
         port=port,
         use_cache=use_cache,
         cache_dir=cache_dir,
+        image_consumer_slots=frame_writer.max_in_flight,
     )
     agent_planning = planning["agents"] + ([EGO_SETUP] if not return_ego else [])
     action_list = set()
@@ -103,6 +104,7 @@ def scene_generation(
 
     if town_name is None:
         print(f"{Fore.RED}No valid road found{Style.RESET_ALL}")
+        frame_writer.close()
         return
 
     print(
@@ -128,22 +130,23 @@ def scene_generation(
     os.makedirs(f"{save_dir}/front_image", exist_ok=True)
     os.makedirs(f"{save_dir}/bev_image", exist_ok=True)
     try:
-        count_frame = 1
-        while True:
-            done, data = carla_client.check_finish()
-            if count_frame > 10:
-                for sensor_name, sensor_data in data.items():
-                    if sensor_data is not None:
-                        try:
-                            Image.fromarray(sensor_data).save(
+        with frame_writer:
+            count_frame = 1
+            while True:
+                done, data = carla_client.check_finish()
+                if count_frame > 10:
+                    for sensor_name, sensor_data in data.items():
+                        if sensor_data is not None:
+                            # The camera ring keeps the BGRA slot untouched until the
+                            # writer threads have converted and saved it
+                            frame_writer.write(
                                 f"{save_dir}/{sensor_name}/{count_frame:06d}.png",
+                                sensor_data,
+                                bgra=True,
                             )
-                        except Exception as e:
-                            print(str(e))
-            if done:
-                break
-            count_frame += 1
-            time.sleep(0.02)
+                if done:
+                    break
+                count_frame += 1
 
         carla_client.destroy()
     except KeyboardInterrupt:
@@ -0,0 +1,64 @@
+import threading
+from queue import Queue
+
+from PIL import Image
+
+
+class FrameWriter:
+    """Save (path, array) jobs as images from a pool of background threads.
+
+    The queue is bounded: `write` blocks once `max_pending` frames are waiting, so a slow disk
+    slows down the capture loop instead of filling the memory. `close` (or leaving the `with`
+    block) waits until every queued frame is written. The arrays are not copied, so a buffer
+    handed to `write` must stay untouched for `max_in_flight` more writes.
+    """
+
+    def __init__(self, num_workers=4, max_pending=64):
+        self.max_in_flight = max_pending + num_workers
+        self.jobs = Queue(maxsize=max_pending)
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            path, array, bgra = job
+            try:
+                if bgra:
+                    height, width = array.shape[:2]
+                    image = Image.frombuffer("RGB", (width, height), array, "raw", "BGRX", 0, 1)
+                else:
+                    image = Image.fromarray(array)
+                image.save(path)
+            except Exception as e:
+                print(str(e))
+            self.jobs.task_done()
+
+    def write(self, path, array, bgra=False):
+        """Queue `array` to be saved at `path`; a contiguous BGRA `array` is reordered into RGB
+        by the worker when `bgra` is set"""
+        self.jobs.put((path, array, bgra))
+
+    def flush(self):
+        self.jobs.join()
+
+    def close(self):
+        if len(self.workers) == 0:
+            return
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
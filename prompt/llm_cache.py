@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+
+class LLMResponseCache:
+    """Disk cache of chat completions, one JSON file per request.
+
+    The key is the SHA-256 of (model, temperature, seed, messages), and of the attempt number
+    for the retries of a same request, so that a rejected response is not served again to the
+    retry. When `replay` is set, a
+    missing entry raises a `KeyError` instead of calling the API, so a prompt set can be re-run
+    without any request.
+    """
+
+    def __init__(self, cache_dir, replay=False):
+        self.cache_dir = cache_dir
+        self.replay = replay
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model, temperature, seed, messages, attempt=0):
+        request = {
+            "model": model,
+            "temperature": temperature,
+            "seed": seed,
+            "messages": messages,
+        }
+        # The first attempt keeps the key it had before retries were told apart
+        if attempt > 0:
+            request["attempt"] = attempt
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)["content"]
+
+    def put(self, key, content, **request):
+        # Write then rename so that a crash never leaves a truncated entry
+        path = self.get_path(key)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({**request, "content": content}, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+
+def create_chat_completion(
+    chat_client,
+    messages,
+    model,
+    temperature,
+    seed=None,
+    cache: LLMResponseCache = None,
+    attempt=0,
+):
+    """Return the content of the first choice, reading `cache` before calling the API
+
+    `attempt` is the number of previous tries of the same request, it is part of the cache key.
+    """
+    if cache is not None:
+        key = cache.make_key(model, temperature, seed, messages, attempt)
+        content = cache.get(key)
+        if content is not None:
+            return content
+        if cache.replay:
+            raise KeyError(f"No cached response for {key} in replay mode")
+
+    request = {"model": model, "messages": messages, "temperature": temperature}
+    if seed is not None:
+        request["seed"] = seed
+    response = chat_client.chat.completions.create(**request)
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(
+            key,
+            content,
+            model=model,
+            temperature=temperature,
+            seed=seed,
+            messages=messages,
+            attempt=attempt,
+        )
+    return content
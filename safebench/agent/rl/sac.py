@@ -191,8 +191,15 @@ class SAC(BasePolicy):
             V_loss = V_loss.mean()
 
             # Single Q_net this is different from original paper!!!
-            Q_loss = self.Q_criterion(excepted_Q, next_q_value.detach())  # J_Q
-            Q_loss = Q_loss.mean()
+            if "weight" in batch:
+                # prioritized replay: importance sampling weights, and the TD errors are given back
+                td_error = next_q_value.detach() - excepted_Q
+                bn_w = CUDA(torch.FloatTensor(batch["weight"])).unsqueeze(-1)  # [B, 1]
+                Q_loss = (bn_w * td_error.pow(2)).mean()  # J_Q
+                replay_buffer.update_priorities(batch["index"], CPU(td_error.abs()).squeeze(-1))
+            else:
+                Q_loss = self.Q_criterion(excepted_Q, next_q_value.detach())  # J_Q
+                Q_loss = Q_loss.mean()
 
             log_policy_target = excepted_new_Q - excepted_value
             pi_loss = log_prob * (log_prob - log_policy_target).detach()
@@ -121,7 +121,7 @@ class RLAgent:
 
         if replay_buffer != None and episode != -1:
             buffer_path = os.path.join(self.model_path, f"model.sac.buffer")
-            if os.path.isfile(buffer_path):
+            if os.path.exists(buffer_path):
                 self.logger.log(
                     f">> Loading {self.policy_name} buffer from {buffer_path}"
                 )
@@ -17,10 +17,15 @@ import numpy as np
 import pygame
 from tqdm import tqdm
 
+from agents.tools.nearest_lane import set_nearest_lane_cache_dir
 from safebench.agent import AGENT_POLICY_LIST
 from safebench.gym_carla.env_wrapper import VectorWrapper
-from safebench.gym_carla.envs.render import BirdeyeRender
-from safebench.gym_carla.replay_buffer import PerceptionReplayBuffer, RouteReplayBuffer
+from safebench.gym_carla.envs.render import BirdeyeRender, make_birdeye_params
+from safebench.gym_carla.replay_buffer import (
+    PerceptionReplayBuffer,
+    RouteReplayBuffer,
+    make_replay_buffer,
+)
 from safebench.scenario import SCENARIO_POLICY_LIST
 from safebench.scenario.scenario_data_loader import ScenarioDataLoader
 from safebench.scenario.scenario_manager.carla_data_provider import CarlaDataProvider
@@ -156,6 +161,8 @@ class CarlaRunner:
         self.world.apply_settings(settings)
         CarlaDataProvider.set_client(self.client)
         CarlaDataProvider.set_world(self.world)
+        # the lane samples of the criteria are stored next to the road graphs
+        set_nearest_lane_cache_dir(self.scenario_config.get("cache_dir", "graph_cache"))
         CarlaDataProvider.set_traffic_manager_port(self.scenario_config["tm_port"])
         self.world.set_weather(carla.WeatherParameters.ClearNoon)
 
@@ -185,18 +192,7 @@ class CarlaRunner:
         self.display = pygame.display.set_mode(window_size, flag)
 
         # initialize the render for generating observation and visualization
-        pixels_per_meter = self.env_params["display_size"] / self.env_params["obs_range"]
-        pixels_ahead_vehicle = (
-            self.env_params["obs_range"] / 2 - self.env_params["d_behind"]
-        ) * pixels_per_meter
-        self.birdeye_params = {
-            "screen_size": [
-                self.env_params["display_size"],
-                self.env_params["display_size"],
-            ],
-            "pixels_per_meter": pixels_per_meter,
-            "pixels_ahead_vehicle": pixels_ahead_vehicle,
-        }
+        self.birdeye_params = make_birdeye_params(self.env_params, self.scenario_config)
         self.birdeye_render = BirdeyeRender(self.world, self.birdeye_params, logger=self.logger)
 
     def train(self, data_loader, start_episode=0, replay_buffer=None):
@@ -402,7 +398,9 @@ class CarlaRunner:
                 if self.scenario_category == "planning"
                 else PerceptionReplayBuffer
             )
-            replay_buffer = Buffer(self.num_scenario, self.mode, self.buffer_capacity)
+            replay_buffer = make_replay_buffer(
+                Buffer, self.agent_config, self.num_scenario, self.mode, self.buffer_capacity
+            )
             map_keys = map_keys * 20
             if self.continue_agent_training:
                 self.logger.load_training_results()
@@ -437,6 +435,8 @@ class CarlaRunner:
                 continue
 
             # create scenarios within the vectorized wrapper
+            if self.env is not None:
+                self.env.close()
             self.env = VectorWrapper(
                 self.env_params,
                 self.scenario_config,
@@ -501,3 +501,4 @@ class CarlaRunner:
         pygame.quit()
         if self.env:
             self.env.clean_up()
+            self.env.close()
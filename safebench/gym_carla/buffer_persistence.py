@@ -0,0 +1,132 @@
+"""
+Description:
+    Persistence of replay buffer states as a folder of .npy files described by a JSON manifest.
+    Each large array of the state (e.g. one field of a RingStorage) is written to its own .npy
+    file, and loaded back as a lazy memory map, so resuming a long training run neither
+    deserializes nor reads the whole buffer up front.
+"""
+
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+OBJECTS_NAME = "objects.pkl"
+FORMAT_VERSION = 1
+# arrays up to this number of elements (e.g. ring cursors and sizes) are kept in the manifest
+INLINE_ARRAY_SIZE = 256
+
+
+def _flatten(state, path=()):
+    """Yield (path, value) for the leaves of nested dictionaries with string keys"""
+    for key, value in state.items():
+        if isinstance(value, dict) and len(value) > 0 and all(isinstance(k, str) for k in value):
+            yield from _flatten(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+
+def _is_json(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _file_name(path):
+    return ".".join(path) + ".npy"
+
+
+def _remove(path):
+    """Deletes a folder, or a single file such as a buffer saved with `torch.save`"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def save_state(directory, state):
+    """
+    Writes a state dictionary (e.g. `RouteReplayBuffer.state_dict()`) to a folder:
+    - every numeric array larger than INLINE_ARRAY_SIZE goes to its own .npy file
+    - small arrays and JSON values (counters, keys, ...) are stored in the manifest
+    - anything else (e.g. lists of arrays or tensors) is pickled in OBJECTS_NAME
+    The folder is written next to `directory` and moved in place at the end, so an interrupted
+    save leaves the previous one untouched.
+    """
+    directory = os.path.normpath(directory)
+    tmp_directory = f"{directory}.tmp"
+    _remove(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    entries = []
+    objects = {}
+    for path, value in _flatten(state):
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            entry = {"path": list(path), "shape": list(value.shape), "dtype": value.dtype.str}
+            if value.size <= INLINE_ARRAY_SIZE:
+                entry.update(kind="inline", data=value.tolist())
+            else:
+                entry.update(kind="array", file=_file_name(path))
+                np.save(os.path.join(tmp_directory, entry["file"]), value, allow_pickle=False)
+        elif _is_json(value):
+            entry = {"path": list(path), "kind": "json", "data": value}
+        else:
+            entry = {"path": list(path), "kind": "object"}
+            objects[path] = value
+        entries.append(entry)
+
+    if len(objects) > 0:
+        with open(os.path.join(tmp_directory, OBJECTS_NAME), "wb") as f:
+            pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp_directory, MANIFEST_NAME), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "entries": entries}, f, indent=1)
+
+    # The previous files may still be memory-mapped, they are only unlinked
+    old_directory = f"{directory}.old"
+    _remove(old_directory)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    _remove(old_directory)
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported buffer format version: {manifest.get('version')}")
+    return manifest
+
+
+def load_state(directory, mmap_mode="c"):
+    """
+    Reads a state written by `save_state`. The .npy arrays are memory-mapped with `mmap_mode`
+    and only read from disk when accessed. The default copy-on-write mode lets the loaded buffer
+    be written to without modifying the files; use None to read them into memory instead.
+    """
+    manifest = load_manifest(directory)
+    objects = None
+    state = {}
+    for entry in manifest["entries"]:
+        kind = entry["kind"]
+        if kind == "array":
+            value = np.load(os.path.join(directory, entry["file"]), mmap_mode=mmap_mode)
+        elif kind == "inline":
+            value = np.array(entry["data"], dtype=np.dtype(entry["dtype"])).reshape(entry["shape"])
+        elif kind == "json":
+            value = entry["data"]
+        else:
+            if objects is None:
+                with open(os.path.join(directory, OBJECTS_NAME), "rb") as f:
+                    objects = pickle.load(f)
+            value = objects[tuple(entry["path"])]
+        node = state
+        for key in entry["path"][:-1]:
+            node = node.setdefault(key, {})
+        node[entry["path"][-1]] = value
+    return state
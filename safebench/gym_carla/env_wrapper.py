@@ -8,11 +8,140 @@ Description:
     For a copy, see <https://opensource.org/licenses/MIT>
 """
 
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
 import gymnasium as gym
 import numpy as np
 import pygame
 
 
+def _attach_shared_array(attached, name, shape, dtype):
+    if name not in attached:
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=attached[name].buf)
+
+
+def _observation_worker(conn, obs_params):
+    from safebench.gym_carla.envs.misc import process_observation
+
+    attached = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        input_specs, output_specs = message
+        # drop the blocks the parent has replaced with larger ones
+        used_names = {spec[0] for spec in list(input_specs.values()) + list(output_specs.values())}
+        for name in list(attached):
+            if name not in used_names:
+                attached.pop(name).close()
+        inputs = {key: _attach_shared_array(attached, *spec) for key, spec in input_specs.items()}
+        outputs = process_observation(inputs, obs_params)
+        reply = {}
+        for key, value in outputs.items():
+            spec = output_specs.get(key)
+            if spec is None or spec[1] != value.shape or spec[2] != value.dtype:
+                # the parent allocates the buffer and sends it again with the next request
+                reply[key] = value
+            else:
+                _attach_shared_array(attached, *spec)[...] = value
+        conn.send(reply)
+    for shm in attached.values():
+        shm.close()
+    conn.close()
+
+
+class SharedArrays:
+    """Named shared-memory arrays, reallocated when an array does not fit anymore"""
+
+    def __init__(self):
+        self.blocks = {}  # key -> (SharedMemory, shape, dtype)
+
+    def put(self, key, value):
+        value = np.asarray(value)
+        block = self.blocks.get(key)
+        if block is None or block[0].size < value.nbytes or block[2] != value.dtype:
+            self.release(key)
+            shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+            block = (shm, value.shape, value.dtype)
+        block = (block[0], value.shape, value.dtype)
+        self.blocks[key] = block
+        self.get(key)[...] = value
+        return self.spec(key)
+
+    def allocate(self, key, shape, dtype):
+        self.put(key, np.empty(shape, dtype=dtype))
+
+    def get(self, key):
+        shm, shape, dtype = self.blocks[key]
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def spec(self, key):
+        shm, shape, dtype = self.blocks[key]
+        return (shm.name, shape, dtype)
+
+    def release(self, key):
+        block = self.blocks.pop(key, None)
+        if block is not None:
+            block[0].close()
+            block[0].unlink()
+
+    def close(self):
+        for key in list(self.blocks):
+            self.release(key)
+
+
+class ObservationWorkerPool:
+    """Subprocesses running `process_observation` for the environments of a `VectorWrapper`.
+
+    Environment `e_i` is always served by worker `e_i % num_workers`. The inputs and outputs of
+    each environment live in its own shared-memory arrays; only their names go through the pipes.
+    Output arrays are allocated after the first reply of a worker, which returns them by value.
+    """
+
+    def __init__(self, num_env, num_workers, obs_params):
+        context = mp.get_context("spawn")
+        self.num_workers = max(1, min(num_workers, num_env))
+        self.connections = []
+        self.workers = []
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(
+                target=_observation_worker, args=(child_conn, obs_params), daemon=True
+            )
+            worker.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.workers.append(worker)
+        self.inputs = [SharedArrays() for _ in range(num_env)]
+        self.outputs = [SharedArrays() for _ in range(num_env)]
+
+    def submit(self, e_i, obs_inputs):
+        input_specs = {key: self.inputs[e_i].put(key, value) for key, value in obs_inputs.items()}
+        output_specs = {key: self.outputs[e_i].spec(key) for key in self.outputs[e_i].blocks}
+        self.connections[e_i % self.num_workers].send((input_specs, output_specs))
+
+    def collect(self, e_i):
+        reply = self.connections[e_i % self.num_workers].recv()
+        for key, value in reply.items():
+            self.outputs[e_i].allocate(key, value.shape, value.dtype)
+        return {
+            key: reply[key] if key in reply else self.outputs[e_i].get(key).copy()
+            for key in set(reply) | set(self.outputs[e_i].blocks)
+        }
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+        for arrays in self.inputs + self.outputs:
+            arrays.close()
+        self.connections = []
+        self.workers = []
+
+
 class VectorWrapper:
     """
     The interface to control a list of environments.
@@ -26,6 +155,11 @@ class VectorWrapper:
         self.frame_skip = scenario_config["frame_skip"]
         self.render = scenario_config["render"]
 
+        # "serial" builds the observations in this process, "process" in `ObservationWorkerPool`
+        self.backend = scenario_config.get("env_backend", "serial")
+        self.num_env_workers = scenario_config.get("num_env_workers", self.num_scenario)
+        self.obs_workers = None
+
         self.env_list = []
         self.action_space_list = []
         for i in range(self.num_scenario):
@@ -43,6 +177,13 @@ class VectorWrapper:
         self.finished_env = [False] * self.num_scenario
         self.running_results = {}
 
+        if self.backend == "process":
+            self.obs_workers = ObservationWorkerPool(
+                self.num_scenario, self.num_env_workers, self.env_list[0].obs_params
+            )
+        elif self.backend != "serial":
+            raise ValueError(f"Unknown env backend: {self.backend}")
+
     def obs_postprocess(self, obs_list):
         # assume all variables are array
         obs_list = np.array(obs_list)
@@ -108,6 +249,13 @@ class VectorWrapper:
         for _ in range(self.frame_skip):
             self.world.tick()
 
+        # read the new frame from CARLA and build the observations in the workers
+        if self.obs_workers is not None:
+            for e_i in range(self.num_scenario):
+                if not self.finished_env[e_i]:
+                    obs_inputs = self.env_list[e_i].prepare_step_after_tick()
+                    self.obs_workers.submit(e_i, obs_inputs)
+
         # collect new observation of one frame
         obs_list = []
         reward_list = []
@@ -116,7 +264,12 @@ class VectorWrapper:
         for e_i in range(self.num_scenario):
             if not self.finished_env[e_i]:
                 current_env = self.env_list[e_i]
-                obs, reward, done, info = current_env.step_after_tick()
+                if self.obs_workers is None:
+                    obs, reward, done, info = current_env.step_after_tick()
+                else:
+                    obs, reward, done, info = current_env.finish_step_after_tick(
+                        self.obs_workers.collect(e_i)
+                    )
 
                 # store scenario id to help agent decide which policy should be used
                 info["scenario_id"] = e_i
@@ -171,6 +324,11 @@ class VectorWrapper:
         # tick to ensure that all destroy commands are executed
         self.world.tick()
 
+    def close(self):
+        if self.obs_workers is not None:
+            self.obs_workers.close()
+            self.obs_workers = None
+
 
 class ObservationWrapper(gym.Wrapper):
     def __init__(self, env, obs_type):
@@ -198,6 +356,20 @@ class ObservationWrapper(gym.Wrapper):
 
     def step_after_tick(self):
         obs, reward, done, info = self._env.step_after_tick()
+        return self._postprocess_step(obs, reward, done, info)
+
+    def prepare_step_after_tick(self):
+        return self._env.prepare_step_after_tick()
+
+    def finish_step_after_tick(self, processed_obs):
+        obs, reward, done, info = self._env.finish_step_after_tick(processed_obs)
+        return self._postprocess_step(obs, reward, done, info)
+
+    @property
+    def obs_params(self):
+        return self._env.obs_params
+
+    def _postprocess_step(self, obs, reward, done, info):
         self.is_running = self._env.is_running
         reward, info = self._preprocess_reward(reward, info)
         obs = self._preprocess_obs(obs)
@@ -16,16 +16,14 @@ import random
 import carla
 import gymnasium as gym
 import numpy as np
-import pygame
 from gymnasium import spaces
-from skimage.transform import resize
 
 from safebench.gym_carla.envs.misc import (
-    display_to_rgb,
+    display_array_to_surface,
     get_lane_dis,
     get_pos,
     get_preview_lane_dis,
-    rgb_to_display_surface,
+    process_observation,
 )
 from safebench.gym_carla.envs.route_planner import RoutePlanner
 from safebench.scenario.scenario_definition.perception_scenario import (
@@ -133,6 +131,15 @@ class CarlaEnv(gym.Env):
 
         # define obs space
         self.observation_space = spaces.Dict(observation_space_dict)
+        # parameters of `process_observation`, which may run in a worker process
+        self.obs_params = {
+            "obs_size": self.obs_size,
+            "display_size": self.display_size,
+            "obs_range": self.obs_range,
+            "d_behind": self.d_behind,
+            "lidar_bin": self.lidar_bin,
+            "lidar_height": self.lidar_height,
+        }
 
         # action and observation spaces
         self.discrete = env_params["discrete"]
@@ -401,6 +408,12 @@ class CarlaEnv(gym.Env):
             raise Exception()
 
     def step_after_tick(self):
+        obs_inputs = self.prepare_step_after_tick()
+        return self.finish_step_after_tick(process_observation(obs_inputs, self.obs_params))
+
+    def prepare_step_after_tick(self):
+        """Read everything needed from CARLA after a tick and return the inputs of
+        `process_observation`, to be passed to `finish_step_after_tick` once processed."""
         # Append actors polygon list
         vehicle_poly_dict = self._get_actor_polygons("vehicle.*")
         self.vehicle_polygons.append(vehicle_poly_dict)
@@ -440,7 +453,15 @@ class CarlaEnv(gym.Env):
         self.time_step += 1
         self.total_step += 1
 
-        return (self._get_obs(), self._get_reward(), self._terminal(), self._get_info())
+        return self._get_obs_inputs()
+
+    def finish_step_after_tick(self, processed_obs):
+        return (
+            self._get_obs(processed_obs),
+            self._get_reward(),
+            self._terminal(),
+            self._get_info(),
+        )
 
     def _get_info(self):
         # state information
@@ -517,7 +538,7 @@ class CarlaEnv(gym.Env):
             actor_velocity_dict,
         )
 
-    def _get_obs(self):
+    def _get_obs_inputs(self):
         # State observation
         ego_trans = self.ego_vehicle.get_transform()
         ego_x = ego_trans.location.x
@@ -530,8 +551,9 @@ class CarlaEnv(gym.Env):
         v = self.ego_vehicle.get_velocity()
         speed = np.sqrt(v.x**2 + v.y**2)
         acc = self.ego_vehicle.get_acceleration()
-        state = np.array([lateral_dis, -delta_yaw, speed, self.vehicle_front])
+        self.obs_state = np.array([lateral_dis, -delta_yaw, speed, self.vehicle_front])
 
+        obs_inputs = {"camera": self.camera_img}
         if self.scenario_category != "perception":
             # set ego information for birdeye_render
             self.birdeye_render.set_hero(self.ego_vehicle, self.ego_vehicle.id)
@@ -541,77 +563,55 @@ class CarlaEnv(gym.Env):
 
             # render birdeye image with the birdeye_render
             birdeye_render_types = ["roadmap", "actors", "waypoints"]
-            birdeye_surface = self.birdeye_render.render(birdeye_render_types)
-            birdeye_surface = pygame.surfarray.array3d(birdeye_surface)
-            center = (
-                int(birdeye_surface.shape[0] / 2),
-                int(birdeye_surface.shape[1] / 2),
+            obs_inputs["birdeye"] = self.birdeye_render.render_birdeye(
+                birdeye_render_types, self.display_size
             )
-            width = height = int(self.display_size / 2)
-            birdeye = birdeye_surface[
-                center[0] - width : center[0] + width,
-                center[1] - height : center[1] + height,
-            ]
-            birdeye = display_to_rgb(birdeye, self.obs_size)
 
             if not self.disable_lidar:
-                # get Lidar image
+                # get Lidar points
                 point_cloud = np.copy(np.frombuffer(self.lidar_data.raw_data, dtype=np.dtype("f4")))
-                point_cloud = np.reshape(point_cloud, (int(point_cloud.shape[0] / 4), 4))
-                x = point_cloud[:, 0:1]
-                y = point_cloud[:, 1:2]
-                z = point_cloud[:, 2:3]
-                intensity = point_cloud[:, 3:4]
-                point_cloud = np.concatenate([y, -x, z], axis=1)
-                # Separate the 3D space to bins for point cloud, x and y is set according to self.lidar_bin, and z is set to be two bins.
-                y_bins = np.arange(
-                    -(self.obs_range - self.d_behind),
-                    self.d_behind + self.lidar_bin,
-                    self.lidar_bin,
-                )
-                x_bins = np.arange(
-                    -self.obs_range / 2,
-                    self.obs_range / 2 + self.lidar_bin,
-                    self.lidar_bin,
+                obs_inputs["point_cloud"] = np.reshape(
+                    point_cloud, (int(point_cloud.shape[0] / 4), 4)
                 )
-                z_bins = [-self.lidar_height - 1, -self.lidar_height + 0.25, 1]
-                # Get lidar image according to the bins
-                lidar, _ = np.histogramdd(point_cloud, bins=(x_bins, y_bins, z_bins))
-                lidar[:, :, 0] = np.array(lidar[:, :, 0] > 0, dtype=np.uint8)
-                lidar[:, :, 1] = np.array(lidar[:, :, 1] > 0, dtype=np.uint8)
-                wayptimg = birdeye[:, :, 0] < 0  # Equal to a zero matrix
-                wayptimg = np.expand_dims(wayptimg, axis=2)
-                wayptimg = np.fliplr(np.rot90(wayptimg, 3))
-                # Get the final lidar image
-                lidar = np.concatenate((lidar, wayptimg), axis=2)
-                lidar = np.flip(lidar, axis=1)
-                lidar = np.rot90(lidar, 1) * 255
-
-                # display birdeye image
-                birdeye_surface = rgb_to_display_surface(birdeye, self.display_size)
-                self.display.blit(birdeye_surface, (0, self.env_id * self.display_size))
+        return obs_inputs
 
+    def _get_obs(self, processed_obs=None):
+        if processed_obs is None:
+            processed_obs = process_observation(self._get_obs_inputs(), self.obs_params)
+        state = self.obs_state
+        camera = processed_obs["camera"]
+
+        if self.scenario_category != "perception":
+            birdeye = processed_obs["birdeye"]
+            # display birdeye image
+            birdeye_surface = display_array_to_surface(
+                processed_obs["birdeye_display"], self.display_size
+            )
+            self.display.blit(birdeye_surface, (0, self.env_id * self.display_size))
+
+            if not self.disable_lidar:
+                lidar = processed_obs["lidar"]
                 # display lidar image
-                lidar_surface = rgb_to_display_surface(lidar, self.display_size)
+                lidar_surface = display_array_to_surface(
+                    processed_obs["lidar_display"], self.display_size
+                )
                 self.display.blit(
                     lidar_surface, (self.display_size, self.env_id * self.display_size)
                 )
 
                 # display camera image
-                camera = resize(self.camera_img, (self.obs_size, self.obs_size)) * 255
-                camera_surface = rgb_to_display_surface(camera, self.display_size)
+                camera_surface = display_array_to_surface(
+                    processed_obs["camera_display"], self.display_size
+                )
                 self.display.blit(
                     camera_surface,
                     (self.display_size * 2, self.env_id * self.display_size),
                 )
             else:
-                # display birdeye image
-                birdeye_surface = rgb_to_display_surface(birdeye, self.display_size)
-                self.display.blit(birdeye_surface, (0, self.env_id * self.display_size))
-
                 # display camera image
-                camera = resize(self.camera_img, (self.obs_size, self.obs_size)) * 255
-                camera_surface = rgb_to_display_surface(camera, self.display_size)
+                camera_surface = display_array_to_surface(
+                    processed_obs["camera_display"], self.display_size
+                )
                 self.display.blit(
                     camera_surface, (self.display_size, self.env_id * self.display_size)
                 )
@@ -624,8 +624,9 @@ class CarlaEnv(gym.Env):
             }
         else:
             """Get the observations for object detection."""
-            camera = resize(self.camera_img, (self.obs_size, self.obs_size)) * 255
-            camera_surface = rgb_to_display_surface(camera, self.display_size)
+            camera_surface = display_array_to_surface(
+                processed_obs["camera_display"], self.display_size
+            )
             self.display.blit(camera_surface, (0, self.env_id * self.display_size))
 
             obs = {
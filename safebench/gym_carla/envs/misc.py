@@ -17,9 +17,10 @@ import carla
 import cv2
 import numpy as np
 import pygame
-import skimage
 from matplotlib.path import Path
 
+from safebench.gym_carla.envs.preprocessing import resize_image
+
 
 def get_speed(vehicle):
     """
@@ -235,17 +236,16 @@ def set_carla_transform(pose):
     return transform
 
 
-def display_to_rgb(display, obs_size):
+def display_to_rgb(display, obs_size, name=None):
     """
     Transform image grabbed from pygame display to an rgb image uint8 matrix
     :param display: pygame display input
     :param obs_size: rgb image size
+    :param name: preallocated buffer to write the image into, see `resize_image`
     :return: rgb image uint8 matrix
     """
     rgb = np.fliplr(np.rot90(display, 3))  # flip to regular view
-    rgb = skimage.transform.resize(rgb, (obs_size, obs_size))  # resize
-    rgb = rgb * 255
-    return rgb
+    return resize_image(rgb, obs_size, name)
 
 
 def rgb_to_display_surface(rgb, display_size):
@@ -255,14 +255,148 @@ def rgb_to_display_surface(rgb, display_size):
     :param display_size: display size
     :return: pygame surface
     """
-    surface = pygame.Surface((display_size, display_size)).convert()
-    display = skimage.transform.resize(rgb, (display_size, display_size))
+    return display_array_to_surface(rgb_to_display_array(rgb, display_size), display_size)
+
+
+def rgb_to_display_array(rgb, display_size, name=None):
+    """
+    Resize and rotate an rgb image to the layout of a pygame surface, without touching pygame
+    :param rgb: rgb image uint8 matrix
+    :param display_size: display size
+    :param name: preallocated buffer to write the image into, see `resize_image`
+    :return: array to blit on a surface of size display_size
+    """
+    display = resize_image(rgb, display_size, name)
     display = np.flip(display, axis=1)
     display = np.rot90(display, 1)
+    return display
+
+
+def display_array_to_surface(display, display_size):
+    surface = pygame.Surface((display_size, display_size)).convert()
     pygame.surfarray.blit_array(surface, display)
     return surface
 
 
+class LidarRasterizer:
+    """
+    Bird-eye view occupancy grid of lidar point clouds, the same as binning the points with
+    `np.histogramdd`, but computing the bin of each point directly and counting the points of
+    each cell with a single `np.bincount`. The grid and the image are allocated once and
+    overwritten by each call, so copy them if they must outlive the next point cloud.
+    """
+
+    def __init__(self, obs_size, obs_range, d_behind, lidar_bin, lidar_height):
+        # The columns of the image bin the lidar y axis, the rows bin -x (rows grow backwards)
+        self.col_edges = np.arange(-obs_range / 2, obs_range / 2 + lidar_bin, lidar_bin)
+        self.row_edges = np.arange(-(obs_range - d_behind), d_behind + lidar_bin, lidar_bin)
+        # Two height bins: the ground, and everything above it
+        self.z_edges = np.array([-lidar_height - 1, -lidar_height + 0.25, 1])
+        self.num_rows = len(self.row_edges) - 1
+        self.num_cols = len(self.col_edges) - 1
+        self.grid = np.zeros((self.num_rows, self.num_cols, 2), dtype=bool)
+        # The third channel is kept empty, like the waypoint channel of the other images
+        self.image = np.zeros((obs_size, obs_size, 3))
+
+    @staticmethod
+    def bin_indices(values, edges):
+        """
+        Bin of each value for sorted, evenly spaced edges, with the conventions of
+        `np.histogramdd`: bins are [left, right) except the last one, [left, right].
+        :return: (bin indices, mask of the values inside the edges)
+        """
+        last_bin = len(edges) - 2
+        indices = np.floor((values - edges[0]) / (edges[1] - edges[0])).astype(np.int64)
+        np.clip(indices, 0, last_bin, out=indices)
+        # The division may round a value next to an edge into the neighbouring bin
+        indices -= values < edges[indices]
+        indices += (values >= edges[indices + 1]) & (indices < last_bin)
+        inside = (values >= edges[0]) & (values <= edges[-1])
+        return indices, inside
+
+    def occupancy(self, point_cloud):
+        """
+        :param point_cloud: lidar points of shape (N, 3) or more columns, in the lidar frame
+        :return: boolean grid of shape (rows, cols, 2), ground and obstacle heights
+        """
+        rows, inside = self.bin_indices(-point_cloud[:, 0], self.row_edges)
+        cols, inside_cols = self.bin_indices(point_cloud[:, 1], self.col_edges)
+        heights = point_cloud[:, 2]
+        inside &= inside_cols
+        inside &= (heights >= self.z_edges[0]) & (heights <= self.z_edges[-1])
+        cells = (rows * self.num_cols + cols) * 2 + (heights >= self.z_edges[1])
+        counts = np.bincount(cells[inside], minlength=self.grid.size)
+        np.greater(counts.reshape(self.grid.shape), 0, out=self.grid)
+        return self.grid
+
+    def rasterize(self, point_cloud):
+        """
+        :param point_cloud: raw lidar points of shape (N, 4)
+        :return: lidar image float matrix of shape (obs_size, obs_size, 3), 0 or 255
+        """
+        grid = self.occupancy(point_cloud)
+        np.multiply(grid, 255.0, out=self.image[:, :, :2])
+        return self.image
+
+
+_LIDAR_RASTERIZERS = {}
+
+
+def get_lidar_rasterizer(obs_size, obs_range, d_behind, lidar_bin, lidar_height):
+    """The LidarRasterizer of the given parameters, shared by the whole process"""
+    key = (obs_size, obs_range, d_behind, lidar_bin, lidar_height)
+    if key not in _LIDAR_RASTERIZERS:
+        _LIDAR_RASTERIZERS[key] = LidarRasterizer(*key)
+    return _LIDAR_RASTERIZERS[key]
+
+
+def lidar_to_image(point_cloud, obs_size, obs_range, d_behind, lidar_bin, lidar_height):
+    """
+    Bin a lidar point cloud into a bird-eye view image
+    :param point_cloud: raw lidar points of shape (N, 4)
+    :return: lidar image float matrix of shape (obs_size, obs_size, 3), overwritten by the next
+        call with the same parameters, see `LidarRasterizer`
+    """
+    rasterizer = get_lidar_rasterizer(obs_size, obs_range, d_behind, lidar_bin, lidar_height)
+    return rasterizer.rasterize(point_cloud)
+
+
+def process_observation(inputs, params):
+    """
+    The part of the observation that only needs the arrays read from CARLA, so that it can run
+    outside of the simulation process
+    :param inputs: dict with "camera" and optionally "birdeye" (cropped render) and "point_cloud"
+    :param params: dict with obs_size, display_size, obs_range, d_behind, lidar_bin, lidar_height
+    :return: dict of images and of the arrays to display them, written into buffers that are
+        reused by the next call
+    """
+    obs_size = params["obs_size"]
+    display_size = params["display_size"]
+    outputs = {}
+    if "birdeye" in inputs:
+        outputs["birdeye"] = display_to_rgb(inputs["birdeye"], obs_size, "birdeye")
+        outputs["birdeye_display"] = rgb_to_display_array(
+            outputs["birdeye"], display_size, "birdeye_display"
+        )
+    if "point_cloud" in inputs:
+        outputs["lidar"] = lidar_to_image(
+            inputs["point_cloud"],
+            obs_size,
+            params["obs_range"],
+            params["d_behind"],
+            params["lidar_bin"],
+            params["lidar_height"],
+        )
+        outputs["lidar_display"] = rgb_to_display_array(
+            outputs["lidar"], display_size, "lidar_display"
+        )
+    outputs["camera"] = resize_image(inputs["camera"], obs_size, "camera")
+    outputs["camera_display"] = rgb_to_display_array(
+        outputs["camera"], display_size, "camera_display"
+    )
+    return outputs
+
+
 def get_image_point(loc, K, w2c):
     # Calculate 2D projection of 3D coordinate
 
@@ -0,0 +1,51 @@
+"""
+Description:
+    Image preprocessing of the observations with OpenCV. The images are resized with
+    `cv2.resize` straight into preallocated uint8 buffers, instead of being converted to float64
+    and allocated again at every step of every environment.
+"""
+
+import cv2
+import numpy as np
+
+_BUFFERS = {}
+
+
+def get_buffer(name, shape):
+    """
+    The uint8 buffer of the given name and shape, allocated on the first request and shared by
+    the whole process afterwards
+    """
+    key = (name, tuple(shape))
+    if key not in _BUFFERS:
+        _BUFFERS[key] = np.empty(shape, dtype=np.uint8)
+    return _BUFFERS[key]
+
+
+def clear_buffers():
+    _BUFFERS.clear()
+
+
+def resize_image(image, size, name=None, interpolation=None):
+    """
+    Resize an image to a square uint8 image. By default, `INTER_AREA` averages the pixels covered
+    by each output pixel when shrinking, like the anti-aliasing of `skimage.transform.resize`, and
+    `INTER_LINEAR` interpolates bilinearly when enlarging, like its default order.
+    :param image: (H, W) or (H, W, C) image, uint8 or float in [0, 255]
+    :param size: side of the output image
+    :param name: buffer to write the result into, overwritten by the next call with the same name
+        and shape. A new array is returned when None
+    :return: uint8 image of shape (size, size) or (size, size, C)
+    """
+    if image.dtype != np.uint8:
+        # rounds and saturates to [0, 255]
+        image = cv2.convertScaleAbs(image)
+    shape = (size, size) + image.shape[2:]
+    out = get_buffer(name, shape) if name is not None else np.empty(shape, dtype=np.uint8)
+    if image.shape == shape:
+        np.copyto(out, image)
+        return out
+    if interpolation is None:
+        shrinking = size * size < image.shape[0] * image.shape[1]
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    return cv2.resize(image, (size, size), dst=out, interpolation=interpolation)
@@ -11,10 +11,14 @@ Description:
     For a copy, see <https://opensource.org/licenses/MIT>
 """
 
+import hashlib
 import math
+import os
 import weakref
 
 import carla
+import cv2
+import numpy as np
 import pygame
 
 # Colors
@@ -58,6 +62,9 @@ COLOR_ALUMINIUM_5 = pygame.Color(46, 52, 54)
 COLOR_WHITE = pygame.Color(255, 255, 255)
 COLOR_BLACK = pygame.Color(0, 0, 0)
 
+# Fractional bits of the coordinates given to the OpenCV drawing functions
+SUBPIXEL_BITS = 4
+
 
 class Util(object):
     @staticmethod
@@ -86,11 +93,20 @@ class Util(object):
 
 
 class MapImage(object):
-    def __init__(self, carla_world, carla_map, pixels_per_meter, logger):
-        logger.log(">> Drawing the map of the entire town. This may take a while...")
+    def __init__(self, carla_world, carla_map, pixels_per_meter, logger, cache_dir=None):
         self._pixels_per_meter = pixels_per_meter
         self.scale = 1.0
+        self.pixels = None
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = self.get_cache_path(cache_dir, carla_map, pixels_per_meter)
+            if os.path.exists(cache_path):
+                logger.log(f">> Loading the map of the entire town from {cache_path}")
+                self.load_cache(cache_path)
+                return
 
+        logger.log(">> Drawing the map of the entire town. This may take a while...")
         waypoints = carla_map.generate_waypoints(2)
         margin = 50
         max_x = max(waypoints, key=lambda x: x.transform.location.x).transform.location.x + margin
@@ -116,6 +132,48 @@ class MapImage(object):
         )
         self.surface = self.big_map_surface
 
+        if cache_path is not None:
+            self.save_cache(cache_path)
+
+    @staticmethod
+    def get_cache_path(cache_dir, carla_map, pixels_per_meter):
+        # The OpenDRIVE hash invalidates the cache when the town is modified
+        map_name = carla_map.name.split("/")[-1]
+        opendrive_hash = hashlib.sha256(carla_map.to_opendrive().encode("utf-8")).hexdigest()
+        return os.path.join(
+            cache_dir, f"{map_name}_{opendrive_hash[:16]}_{float(pixels_per_meter):g}.npz"
+        )
+
+    def save_cache(self, cache_path):
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        # np.savez_compressed appends .npz to names without it, so keep the suffix on the tmp file
+        tmp_path = f"{cache_path[:-len('.npz')]}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            pixels=pygame.surfarray.array3d(self.big_map_surface),
+            width=self.width,
+            world_offset=np.array(self._world_offset, dtype=np.float64),
+        )
+        os.replace(tmp_path, cache_path)
+
+    def load_cache(self, cache_path):
+        with np.load(cache_path) as data:
+            pixels = data["pixels"]
+            self.width = float(data["width"])
+            self._world_offset = tuple(float(x) for x in data["world_offset"])
+        self.big_map_surface = pygame.Surface(pixels.shape[:2]).convert()
+        pygame.surfarray.blit_array(self.big_map_surface, pixels)
+        self.surface = self.big_map_surface
+        self.pixels = np.ascontiguousarray(pixels.transpose(1, 0, 2))
+
+    def get_pixels(self):
+        """The map as an RGB array indexed [y][x], as OpenCV expects it"""
+        if self.pixels is None:
+            self.pixels = np.ascontiguousarray(
+                pygame.surfarray.array3d(self.surface).transpose(1, 0, 2)
+            )
+        return self.pixels
+
     def draw_road_map(
         self, map_surface, carla_world, carla_map, world_to_pixel, world_to_pixel_width
     ):
@@ -415,10 +473,33 @@ class MapImage(object):
     def world_to_pixel_width(self, width):
         return int(self.scale * self._pixels_per_meter * width)
 
+    def world_to_pixel_array(self, points):
+        """Vectorized `world_to_pixel` of an (..., 2) array, without rounding"""
+        return (
+            self.scale
+            * self._pixels_per_meter
+            * (np.asarray(points, dtype=np.float64)[..., :2] - np.array(self._world_offset))
+        )
+
+
+def make_birdeye_params(env_params, scenario_config):
+    """Parameters of BirdeyeRender from the env parameters and the options of the runner"""
+    pixels_per_meter = env_params["display_size"] / env_params["obs_range"]
+    pixels_ahead_vehicle = (env_params["obs_range"] / 2 - env_params["d_behind"]) * pixels_per_meter
+    return {
+        "screen_size": [env_params["display_size"], env_params["display_size"]],
+        "pixels_per_meter": pixels_per_meter,
+        "pixels_ahead_vehicle": pixels_ahead_vehicle,
+        "map_cache_dir": scenario_config.get("map_cache_dir"),
+        "birdeye_backend": scenario_config.get("birdeye_backend", "pygame"),
+    }
+
 
 class BirdeyeRender(object):
     def __init__(self, world, params, logger):
         self.params = params
+        # "pygame" blits and rotates surfaces of the whole map, "array" warps only the crop
+        self.backend = self.params.get("birdeye_backend", "pygame")
         self.server_fps = 0.0
         self.simulation_time = 0
         self.server_clock = pygame.time.Clock()
@@ -446,6 +527,7 @@ class BirdeyeRender(object):
             carla_map=self.town_map,
             pixels_per_meter=self.params["pixels_per_meter"],
             logger=logger,
+            cache_dir=self.params.get("map_cache_dir"),
         )
         self.original_surface_size = min(
             self.params["screen_size"][0], self.params["screen_size"][1]
@@ -634,3 +716,102 @@ class BirdeyeRender(object):
             return rotated_result_surface
         else:
             raise ValueError("hero_actor is None")
+
+    def render_birdeye(self, render_types, size):
+        """
+        The birdeye image of size x size pixels around the hero, indexed [x][y] like
+        `pygame.surfarray`, from the backend selected by the "birdeye_backend" parameter
+        """
+        if self.backend == "array":
+            return self.render_array(render_types, size)
+        birdeye_surface = pygame.surfarray.array3d(self.render(render_types))
+        center = (int(birdeye_surface.shape[0] / 2), int(birdeye_surface.shape[1] / 2))
+        half = int(size / 2)
+        return birdeye_surface[
+            center[0] - half : center[0] + half,
+            center[1] - half : center[1] + half,
+        ]
+
+    def get_crop_transform(self, size):
+        """
+        The affine transform (2x3) from the map pixels to the pixels of the crop, i.e. the
+        translation and rotation `render` applies with its clipping rect and `rotozoom`
+        """
+        angle = math.radians(self.hero_transform.rotation.yaw + 90.0)
+        hero_front = self.hero_transform.get_forward_vector()
+        center = self.map_image.world_to_pixel_array(
+            [self.hero_transform.location.x, self.hero_transform.location.y]
+        ) + self.params["pixels_ahead_vehicle"] * np.array([hero_front.x, hero_front.y])
+        # rotozoom turns counterclockwise on the screen, whose y axis points down
+        rotation = np.array(
+            [[math.cos(angle), math.sin(angle)], [-math.sin(angle), math.cos(angle)]]
+        )
+        translation = size / 2 - rotation @ center
+        return np.hstack([rotation, translation[:, None]])
+
+    @staticmethod
+    def _to_crop_points(map_points, crop_transform):
+        # Fixed point coordinates with 4 fractional bits, for the `shift` of the OpenCV drawing
+        points = map_points @ crop_transform[:, :2].T + crop_transform[:, 2]
+        return np.round(points * (1 << SUBPIXEL_BITS)).astype(np.int32)
+
+    def _fill_hist_actors(self, canvas, actor_polygons, actor_type, crop_transform, num):
+        lp = len(actor_polygons)
+        for i in range(max(0, lp - num), lp):
+            color_value = math.floor(max(0.8 - 0.8 / lp * (i + 1), 0) * 255)
+            hero_color = (255, color_value, color_value)  # red
+            if actor_type == "vehicle":
+                color = (color_value, 255, color_value)  # green
+            else:
+                color = (255, 255, color_value)  # yellow
+
+            others, heros = [], []
+            for ID, poly in actor_polygons[i].items():
+                if ID == self.hero_id or ID in self.heros_in_all_envs:
+                    heros.append(poly)
+                else:
+                    others.append(poly)
+            for polygons, polygon_color in ((others, color), (heros, hero_color)):
+                if len(polygons) == 0:
+                    continue
+                map_points = self.map_image.world_to_pixel_array(np.array(polygons))
+                # One call per polygon, fillPoly would leave the overlaps of a list unfilled
+                for crop_points in self._to_crop_points(map_points, crop_transform):
+                    cv2.fillPoly(canvas, [crop_points], polygon_color, shift=SUBPIXEL_BITS)
+
+    def render_array(self, render_types, size):
+        """
+        Array-native version of `render_birdeye`: the precomputed map raster is warped once into
+        the crop, then the waypoints and the actors are drawn on it directly in crop pixels
+        """
+        if self.hero_actor is None:
+            raise ValueError("hero_actor is None")
+        self.hero_transform = self.hero_actor.get_transform()
+        crop_transform = self.get_crop_transform(size)
+
+        if render_types is None or "roadmap" in render_types:
+            canvas = cv2.warpAffine(
+                self.map_image.get_pixels(),
+                crop_transform,
+                (size, size),
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=0,
+            )
+        else:
+            canvas = np.zeros((size, size, 3), dtype=np.uint8)
+
+        if (render_types is None or "waypoints" in render_types) and len(self.waypoints) > 1:
+            if self.red_light:
+                color = (math.floor(0.5 * 255), 0, math.floor(0.5 * 255))  # purple
+            else:
+                color = (0, 0, 255)  # blue
+            map_points = self.map_image.world_to_pixel_array(np.array(self.waypoints))
+            crop_points = self._to_crop_points(map_points, crop_transform)
+            cv2.polylines(canvas, [crop_points], False, color, 10, shift=SUBPIXEL_BITS)
+
+        if render_types is None or "actors" in render_types:
+            self._fill_hist_actors(canvas, self.vehicle_polygons, "vehicle", crop_transform, 10)
+            self._fill_hist_actors(canvas, self.walker_polygons, "walker", crop_transform, 10)
+
+        return canvas.transpose(1, 0, 2)
@@ -8,13 +8,95 @@ Description:
     For a copy, see <https://opensource.org/licenses/MIT>
 """
 
+import os
+
 import numpy as np
 import torch
 
+from safebench.gym_carla.buffer_persistence import load_state, save_state
+
+TRANSITION_FIELDS = ("ego_actions", "scenario_actions", "obs", "next_obs", "rewards", "dones")
+
+
+class RingStorage:
+    """
+    Fixed-capacity storage with one ring of `capacity` rows per scenario.
+    Each field is a preallocated array of shape [num_scenario * capacity, ...], created at the first write.
+    """
+
+    def __init__(self, num_scenario, capacity):
+        self.num_scenario = num_scenario
+        self.capacity = capacity
+        self.fields = {}
+        self.cursor = np.zeros(num_scenario, dtype=np.int64)
+        self.size = np.zeros(num_scenario, dtype=np.int64)
+
+    def __len__(self):
+        return int(self.size.sum())
+
+    def add(self, sid, data):
+        """Write one transition of a scenario, returns its storage row"""
+        if self.capacity == 0:
+            return None
+        row = sid * self.capacity + self.cursor[sid]
+        for name, value in data.items():
+            value = np.asarray(value)
+            if name not in self.fields:
+                self.fields[name] = np.zeros(
+                    (self.num_scenario * self.capacity,) + value.shape, dtype=value.dtype
+                )
+            self.fields[name][row] = value
+        self.cursor[sid] = (self.cursor[sid] + 1) % self.capacity
+        self.size[sid] = min(self.size[sid] + 1, self.capacity)
+        return row
+
+    def rows(self, index):
+        """Map positions in the scenario-by-scenario chronological order to storage rows"""
+        end = np.cumsum(self.size)
+        sid = np.searchsorted(end, index, side="right")
+        offset = index - (end[sid] - self.size[sid])
+        slot = (self.cursor[sid] - self.size[sid] + offset) % self.capacity
+        return sid * self.capacity + slot
+
+    def get(self, name, index):
+        return self.fields[name][self.rows(index)]
+
+    def scenario_view(self, name, sid):
+        """Chronological values of one scenario"""
+        if name not in self.fields or self.size[sid] == 0:
+            return np.zeros(0)
+        slot = (self.cursor[sid] - self.size[sid] + np.arange(self.size[sid])) % self.capacity
+        return self.fields[name][sid * self.capacity + slot]
+
+    def state_dict(self):
+        return {"fields": self.fields, "cursor": self.cursor, "size": self.size}
+
+    def load_state_dict(self, state):
+        """Raises a ValueError if the state was saved with another num_scenario or capacity"""
+        num_rows = self.num_scenario * self.capacity
+        for name, value in state["fields"].items():
+            if len(value) != num_rows:
+                raise ValueError(
+                    f"Field '{name}' has {len(value)} rows, expected num_scenario * capacity = "
+                    f"{self.num_scenario} * {self.capacity}: the buffer was saved with another "
+                    "num_scenario or buffer_capacity"
+                )
+        for key in ("cursor", "size"):
+            if np.shape(state[key]) != (self.num_scenario,):
+                raise ValueError(
+                    f"The {key} of the saved buffer has shape {np.shape(state[key])}, expected "
+                    f"({self.num_scenario},): the buffer was saved with another num_scenario"
+                )
+        self.fields = state["fields"]
+        self.cursor = state["cursor"]
+        self.size = state["size"]
+
 
 class RouteReplayBuffer:
     """
     This buffer supports parallel storing transitions from multiple trajectories.
+    Only the latest buffer_capacity // num_scenario transitions of each scenario are sampled,
+    so they are kept in preallocated rings of that size (1/100 of it for collision transitions).
     """
 
     def __init__(self, num_scenario, mode, buffer_capacity=1000):
@@ -31,21 +113,11 @@ class RouteReplayBuffer:
         self.reset_init_buffer()
 
     def reset_buffer(self):
-        self.buffer_ego_actions = [[] for _ in range(self.num_scenario)]
-        self.buffer_scenario_actions = [[] for _ in range(self.num_scenario)]
-        self.buffer_obs = [[] for _ in range(self.num_scenario)]
-        self.buffer_next_obs = [[] for _ in range(self.num_scenario)]
-        self.buffer_rewards = [[] for _ in range(self.num_scenario)]
-        self.buffer_dones = [[] for _ in range(self.num_scenario)]
-        self.buffer_additional_dict = [{} for _ in range(self.num_scenario)]
-
-        self.collision_buffer_ego_actions = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_scenario_actions = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_obs = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_next_obs = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_rewards = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_dones = [[] for _ in range(self.num_scenario)]
-        self.collision_buffer_additional_dict = [{} for _ in range(self.num_scenario)]
+        samples_per_trajectory = self.buffer_capacity // self.num_scenario
+        self.buffer = RingStorage(self.num_scenario, samples_per_trajectory)
+        self.collision_buffer = RingStorage(self.num_scenario, samples_per_trajectory // 100)
+        self.info_keys = []
+        self.collision_info_keys = []
 
     def reset_init_buffer(self):
         self.buffer_static_obs = []
@@ -54,50 +126,32 @@ class RouteReplayBuffer:
         self.buffer_init_additional_dict = {}
         self.init_buffer_len = 0
 
-    def save_buffer(self, path):
-        torch.save(
-            {
-                "buffer_ego_actions": self.buffer_ego_actions,
-                "buffer_scenario_actions": self.buffer_scenario_actions,
-                "buffer_next_obs": self.buffer_next_obs,
-                "buffer_obs": self.buffer_obs,
-                "buffer_rewards": self.buffer_rewards,
-                "buffer_dones": self.buffer_dones,
-                "buffer_additional_dict": self.buffer_additional_dict,
-                "collision_buffer_ego_actions": self.collision_buffer_ego_actions,
-                "collision_buffer_scenario_actions": self.collision_buffer_scenario_actions,
-                "collision_buffer_next_obs": self.collision_buffer_next_obs,
-                "collision_buffer_obs": self.collision_buffer_obs,
-                "collision_buffer_rewards": self.collision_buffer_rewards,
-                "collision_buffer_dones": self.collision_buffer_dones,
-                "collision_buffer_additional_dict": self.collision_buffer_additional_dict,
-                "buffer_static_obs": self.buffer_static_obs,
-                "buffer_init_action": self.buffer_init_action,
-                "buffer_episode_reward": self.buffer_episode_reward,
-                "buffer_init_additional_dict": self.buffer_init_additional_dict,
-                "buffer_len": self.buffer_len,
-                "collision_buffer_len": self.collision_buffer_len,
-                "init_buffer_len": self.init_buffer_len,
-            },
-            path,
-        )
+    def state_dict(self):
+        return {
+            "buffer": self.buffer.state_dict(),
+            "collision_buffer": self.collision_buffer.state_dict(),
+            "info_keys": self.info_keys,
+            "collision_info_keys": self.collision_info_keys,
+            "buffer_static_obs": self.buffer_static_obs,
+            "buffer_init_action": self.buffer_init_action,
+            "buffer_episode_reward": self.buffer_episode_reward,
+            "buffer_init_additional_dict": self.buffer_init_additional_dict,
+            "buffer_len": self.buffer_len,
+            "collision_buffer_len": self.collision_buffer_len,
+            "init_buffer_len": self.init_buffer_len,
+        }
 
-    def load_buffer(self, path):
-        data = torch.load(path)
-        self.buffer_ego_actions = data["buffer_ego_actions"]
-        self.buffer_scenario_actions = data["buffer_scenario_actions"]
-        self.buffer_next_obs = data["buffer_next_obs"]
-        self.buffer_obs = data["buffer_obs"]
-        self.buffer_rewards = data["buffer_rewards"]
-        self.buffer_dones = data["buffer_dones"]
-        self.buffer_additional_dict = data["buffer_additional_dict"]
-        self.collision_buffer_ego_actions = data["collision_buffer_ego_actions"]
-        self.collision_buffer_scenario_actions = data["collision_buffer_scenario_actions"]
-        self.collision_buffer_next_obs = data["collision_buffer_next_obs"]
-        self.collision_buffer_obs = data["collision_buffer_obs"]
-        self.collision_buffer_rewards = data["collision_buffer_rewards"]
-        self.collision_buffer_dones = data["collision_buffer_dones"]
-        self.collision_buffer_additional_dict = data["collision_buffer_additional_dict"]
+    def load_state_dict(self, data):
+        if "buffer" not in data:
+            self.load_legacy_state_dict(data)
+            return
+        self.buffer.load_state_dict(data["buffer"])
+        self.collision_buffer.load_state_dict(data["collision_buffer"])
+        self.info_keys = data["info_keys"]
+        self.collision_info_keys = data["collision_info_keys"]
+        self.load_common_state_dict(data)
+
+    def load_common_state_dict(self, data):
         self.buffer_static_obs = data["buffer_static_obs"]
         self.buffer_init_action = data["buffer_init_action"]
         self.buffer_episode_reward = data["buffer_episode_reward"]
@@ -106,16 +160,61 @@ class RouteReplayBuffer:
         self.collision_buffer_len = data["collision_buffer_len"]
         self.init_buffer_len = data["init_buffer_len"]
 
+    def load_legacy_state_dict(self, data):
+        """
+        Converts a buffer saved as per-scenario lists of transitions (the format used before the
+        ring storages) by storing again the latest transitions of each scenario, the ones
+        `sample` can still return
+        """
+        if "buffer_rewards" not in data:
+            raise ValueError(
+                "Unknown replay buffer format: neither ring storages ('buffer') nor lists of "
+                "transitions ('buffer_rewards')"
+            )
+        self.reset_buffer()
+        for prefix, collision in (("buffer_", False), ("collision_buffer_", True)):
+            num_scenario = min(self.num_scenario, len(data[f"{prefix}rewards"]))
+            for sid in range(num_scenario):
+                num_transitions = len(data[f"{prefix}rewards"][sid])
+                infos = data[f"{prefix}additional_dict"][sid]
+                for index in range(max(0, num_transitions - self.buffer.capacity), num_transitions):
+                    transition = {
+                        name: data[f"{prefix}{name}"][sid][index] for name in TRANSITION_FIELDS
+                    }
+                    info = {}
+                    for key, values in infos.items():
+                        # the info lists are aligned with the transitions on their latest entry
+                        info_index = index - num_transitions + len(values)
+                        if 0 <= info_index < len(values):
+                            info[key] = values[info_index]
+                    info["collision"] = collision
+                    self.add_transition(sid, transition, info)
+        self.load_common_state_dict(data)
+
+    def save_buffer(self, path):
+        """Writes the buffer to the folder `path`, one .npy file per storage field"""
+        save_state(path, self.state_dict())
+
+    def load_buffer(self, path):
+        """
+        Maps the fields saved by `save_buffer` lazily. A file is read with torch.load instead, it
+        may hold ring storages or the older lists of transitions, see `load_legacy_state_dict`
+        """
+        if os.path.isdir(path):
+            self.load_state_dict(load_state(path))
+        else:
+            self.load_state_dict(torch.load(path))
+
     def finish_one_episode(self):
         # get total reward for episode
         for s_i in range(self.num_scenario):
             try:
-                dones = np.where(self.buffer_dones[s_i])[0]
+                buffer_dones = self.buffer.scenario_view("dones", s_i)
+                buffer_rewards = self.buffer.scenario_view("rewards", s_i)
+                dones = np.where(buffer_dones)[0]
                 start_ = dones[-2] if len(dones) > 1 else -1
                 end_ = dones[-1]
-                self.buffer_episode_reward.append(
-                    np.sum(self.buffer_rewards[s_i][start_ + 1 : end_ + 1])
-                )
+                self.buffer_episode_reward.append(np.sum(buffer_rewards[start_ + 1 : end_ + 1]))
             except:
                 pass
 
@@ -130,38 +229,35 @@ class RouteReplayBuffer:
         # separate trajectories according to infos
         for s_i in range(len(additional_dict)):
             sid = additional_dict[s_i]["scenario_id"]
-            if additional_dict[s_i]["collision"]:
-                self.collision_buffer_ego_actions[sid].append(ego_actions[s_i])
-                self.collision_buffer_scenario_actions[sid].append(scenario_actions[s_i])
-                self.collision_buffer_obs[sid].append(obs[s_i])
-                self.collision_buffer_next_obs[sid].append(next_obs[s_i])
-                self.collision_buffer_rewards[sid].append(rewards[s_i])
-                self.collision_buffer_dones[sid].append(dones[s_i])
-                # store additional information in given dict (e.g., cost and actor_info)
-                for key in additional_dict[s_i].keys():
-                    if key in ["scenario_id", "route_waypoints", "actor_info"]:
-                        continue
-                    if key not in self.collision_buffer_additional_dict[s_i].keys():
-                        self.collision_buffer_additional_dict[s_i][key] = []
-                    self.collision_buffer_additional_dict[s_i][key].append(
-                        additional_dict[s_i][key]
-                    )
-                self.collision_buffer_len += 1
-            else:
-                self.buffer_ego_actions[sid].append(ego_actions[s_i])
-                self.buffer_scenario_actions[sid].append(scenario_actions[s_i])
-                self.buffer_obs[sid].append(obs[s_i])
-                self.buffer_next_obs[sid].append(next_obs[s_i])
-                self.buffer_rewards[sid].append(rewards[s_i])
-                self.buffer_dones[sid].append(dones[s_i])
-                # store additional information in given dict (e.g., cost and actor_info)
-                for key in additional_dict[s_i].keys():
-                    if key in ["scenario_id", "route_waypoints", "actor_info"]:
-                        continue
-                    if key not in self.buffer_additional_dict[s_i].keys():
-                        self.buffer_additional_dict[s_i][key] = []
-                    self.buffer_additional_dict[s_i][key].append(additional_dict[s_i][key])
-                self.buffer_len += 1
+            transition = {
+                "ego_actions": ego_actions[s_i],
+                "scenario_actions": scenario_actions[s_i],
+                "obs": obs[s_i],
+                "next_obs": next_obs[s_i],
+                "rewards": rewards[s_i],
+                "dones": dones[s_i],
+            }
+            self.add_transition(sid, transition, additional_dict[s_i])
+
+    @staticmethod
+    def add_info(transition, info, info_keys):
+        # store additional information in given dict (e.g., cost and actor_info)
+        for key in info.keys():
+            if key in ["scenario_id", "route_waypoints", "actor_info"]:
+                continue
+            if key not in info_keys:
+                info_keys.append(key)
+            transition[f"info_{key}"] = info[key]
+
+    def add_transition(self, sid, transition, info):
+        if info["collision"]:
+            buffer, info_keys = self.collision_buffer, self.collision_info_keys
+            self.collision_buffer_len += 1
+        else:
+            buffer, info_keys = self.buffer, self.info_keys
+            self.buffer_len += 1
+        self.add_info(transition, info, info_keys)
+        buffer.add(sid, transition)
 
     def store_init(self, data_list, additional_dict=None):
         static_obs = data_list[0]
@@ -205,169 +301,297 @@ class RouteReplayBuffer:
         return batch
 
     def sample(self, batch_size):
-        # prepare concatenated list
-        prepared_ego_actions = []
-        prepared_scenario_actions = []
-        prepared_obs = []
-        prepared_next_obs = []
-        prepared_rewards = []
-        prepared_dones = []
-        prepared_infos = {}
-
-        prepared_collision_ego_actions = []
-        prepared_collision_scenario_actions = []
-        prepared_collision_obs = []
-        prepared_collision_next_obs = []
-        prepared_collision_rewards = []
-        prepared_collision_dones = []
-        prepared_collision_infos = {}
-
-        # get the length of each sub-buffer
-        samples_per_trajectory = (
-            self.buffer_capacity // self.num_scenario
-        )  # assume average over all sub-buffer
-        for s_i in range(self.num_scenario):
-            # select the latest samples starting from the end of buffer
-            start_idx = np.max([0, len(self.buffer_rewards[s_i]) - samples_per_trajectory])
-            # the buffer size for collision size is the buffer of the non-collision // 100
-            collision_start_idx = np.max(
-                [
-                    0,
-                    len(self.collision_buffer_rewards[s_i]) - samples_per_trajectory // 100,
-                ]
-            )
-
-            # concat
-            prepared_ego_actions += self.buffer_ego_actions[s_i][start_idx:]
-            prepared_scenario_actions += self.buffer_scenario_actions[s_i][start_idx:]
-            prepared_obs += self.buffer_obs[s_i][start_idx:]
-            prepared_next_obs += self.buffer_next_obs[s_i][start_idx:]
-            prepared_rewards += self.buffer_rewards[s_i][start_idx:]
-            prepared_dones += self.buffer_dones[s_i][start_idx:]
-
-            prepared_collision_ego_actions += self.collision_buffer_ego_actions[s_i][
-                collision_start_idx:
-            ]
-            prepared_collision_scenario_actions += self.collision_buffer_scenario_actions[s_i][
-                collision_start_idx:
-            ]
-            prepared_collision_obs += self.collision_buffer_obs[s_i][collision_start_idx:]
-            prepared_collision_next_obs += self.collision_buffer_next_obs[s_i][collision_start_idx:]
-            prepared_collision_rewards += self.collision_buffer_rewards[s_i][collision_start_idx:]
-            prepared_collision_dones += self.collision_buffer_dones[s_i][collision_start_idx:]
-
-            # add additional information
-            for k_i in self.buffer_additional_dict[s_i].keys():
-                if k_i not in prepared_infos.keys():
-                    prepared_infos[k_i] = []
-                prepared_infos[k_i] += self.buffer_additional_dict[s_i][k_i][start_idx:]
-
-            for k_i in self.collision_buffer_additional_dict[s_i].keys():
-                if k_i not in prepared_collision_infos.keys():
-                    prepared_collision_infos[k_i] = []
-                prepared_collision_infos[k_i] += self.collision_buffer_additional_dict[s_i][k_i][
-                    collision_start_idx:
-                ]
-
-        # sample from concatenated list
+        # positions follow the order of the concatenated scenario buffers,
         # the first sample does not have previous state ()
-
-        if len(prepared_collision_rewards) - 1 < batch_size // 5:
-            sample_index = np.random.choice(
-                np.arange(1, len(prepared_rewards)),
-                size=batch_size - len(prepared_collision_rewards),
-                replace=False,
+        buffer_len = len(self.buffer)
+        collision_buffer_len = len(self.collision_buffer)
+        if collision_buffer_len - 1 < batch_size // 5:
+            sample_index = (
+                np.random.choice(
+                    buffer_len - 1, size=batch_size - collision_buffer_len, replace=False
+                )
+                + 1
             )
-            collision_sample_index = np.arange(1, len(prepared_collision_rewards))
+            collision_sample_index = np.arange(1, collision_buffer_len)
         else:
-            sample_index = np.random.choice(
-                np.arange(1, len(prepared_rewards)),
-                size=batch_size - batch_size // 5,
-                replace=False,
+            sample_index = (
+                np.random.choice(buffer_len - 1, size=batch_size - batch_size // 5, replace=False)
+                + 1
             )
-            collision_sample_index = np.random.choice(
-                np.arange(1, len(prepared_collision_rewards)),
-                size=batch_size // 5,
-                replace=False,
+            collision_sample_index = (
+                np.random.choice(collision_buffer_len - 1, size=batch_size // 5, replace=False) + 1
             )
 
         # prepare batch
-        action = prepared_ego_actions if self.mode == "train_agent" else prepared_scenario_actions
-        collision_action = (
-            prepared_collision_ego_actions
-            if self.mode == "train_agent"
-            else prepared_collision_scenario_actions
-        )
-
-        if not collision_action:
-            batch = {
-                "action": np.stack(action)[sample_index],  # action
-                "state": np.stack(prepared_obs)[sample_index, :],  # state
-                "n_state": np.stack(prepared_next_obs)[sample_index, :],  # next state
-                "reward": np.stack(prepared_rewards)[sample_index],  # reward
-                "done": np.stack(prepared_dones)[sample_index],  # done
-            }
-        else:
-            batch = {
-                "action": np.concatenate(
-                    [
-                        np.stack(action)[sample_index],
-                        np.stack(collision_action)[collision_sample_index],
-                    ]
-                ),  # action
-                "state": np.concatenate(
-                    [
-                        np.stack(prepared_obs)[sample_index, :],
-                        np.stack(prepared_collision_obs)[collision_sample_index],
-                    ]
-                ),  # state
-                "n_state": np.concatenate(
-                    [
-                        np.stack(prepared_next_obs)[sample_index, :],
-                        np.stack(prepared_collision_next_obs)[collision_sample_index],
-                    ]
-                ),  # next state
-                "reward": np.concatenate(
-                    [
-                        np.stack(prepared_rewards)[sample_index],
-                        np.stack(prepared_collision_rewards)[collision_sample_index],
-                    ]
-                ),  # reward
-                "done": np.concatenate(
-                    [
-                        np.stack(prepared_dones)[sample_index],
-                        np.stack(prepared_collision_dones)[collision_sample_index],
-                    ]
-                ),  # done
-            }
+        action_key = "ego_actions" if self.mode == "train_agent" else "scenario_actions"
+        key_to_batch = {
+            action_key: "action",  # action
+            "obs": "state",  # state
+            "next_obs": "n_state",  # next state
+            "rewards": "reward",  # reward
+            "dones": "done",  # done
+        }
+        has_collision = collision_buffer_len > 0
+        batch = {}
+        for key, batch_key in key_to_batch.items():
+            batch[batch_key] = self.buffer.get(key, sample_index)
+            if has_collision:
+                batch[batch_key] = np.concatenate(
+                    [batch[batch_key], self.collision_buffer.get(key, collision_sample_index)]
+                )
 
         # add additional information to the batch
         batch_info = {}
-        for k_i in prepared_infos.keys():
+        for k_i in self.info_keys:
             if k_i in ["route_waypoints", "actor_info"]:
                 continue
-            if not collision_action:
-                batch_info[k_i] = np.stack(prepared_infos[k_i])[sample_index - 1]
-                batch_info["n_" + k_i] = np.stack(prepared_infos[k_i])[sample_index]
-            else:
-                batch_info[k_i] = np.concatenate(
-                    [
-                        np.stack(prepared_infos[k_i])[sample_index - 1],
-                        np.stack(prepared_collision_infos[k_i])[collision_sample_index - 1],
-                    ]
-                )
-                batch_info["n_" + k_i] = np.concatenate(
-                    [
-                        np.stack(prepared_infos[k_i])[sample_index],
-                        np.stack(prepared_collision_infos[k_i])[collision_sample_index - 1],
-                    ]
+            batch_info[k_i] = self.buffer.get(f"info_{k_i}", sample_index - 1)
+            batch_info["n_" + k_i] = self.buffer.get(f"info_{k_i}", sample_index)
+            if has_collision:
+                collision_info = self.collision_buffer.get(
+                    f"info_{k_i}", collision_sample_index - 1
                 )
+                batch_info[k_i] = np.concatenate([batch_info[k_i], collision_info])
+                batch_info["n_" + k_i] = np.concatenate([batch_info["n_" + k_i], collision_info])
 
         # combine two dicts
         batch.update(batch_info)
         return batch
 
 
+class SumTree:
+    """
+    Binary tree whose leaves hold the priorities of `capacity` rows and whose inner nodes hold
+    the sum of their children, stored as a flat array with the root at index 1.
+    Updating k priorities and sampling k rows both cost O(k log N).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.num_leaves = 1
+        while self.num_leaves < max(capacity, 1):
+            self.num_leaves *= 2
+        self.nodes = np.zeros(2 * self.num_leaves)
+
+    def total(self):
+        return float(self.nodes[1])
+
+    def get(self, rows):
+        return self.nodes[self.num_leaves + np.asarray(rows, dtype=np.int64)]
+
+    def update(self, rows, priorities):
+        nodes = self.num_leaves + np.asarray(rows, dtype=np.int64).reshape(-1)
+        self.nodes[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """Rows whose cumulative priority range contains each value of [0, total)"""
+        values = np.array(values, dtype=np.float64).reshape(-1)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.num_leaves:
+            left = 2 * nodes
+            # a rounding error must not lead to an empty subtree
+            go_right = (values >= self.nodes[left]) & (self.nodes[left + 1] > 0)
+            values = np.where(go_right, values - self.nodes[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.num_leaves
+
+
+class PrioritizedRouteReplayBuffer(RouteReplayBuffer):
+    """
+    Drop-in replacement of RouteReplayBuffer sampling the transitions in proportion to their
+    priority, through a SumTree over the rows of a single ring storage. Collision transitions
+    are stored with the others and favoured through their priority instead of being mixed in
+    from a separate buffer.
+
+    The priority of a transition is (td + collision_bonus * collision + cost_scale * |cost| +
+    eps) ** alpha, with each term enabled by `priority_sources`:
+    - "td_error": absolute TD error given back by `update_priorities` (e.g. by SAC), new
+      transitions get the largest one seen so far. Without it, td is 1
+    - "collision": the collision flag of the transition info
+    - "cost": the cost of the transition info
+    `sample` adds the importance sampling weights ("weight", normalized by their max) and the
+    rows of the transitions ("index") to the batch.
+    """
+
+    PRIORITY_SOURCES = ("td_error", "collision", "cost")
+
+    def __init__(
+        self,
+        num_scenario,
+        mode,
+        buffer_capacity=1000,
+        priority_sources=("td_error", "collision"),
+        alpha=0.6,
+        beta=0.4,
+        beta_increment=1e-3,
+        collision_bonus=1.0,
+        cost_scale=1.0,
+        eps=1e-3,
+    ):
+        for source in priority_sources:
+            if source not in self.PRIORITY_SOURCES:
+                raise ValueError(f"Unknown priority source: {source}")
+        self.priority_sources = tuple(priority_sources)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.collision_bonus = collision_bonus
+        self.cost_scale = cost_scale
+        self.eps = eps
+        super().__init__(num_scenario, mode, buffer_capacity)
+
+    def reset_buffer(self):
+        super().reset_buffer()
+        self.collision_buffer = RingStorage(self.num_scenario, 0)
+        num_rows = self.num_scenario * self.buffer.capacity
+        self.tree = SumTree(num_rows)
+        self.td_error = np.ones(num_rows)
+        self.static_priority = np.zeros(num_rows)
+        self.max_td_error = 1.0
+
+    def state_dict(self):
+        data = super().state_dict()
+        data["priority"] = {
+            "td_error": self.td_error,
+            "static_priority": self.static_priority,
+            "max_td_error": self.max_td_error,
+            "beta": self.beta,
+        }
+        return data
+
+    def load_state_dict(self, data):
+        if "buffer" in data and "priority" not in data:
+            # the separate collision storage of RouteReplayBuffer is not sampled by this buffer
+            data = dict(data, collision_buffer=self.collision_buffer.state_dict())
+        super().load_state_dict(data)
+        if "priority" in data:
+            if np.shape(data["priority"]["td_error"]) != (self.tree.capacity,):
+                raise ValueError(
+                    f"The saved priorities have shape {np.shape(data['priority']['td_error'])}, "
+                    f"expected ({self.tree.capacity},)"
+                )
+            self.td_error = data["priority"]["td_error"]
+            self.static_priority = data["priority"]["static_priority"]
+            self.max_td_error = data["priority"]["max_td_error"]
+            self.beta = data["priority"]["beta"]
+        else:
+            self.init_priorities()
+        self.refresh_priorities(np.arange(self.tree.capacity))
+
+    def init_priorities(self):
+        """
+        Priorities of a buffer saved without them (e.g. by RouteReplayBuffer): every transition
+        gets the largest TD error, like a new one, and its static priority from its info
+        """
+        num_rows = self.tree.capacity
+        self.td_error = np.full(num_rows, self.max_td_error)
+        self.static_priority = np.zeros(num_rows)
+        fields = self.buffer.fields
+        if "collision" in self.priority_sources and "info_collision" in fields:
+            collision = np.asarray(fields["info_collision"], dtype=bool).reshape(num_rows)
+            self.static_priority += self.collision_bonus * collision
+        if "cost" in self.priority_sources and "info_cost" in fields:
+            cost = np.asarray(fields["info_cost"], dtype=np.float64).reshape(num_rows)
+            self.static_priority += self.cost_scale * np.abs(cost)
+        # the separate collision storage of RouteReplayBuffer is not sampled by this buffer
+        self.collision_buffer = RingStorage(self.num_scenario, 0)
+
+    def oldest_rows(self):
+        """
+        Row of the oldest transition of each scenario. It is never sampled, as the info of the
+        transition before it is needed, see `sample`
+        """
+        capacity = self.buffer.capacity
+        slots = (self.buffer.cursor - self.buffer.size) % capacity
+        return np.arange(self.num_scenario) * capacity + slots
+
+    def refresh_priorities(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        td_error = self.td_error[rows] if "td_error" in self.priority_sources else 1.0
+        priorities = (td_error + self.static_priority[rows] + self.eps) ** self.alpha
+        sid = rows // self.buffer.capacity
+        # empty rows and the oldest row of each scenario
+        slots = rows % self.buffer.capacity
+        age = (self.buffer.cursor[sid] - 1 - slots) % self.buffer.capacity
+        priorities = np.where(age < self.buffer.size[sid] - 1, priorities, 0.0)
+        self.tree.update(rows, priorities)
+
+    def add_transition(self, sid, transition, info):
+        if info["collision"]:
+            self.collision_buffer_len += 1
+        else:
+            self.buffer_len += 1
+        self.add_info(transition, info, self.info_keys)
+        row = self.buffer.add(sid, transition)
+        if row is None:
+            return
+        static_priority = 0.0
+        if "collision" in self.priority_sources and info["collision"]:
+            static_priority += self.collision_bonus
+        if "cost" in self.priority_sources:
+            static_priority += self.cost_scale * abs(float(info.get("cost", 0.0)))
+        self.static_priority[row] = static_priority
+        self.td_error[row] = self.max_td_error
+        # the new row, and the row that has just become the oldest of the scenario
+        self.refresh_priorities([row, self.oldest_rows()[sid]])
+
+    def update_priorities(self, rows, td_errors):
+        """Gives back the TD errors of the transitions of a batch, at the rows of its "index" """
+        if "td_error" not in self.priority_sources:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        td_errors = np.abs(np.asarray(td_errors, dtype=np.float64).reshape(-1))
+        self.td_error[rows] = td_errors
+        self.max_td_error = max(self.max_td_error, float(td_errors.max(initial=0.0)))
+        self.refresh_priorities(rows)
+
+    def sample(self, batch_size):
+        # stratified sampling, one value in each of batch_size equal slices of the total
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * (total / batch_size)
+        rows = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        previous_rows = (
+            rows // self.buffer.capacity * self.buffer.capacity
+            + (rows % self.buffer.capacity - 1) % self.buffer.capacity
+        )
+
+        # importance sampling weights, normalized by the largest one of the batch
+        num_sampled = len(self.buffer) - np.count_nonzero(self.buffer.size)
+        probabilities = self.tree.get(rows) / total
+        weights = (num_sampled * probabilities) ** -self.beta
+        weights = weights / weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        # prepare batch
+        action_key = "ego_actions" if self.mode == "train_agent" else "scenario_actions"
+        key_to_batch = {
+            action_key: "action",  # action
+            "obs": "state",  # state
+            "next_obs": "n_state",  # next state
+            "rewards": "reward",  # reward
+            "dones": "done",  # done
+        }
+        batch = {
+            batch_key: self.buffer.fields[key][rows] for key, batch_key in key_to_batch.items()
+        }
+        batch["weight"] = weights.astype(np.float32)
+        batch["index"] = rows
+
+        # add additional information to the batch
+        for k_i in self.info_keys:
+            if k_i in ["route_waypoints", "actor_info"]:
+                continue
+            batch[k_i] = self.buffer.fields[f"info_{k_i}"][previous_rows]
+            batch["n_" + k_i] = self.buffer.fields[f"info_{k_i}"][rows]
+        return batch
+
+
 class PerceptionReplayBuffer:
     """
     This buffer supports parallel storing image states and labels for object detection
@@ -453,3 +677,17 @@ class PerceptionReplayBuffer:
         }
 
         return batch
+
+
+def make_replay_buffer(Buffer, config, num_scenario, mode, buffer_capacity):
+    """
+    Creates the replay buffer of a runner. A RouteReplayBuffer is replaced by a
+    PrioritizedRouteReplayBuffer when the agent `config` has a "prioritized_replay" entry,
+    holding the parameters of the sum-tree buffer, e.g. {"priority_sources": ["td_error"]}
+    """
+    prioritized_replay = config.get("prioritized_replay")
+    if Buffer is RouteReplayBuffer and prioritized_replay:
+        return PrioritizedRouteReplayBuffer(
+            num_scenario, mode, buffer_capacity, **prioritized_replay
+        )
+    return Buffer(num_scenario, mode, buffer_capacity)
@@ -25,6 +25,7 @@ from safebench.scenario.scenario_manager.traffic_events import (
     TrafficEvent,
     TrafficEventType,
 )
+from safebench.scenario.tools.route_progress import RouteProgressTracker
 
 
 class Status(Enum):
@@ -527,7 +528,7 @@ class OffRoadTest(Criterion):
         """
         super(OffRoadTest, self).__init__(name, actor, 0, None, optional, terminate_on_failure)
 
-        self._map = CarlaDataProvider.get_map()
+        self._lanes = CarlaDataProvider.get_nearest_lane_service()
         self._offroad = False
 
         self._duration = duration
@@ -549,8 +550,8 @@ class OffRoadTest(Criterion):
         current_location = CarlaDataProvider.get_location(self.actor)
 
         # Get the waypoint at the current location to see if the actor is offroad
-        drive_waypoint = self._map.get_waypoint(current_location, project_to_road=False)
-        park_waypoint = self._map.get_waypoint(
+        drive_waypoint = self._lanes.get_waypoint(current_location, project_to_road=False)
+        park_waypoint = self._lanes.get_waypoint(
             current_location, project_to_road=False, lane_type=carla.LaneType.Parking
         )
         if drive_waypoint or park_waypoint:
@@ -589,6 +590,7 @@ class InRouteTest(Criterion):
     - offroad_max: Maximum distance (in meters) the actor can deviate from the route
     - offroad_min: Maximum safe distance (in meters). Might eventually cause failure
     - terminate_on_failure [optional]: If True, the complete scenario will terminate upon failure of this test
+    - tracker [optional]: RouteProgressTracker of the route, shared with the other route criteria
     """
 
     MAX_ROUTE_PERCENTAGE = 30  # %
@@ -602,6 +604,7 @@ class InRouteTest(Criterion):
         offroad_max=30,
         name="InRouteTest",
         terminate_on_failure=False,
+        tracker=None,
     ):
         super(InRouteTest, self).__init__(name, actor, 0, terminate_on_failure=terminate_on_failure)
         self._actor = actor
@@ -620,17 +623,10 @@ class InRouteTest(Criterion):
         self._out_route_distance = 0
         self._in_safe_route = True
 
-        self._accum_meters = []
-        prev_wp = self._waypoints[0]
-        for i, wp in enumerate(self._waypoints):
-            d = wp.distance(prev_wp)
-            if i > 0:
-                accum = self._accum_meters[i - 1]
-            else:
-                accum = 0
-
-            self._accum_meters.append(d + accum)
-            prev_wp = wp
+        if tracker is None:
+            tracker = RouteProgressTracker(self._waypoints)
+        self._tracker = tracker
+        self._accum_meters = self._tracker.accum_meters
 
     def update(self):
         """
@@ -646,18 +642,11 @@ class InRouteTest(Criterion):
             new_status = Status.FAILURE
 
         off_route = True
-        shortest_distance = float("inf")
-        closest_index = -1
-
-        # Get the closest distance
-        for index in range(self._current_index, self._route_length):
-            ref_waypoint = self._waypoints[index]
-            distance = math.sqrt(
-                ((location.x - ref_waypoint.x) ** 2) + ((location.y - ref_waypoint.y) ** 2)
-            )
-            if distance <= shortest_distance:
-                closest_index = index
-                shortest_distance = distance
+
+        # Get the closest distance, searching a window ahead of the current index
+        closest_index, shortest_distance = self._tracker.closest_index(
+            location, self._current_index
+        )
 
         if closest_index == -1 or shortest_distance == float("inf"):
             self.shortest_distance = 0
@@ -672,7 +661,9 @@ class InRouteTest(Criterion):
 
         # If actor advanced a step, record the distance
         if self._current_index != closest_index:
-            new_dist = self._accum_meters[closest_index] - self._accum_meters[self._current_index]
+            new_dist = float(
+                self._accum_meters[closest_index] - self._accum_meters[self._current_index]
+            )
 
             # If too far from the route, add it and check if its value
             if not self._in_safe_route:
@@ -707,18 +698,20 @@ class RouteCompletionTest(Criterion):
     - actor: CARLA actor to be used for this test
     - route: Route to be checked
     - terminate_on_failure [optional]: If True, the complete scenario will terminate upon failure of this test
+    - tracker [optional]: RouteProgressTracker of the route, shared with the other route criteria
     """
 
     DISTANCE_THRESHOLD = 10.0  # meters
     WINDOWS_SIZE = 2
 
-    def __init__(self, actor, route, name="RouteCompletionTest", terminate_on_failure=False):
+    def __init__(
+        self, actor, route, name="RouteCompletionTest", terminate_on_failure=False, tracker=None
+    ):
         super(RouteCompletionTest, self).__init__(
             name, actor, 100, terminate_on_failure=terminate_on_failure
         )
         self._actor = actor
         self._route = route
-        self._map = CarlaDataProvider.get_map()
 
         self._wsize = self.WINDOWS_SIZE
         self._current_index = 0
@@ -726,17 +719,11 @@ class RouteCompletionTest(Criterion):
         self._waypoints, _ = zip(*self._route)
         self.target = self._waypoints[-1]
 
-        self._accum_meters = []
-        prev_wp = self._waypoints[0]
-        for i, wp in enumerate(self._waypoints):
-            d = wp.distance(prev_wp)
-            if i > 0:
-                accum = self._accum_meters[i - 1]
-            else:
-                accum = 0
-
-            self._accum_meters.append(d + accum)
-            prev_wp = wp
+        if tracker is None:
+            tracker = RouteProgressTracker(
+                self._waypoints, lanes=CarlaDataProvider.get_nearest_lane_service()
+            )
+        self._tracker = tracker
 
         self._traffic_event = TrafficEvent(event_type=TrafficEventType.ROUTE_COMPLETION)
         self.list_traffic_events.append(self._traffic_event)
@@ -755,33 +742,18 @@ class RouteCompletionTest(Criterion):
         if self._terminate_on_failure and (self.test_status == "FAILURE"):
             new_status = Status.FAILURE
         elif self.test_status == "RUNNING" or self.test_status == "INIT":
-            for index in range(
-                self._current_index,
-                min(self._current_index + self._wsize + 1, self._route_length),
-            ):
-                # Get the dot product to know if it has passed this location
-                ref_waypoint = self._waypoints[index]
-                wp = self._map.get_waypoint(ref_waypoint)
-                wp_dir = wp.transform.get_forward_vector()  # Waypoint's forward vector
-                wp_veh = location - ref_waypoint  # vector waypoint - vehicle
-                dot_ve_wp = wp_veh.x * wp_dir.x + wp_veh.y * wp_dir.y + wp_veh.z * wp_dir.z
-
-                if dot_ve_wp > 0:
-                    # good! segment completed!
-                    self._current_index = index
-                    self._percentage_route_completed = (
-                        100.0
-                        * float(self._accum_meters[self._current_index])
-                        / float(self._accum_meters[-1])
-                    )
-                    self._traffic_event.set_dict(
-                        {"route_completed": self._percentage_route_completed}
-                    )
-                    self._traffic_event.set_message(
-                        "Agent has completed > {:.2f}% of the route".format(
-                            self._percentage_route_completed
-                        )
+            # Get the last waypoint of the window the actor has passed, along the lane direction
+            index = self._tracker.last_passed_index(location, self._current_index, self._wsize)
+            if index is not None:
+                # good! segment completed!
+                self._current_index = index
+                self._percentage_route_completed = self._tracker.completion(self._current_index)
+                self._traffic_event.set_dict({"route_completed": self._percentage_route_completed})
+                self._traffic_event.set_message(
+                    "Agent has completed > {:.2f}% of the route".format(
+                        self._percentage_route_completed
                     )
+                )
 
             if (
                 self._percentage_route_completed > 99.0
@@ -830,6 +802,7 @@ class RunningRedLightTest(Criterion):
         self._actor = actor
         self._world = actor.get_world()
         self._map = CarlaDataProvider.get_map()
+        self._lanes = CarlaDataProvider.get_nearest_lane_service()
         self._list_traffic_lights = []
         self._last_red_light_id = None
         self.actual_value = 0
@@ -909,7 +882,7 @@ class RunningRedLightTest(Criterion):
                 continue
 
             for wp in waypoints:
-                tail_wp = self._map.get_waypoint(tail_far_pt)
+                tail_wp = self._lanes.get_waypoint(tail_far_pt)
 
                 # Calculate the dot product (Might be unscaled, as only its sign is important)
                 ve_dir = CarlaDataProvider.get_transform(self._actor).get_forward_vector()
@@ -1046,7 +1019,7 @@ class RunningStopTest(Criterion):
         )
         self._actor = actor
         self._world = CarlaDataProvider.get_world()
-        self._map = CarlaDataProvider.get_map()
+        self._lanes = CarlaDataProvider.get_nearest_lane_service()
         self._list_stop_signs = []
         self._target_stop_sign = None
         self._stop_completed = False
@@ -1092,7 +1065,7 @@ class RunningStopTest(Criterion):
 
         # slower and accurate test based on waypoint's horizon and geometric test
         list_locations = [current_location]
-        waypoint = self._map.get_waypoint(current_location)
+        waypoint = self._lanes.get_waypoint(current_location)
         for _ in range(multi_step):
             if waypoint:
                 next_wps = waypoint.next(self.WAYPOINT_STEP)
@@ -1117,7 +1090,7 @@ class RunningStopTest(Criterion):
         ve_tra = CarlaDataProvider.get_transform(self._actor)
         ve_dir = ve_tra.get_forward_vector()
 
-        wp = self._map.get_waypoint(ve_tra.location)
+        wp = self._lanes.get_waypoint(ve_tra.location)
         wp_dir = wp.transform.get_forward_vector()
 
         dot_ve_wp = ve_dir.x * wp_dir.x + ve_dir.y * wp_dir.y + ve_dir.z * wp_dir.z
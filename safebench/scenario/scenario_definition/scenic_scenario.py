@@ -8,6 +8,7 @@ from safebench.scenario.scenario_definition.scenic.dynamic_scenic import (
 from safebench.scenario.scenario_manager.carla_data_provider import CarlaDataProvider
 from safebench.scenario.scenario_manager.timer import GameTime
 from safebench.scenario.tools.route_manipulation import interpolate_trajectory
+from safebench.scenario.tools.route_progress import RouteProgressTracker
 from safebench.scenario.tools.scenario_utils import convert_transform_to_location
 
 SECONDS_GIVEN_PER_METERS = 1
@@ -207,10 +208,17 @@ class ScenicScenario:
         criteria["run_red_light"] = RunningRedLightTest(actor=self.ego_vehicle)
         criteria["run_stop"] = RunningStopTest(actor=self.ego_vehicle)
         if self.config.scenario_id != 0:  # only check when evaluating
+            # Both route criteria share the arrays and KD-tree of the route
+            tracker = RouteProgressTracker(
+                [location for location, _ in route],
+                lanes=CarlaDataProvider.get_nearest_lane_service(),
+            )
             criteria["distance_to_route"] = InRouteTest(
-                self.ego_vehicle, route=route, offroad_max=30
+                self.ego_vehicle, route=route, offroad_max=30, tracker=tracker
+            )
+            criteria["route_complete"] = RouteCompletionTest(
+                self.ego_vehicle, route=route, tracker=tracker
             )
-            criteria["route_complete"] = RouteCompletionTest(self.ego_vehicle, route=route)
         return criteria
 
     @staticmethod
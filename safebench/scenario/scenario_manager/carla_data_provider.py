@@ -18,6 +18,8 @@ from six import iteritems
 
 import carla
 
+from agents.tools.nearest_lane import get_nearest_lane_service
+
 
 def calculate_velocity(actor):
     velocity_squared = actor.get_velocity().x ** 2
@@ -211,6 +213,14 @@ class CarlaDataProvider(object):
 
         return CarlaDataProvider._map
 
+    @staticmethod
+    def get_nearest_lane_service():
+        """
+        Return the in-process nearest-lane service of the current map, to replace the
+        map.get_waypoint calls done at every tick
+        """
+        return get_nearest_lane_service(CarlaDataProvider.get_map())
+
     @staticmethod
     def get_random_seed():
         """
@@ -14,7 +14,7 @@ Description:
 import math
 import xml.etree.ElementTree as ET
 
-from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner import get_global_route_planner
 from agents.navigation.local_planner import RoadOption
 
 
@@ -145,7 +145,7 @@ def interpolate_trajectory(world, waypoints_trajectory, hop_resolution=1.0):
         :return: the full interpolated route both in GPS coordinates and also in its original form.
     """
 
-    grp = GlobalRoutePlanner(world.get_map(), hop_resolution)
+    grp = get_global_route_planner(world.get_map(), hop_resolution)
     route = []
 
     if len(waypoints_trajectory) == 1:
@@ -0,0 +1,137 @@
+"""
+Description:
+    Route progress tracking shared by the route criteria (InRouteTest, RouteCompletionTest).
+    The route is stored as NumPy arrays, and the progress of the actor is searched in a bounded
+    window ahead of its last index instead of over the whole remaining route.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class RouteProgressTracker(object):
+    """
+    The route locations with their cumulative arc length. The tracker has no state of its own,
+    each criterion keeps its current index, so one tracker can be shared by the criteria of a
+    route.
+
+    `closest_index` slides a window of `window_size` points forward while the closest point is
+    at the end of the window, so a monotonic progress costs O(window_size) per tick. When the
+    actor ends up farther than `teleport_distance` from the window, the KD-tree of the whole
+    route is used to find where it is.
+    """
+
+    WINDOW_SIZE = 20
+    TELEPORT_DISTANCE = 10.0  # meters
+    NUM_CANDIDATES = 16
+
+    def __init__(self, route, lanes=None, window_size=WINDOW_SIZE, teleport_distance=None):
+        """
+        :param route: list of carla.Location
+        :param lanes: object with a `get_waypoints(locations)` method, e.g. the nearest-lane
+            service, used for the lane direction at each point. If None, the direction of the
+            route itself is used.
+        """
+        self.route = route
+        self.points = np.array(
+            [[location.x, location.y, location.z] for location in route], dtype=np.float64
+        ).reshape(-1, 3)
+        segments = np.linalg.norm(np.diff(self.points, axis=0), axis=1)
+        self.accum_meters = np.concatenate([[0.0], np.cumsum(segments)])
+        self.lanes = lanes
+        self.window_size = window_size
+        self.teleport_distance = (
+            teleport_distance if teleport_distance is not None else self.TELEPORT_DISTANCE
+        )
+        self.tree = None
+        self.forward = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def _distances(self, location, start, end):
+        delta = self.points[start:end, :2] - np.array([location.x, location.y])
+        return np.hypot(delta[:, 0], delta[:, 1])
+
+    @staticmethod
+    def _last_argmin(distances):
+        # Ties go to the farthest point, like a `<=` scan
+        return len(distances) - 1 - int(np.argmin(distances[::-1]))
+
+    def closest_index(self, location, start_index=0):
+        """
+        Index (>= start_index) of the route point closest to `location` in 2D, and its distance.
+        Returns (-1, inf) when there is no point left.
+        """
+        num_points = len(self.points)
+        if start_index >= num_points:
+            return -1, float("inf")
+
+        index, distance = start_index, float("inf")
+        window_start = start_index
+        while True:
+            window_end = min(window_start + self.window_size + 1, num_points)
+            distances = self._distances(location, window_start, window_end)
+            best = self._last_argmin(distances)
+            if distances[best] <= distance:
+                index, distance = window_start + best, float(distances[best])
+            # Keep sliding while the route still gets closer at the end of the window
+            if best < len(distances) - 1 or window_end == num_points:
+                break
+            window_start = window_end - 1
+
+        if distance > self.teleport_distance:
+            index, distance = self._closest_index_from_tree(location, start_index, index, distance)
+        return index, distance
+
+    def _closest_index_from_tree(self, location, start_index, index, distance):
+        if self.tree is None:
+            self.tree = cKDTree(self.points[:, :2])
+        k = min(self.NUM_CANDIDATES, len(self.points))
+        distances, candidates = self.tree.query([location.x, location.y], k=k)
+        distances, candidates = np.atleast_1d(distances), np.atleast_1d(candidates)
+        ahead = candidates >= start_index
+        if not ahead.any():
+            # All the nearest points are behind, scan the rest of the route
+            distances = self._distances(location, start_index, len(self.points))
+            best = self._last_argmin(distances)
+            return start_index + best, float(distances[best])
+        for candidate, candidate_distance in zip(candidates[ahead], distances[ahead]):
+            if candidate_distance < distance or (
+                candidate_distance == distance and candidate > index
+            ):
+                index, distance = int(candidate), float(candidate_distance)
+        return index, distance
+
+    def get_forward(self):
+        """Unit forward vectors (N, 3) of the lane at each route point"""
+        if self.forward is None:
+            if self.lanes is not None:
+                forward = []
+                for waypoint in self.lanes.get_waypoints(self.route):
+                    vector = waypoint.transform.get_forward_vector()
+                    forward.append([vector.x, vector.y, vector.z])
+                self.forward = np.array(forward, dtype=np.float64).reshape(-1, 3)
+            else:
+                direction = np.diff(self.points, axis=0)
+                direction = np.concatenate([direction, direction[-1:]], axis=0)
+                norm = np.linalg.norm(direction, axis=1, keepdims=True)
+                self.forward = direction / np.maximum(norm, 1e-6)
+        return self.forward
+
+    def last_passed_index(self, location, start_index, window_size):
+        """
+        The last index of [start_index, start_index + window_size] whose point the location
+        has passed along the lane direction, or None if it has passed none of them.
+        """
+        end_index = min(start_index + window_size + 1, len(self.points))
+        delta = np.array([location.x, location.y, location.z]) - self.points[start_index:end_index]
+        dots = np.sum(delta * self.get_forward()[start_index:end_index], axis=1)
+        passed = np.flatnonzero(dots > 0)
+        if len(passed) == 0:
+            return None
+        return start_index + int(passed[-1])
+
+    def completion(self, index):
+        """Percentage of the route length covered up to `index`"""
+        return 100.0 * float(self.accum_meters[index]) / float(self.accum_meters[-1])
@@ -18,10 +18,15 @@ import numpy as np
 import pygame
 from tqdm import tqdm
 
+from agents.tools.nearest_lane import set_nearest_lane_cache_dir
 from safebench.agent import AGENT_POLICY_LIST
 from safebench.gym_carla.env_wrapper import VectorWrapper
-from safebench.gym_carla.envs.render import BirdeyeRender
-from safebench.gym_carla.replay_buffer import PerceptionReplayBuffer, RouteReplayBuffer
+from safebench.gym_carla.envs.render import BirdeyeRender, make_birdeye_params
+from safebench.gym_carla.replay_buffer import (
+    PerceptionReplayBuffer,
+    RouteReplayBuffer,
+    make_replay_buffer,
+)
 from safebench.scenario import SCENARIO_POLICY_LIST
 from safebench.scenario.scenario_data_loader import ScenicDataLoader
 from safebench.scenario.scenario_manager.carla_data_provider import CarlaDataProvider
@@ -153,6 +158,8 @@ class ScenicRunner:
         self.world.apply_settings(settings)
         CarlaDataProvider.set_client(self.client)
         CarlaDataProvider.set_world(self.world)
+        # the lane samples of the criteria are stored next to the road graphs
+        set_nearest_lane_cache_dir(self.scenario_config.get("cache_dir", "graph_cache"))
         CarlaDataProvider.set_traffic_manager_port(self.scenario_config["tm_port"])
 
     def _init_scenic(self, config):
@@ -185,18 +192,7 @@ class ScenicRunner:
         self.display = pygame.display.set_mode(window_size, flag)
 
         # initialize the render for generating observation and visualization
-        pixels_per_meter = self.env_params["display_size"] / self.env_params["obs_range"]
-        pixels_ahead_vehicle = (
-            self.env_params["obs_range"] / 2 - self.env_params["d_behind"]
-        ) * pixels_per_meter
-        self.birdeye_params = {
-            "screen_size": [
-                self.env_params["display_size"],
-                self.env_params["display_size"],
-            ],
-            "pixels_per_meter": pixels_per_meter,
-            "pixels_ahead_vehicle": pixels_ahead_vehicle,
-        }
+        self.birdeye_params = make_birdeye_params(self.env_params, self.scenario_config)
         self.birdeye_render = BirdeyeRender(self.world, self.birdeye_params, logger=self.logger)
 
     def run_scenes(self, scenes):
@@ -474,7 +470,9 @@ class ScenicRunner:
                 if self.scenario_category in ["scenic", "planning"]
                 else PerceptionReplayBuffer
             )
-            replay_buffer = Buffer(self.num_scenario, self.mode, self.buffer_capacity)
+            replay_buffer = make_replay_buffer(
+                Buffer, self.agent_config, self.num_scenario, self.mode, self.buffer_capacity
+            )
 
             ### repeat the training, 20 is just a random placeholder
             config_list = config_list * 20
@@ -521,6 +519,8 @@ class ScenicRunner:
             self.world.scenic = self.scenic
 
             # create scenarios within the vectorized wrapper
+            if self.env is not None:
+                self.env.close()
             self.env = VectorWrapper(
                 self.env_params,
                 self.scenario_config,
@@ -600,3 +600,4 @@ class ScenicRunner:
         pygame.quit()  # close pygame renderer
         if self.env:
             self.env.clean_up()
+            self.env.close()
@@ -11,8 +11,12 @@ from tqdm import tqdm
 
 from safebench.agent import AGENT_POLICY_LIST
 from safebench.gym_carla.env_wrapper import VectorWrapper
-from safebench.gym_carla.envs.render import BirdeyeRender
-from safebench.gym_carla.replay_buffer import PerceptionReplayBuffer, RouteReplayBuffer
+from safebench.gym_carla.envs.render import BirdeyeRender, make_birdeye_params
+from safebench.gym_carla.replay_buffer import (
+    PerceptionReplayBuffer,
+    RouteReplayBuffer,
+    make_replay_buffer,
+)
 from safebench.scenario import SCENARIO_POLICY_LIST
 from safebench.scenario.scenario_data_loader import CarlaClientDataLoader
 from safebench.scenario.scenario_manager.carla_data_provider import CarlaDataProvider
@@ -49,6 +53,7 @@ class TextToSceneRunner:
         self.client.set_timeout(10.0)
         self.world = None
         self.env = None
+        self.carla_client = None
 
         self.env_params = {
             "auto_ego": scenario_config["auto_ego"],
@@ -150,11 +155,15 @@ class TextToSceneRunner:
         CarlaDataProvider.set_traffic_manager_port(self.scenario_config["tm_port"])
 
     def _init_client(self, config):
-        self.logger.log(f">> Initializing carla client with config file: {config.json_file}")
         # The json file will be one of the behavior config file (e.g., behavior_1_opt.json)
-        carla_client = CarlaClient()
-        carla_client.set_world(self.world)
-        return carla_client
+        # The client is built once per run since building its graph is slow, then it only follows
+        # the world and is cleaned after each episode
+        if self.carla_client is None:
+            self.logger.log(f">> Initializing carla client with config file: {config.json_file}")
+            self.carla_client = CarlaClient()
+        if self.carla_client.world is not self.world:
+            self.carla_client.set_world(self.world)
+        return self.carla_client
 
     def _init_renderer(self):
         self.logger.log(">> Initializing pygame birdeye renderer")
@@ -182,18 +191,7 @@ class TextToSceneRunner:
         self.display = pygame.display.set_mode(window_size, flag)
 
         # initialize the render for generating observation and visualization
-        pixels_per_meter = self.env_params["display_size"] / self.env_params["obs_range"]
-        pixels_ahead_vehicle = (
-            self.env_params["obs_range"] / 2 - self.env_params["d_behind"]
-        ) * pixels_per_meter
-        self.birdeye_params = {
-            "screen_size": [
-                self.env_params["display_size"],
-                self.env_params["display_size"],
-            ],
-            "pixels_per_meter": pixels_per_meter,
-            "pixels_ahead_vehicle": pixels_ahead_vehicle,
-        }
+        self.birdeye_params = make_birdeye_params(self.env_params, self.scenario_config)
         self.birdeye_render = BirdeyeRender(self.world, self.birdeye_params, logger=self.logger)
 
     def run_scenes(self, scenes):
@@ -486,7 +484,9 @@ class TextToSceneRunner:
                 if self.scenario_category in ["scenic", "planning"]
                 else PerceptionReplayBuffer
             )
-            replay_buffer = Buffer(self.num_scenario, self.mode, self.buffer_capacity)
+            replay_buffer = make_replay_buffer(
+                Buffer, self.agent_config, self.num_scenario, self.mode, self.buffer_capacity
+            )
 
             # repeat the training, 20 is just a random placeholder
             config_list = config_list * 20
@@ -534,6 +534,8 @@ class TextToSceneRunner:
                 last_town = config.town
 
             # create scenarios within the vectorized wrapper
+            if self.env is not None:
+                self.env.close()
             self.env = VectorWrapper(
                 self.env_params,
                 self.scenario_config,
@@ -613,3 +615,4 @@ class TextToSceneRunner:
         pygame.quit()  # close pygame renderer
         if self.env:
             self.env.clean_up()
+            self.env.close()
@@ -1,11 +1,15 @@
-import copy
 import weakref
 from collections import defaultdict
-from queue import Queue
 
 import carla
 import numpy as np
 
+from agents.navigation.global_route_planner import (
+    clear_global_route_planners,
+    set_route_planner_cache_dir,
+)
+from agents.tools.nearest_lane import clear_nearest_lane_services, set_nearest_lane_cache_dir
+from agents.tools.world_snapshot import clear_world_snapshots
 from graph.graph_manager import GraphManager
 from manager import (
     AgentModelManager,
@@ -16,6 +20,7 @@ from manager import (
 )
 from misc.constant import BEV_CAMERA, FRONT_CAMERA
 from scene_utils.retreival import retrieve_roads
+from scene_utils.sensor_hub import ImageRing, SensorHub
 
 
 def inverse_format_town_name(town_name):
@@ -29,6 +34,11 @@ def format_town_name(town_name):
     return f"Town{town_num.zfill(2)}"
 
 
+def get_map_name(world):
+    # e.g. "Carla/Maps/Town01" -> "Town01"
+    return world.get_map().name.rsplit("/", 1)[-1]
+
+
 class CarlaClient:
     def __init__(
         self,
@@ -37,25 +47,33 @@ class CarlaClient:
         port=2000,
         use_cache=True,
         cache_dir="graph_cache",
+        towns=None,
+        image_consumer_slots=0,
     ):
         self.client = carla.Client(host, port)
         self.client.set_timeout(10.0)
+        if use_cache:
+            set_route_planner_cache_dir(cache_dir)
+            set_nearest_lane_cache_dir(cache_dir)
         self.graph_manager = GraphManager(
             input_folder,
             use_cache=use_cache,
             cache_dir=cache_dir,
+            towns=towns,
         )
         self.world = None
         self.agent_model_manager = AgentModelManager(self.client)
         self.vehicle_manager = VehicleManager(self.graph_manager)
         self.pedestrian_manager = PedestrianManager()
         self.cyclist_manager = CyclistManager(self.graph_manager)
-        self.world_manager = WorldManager()
+        self.world_manager = WorldManager(client=self.client)
 
         self.front_camera = None
-        self.front_image_queue = Queue()
         self.bev_camera = None
-        self.bev_image_queue = Queue()
+        self.sensor_hub = None
+        self.image_rings = {}
+        # Images a consumer may still hold after `check_finish` returned them
+        self.image_consumer_slots = image_consumer_slots
 
         self.json_file = None
 
@@ -83,10 +101,21 @@ class CarlaClient:
         )
 
     def load_map(self, map_name, weather="ClearNoon"):
+        """Load `map_name`, or only reset the current world if that town is already loaded"""
+        if self.world is None:
+            world = self.client.get_world()
+            if get_map_name(world) == map_name:
+                self.world = world
         if self.world is not None:
             self.clean()
-            self.set_sync_mode(False, set_tm=False)
-        self.world = self.client.load_world(map_name)
+            if get_map_name(self.world) != map_name:
+                self.set_sync_mode(False, set_tm=False)
+                self.world = None
+                # they hold the map of the previous world, the new one is sampled on demand
+                clear_nearest_lane_services()
+                clear_global_route_planners()
+        if self.world is None:
+            self.world = self.client.load_world(map_name)
         if hasattr(carla.WeatherParameters, weather):
             self.world.set_weather(getattr(carla.WeatherParameters, weather))
         self.set_sync_mode(True, set_tm=False)
@@ -104,7 +133,14 @@ class CarlaClient:
         self.vehicle_manager.set_new_manager(self.agent_model_manager, self.world_manager)
         self.pedestrian_manager.set_new_manager(self.agent_model_manager, self.world_manager)
         self.cyclist_manager.set_new_manager(self.agent_model_manager, self.world_manager)
-        self.graph_manager.set_town_name(inverse_format_town_name(self.world.get_map().name))
+        town_name = inverse_format_town_name(self.world.get_map().name)
+        self.graph_manager.set_town_name(town_name)
+        if town_name not in self.graph_manager.town_nodes:
+            # The client was created with other towns, merge this one on request
+            if town_name not in self.graph_manager.town_files:
+                raise ValueError(f"No OpenDRIVE file for {town_name} in the map folder")
+            self.graph_manager.load_towns([town_name])
+            self.graph_manager.get_intersection_info(self, self.vehicle_manager)
 
     def set_traffic_light_time(self, duration=20):
         actor_list = self.world.get_actors()
@@ -124,13 +160,13 @@ class CarlaClient:
             self.tm.set_synchronous_mode(sync)
 
     @staticmethod
-    def parse_image(weak_self, carla_image, name_to_put):
+    def parse_image(weak_self, carla_image, sensor_name):
+        # The image stays BGRA in the ring of the camera, the consumer reorders the channels
         self = weak_self()
-        np_img = np.frombuffer(carla_image.raw_data, dtype=np.dtype("uint8"))
-        np_img = copy.deepcopy(np_img)
-        np_img = np.reshape(np_img, (carla_image.height, carla_image.width, 4))
-        np_img = np_img[:, :, :3][:, :, ::-1]
-        getattr(self, name_to_put).put((carla_image.frame, np_img))
+        if self is None or self.sensor_hub is None:
+            return
+        np_img = self.image_rings[sensor_name].write(carla_image)
+        self.sensor_hub.put(sensor_name, carla_image.frame, np_img)
 
     def clean(self):
         self.vehicle_manager.clean()
@@ -146,6 +182,17 @@ class CarlaClient:
         if self.front_camera is not None or self.bev_camera is not None:
             self.world.tick()
 
+        # Keep the graph and the world, only the actors of the scene are dropped
+        self.vehicle_manager.reset()
+        self.pedestrian_manager.reset()
+        self.cyclist_manager.reset()
+        self.world_manager.reset()
+        # the snapshots hold the actors that have just been destroyed
+        clear_world_snapshots()
+        self.front_camera = None
+        self.bev_camera = None
+        self.sensor_hub = None
+
     def sort_road_target(self, road_info, required_num_of_waypoints, action_list, road_type_list):
         score = 0
 
@@ -188,7 +235,9 @@ class CarlaClient:
         return score
 
     def get_valid_road(self, road_condition, agent_type_list, action_list, road_type_list):
-        road = retrieve_roads(self.graph_manager.graph, road_condition)
+        road = retrieve_roads(
+            self.graph_manager.graph, road_condition, self.graph_manager.road_index
+        )
         if len(road) == 0:
             return None, None, None, None
 
@@ -238,6 +287,13 @@ class CarlaClient:
     def spawn_ego_monitor(self):
         # Create sensor
         weak_self = weakref.ref(self)
+        self.sensor_hub = SensorHub(["front_image", "bev_image"])
+        # One slot more than the hub can hold, plus the frame being consumed and the images
+        # the consumer still holds
+        self.image_rings = {
+            sensor_name: ImageRing(self.sensor_hub.max_pending + 2 + self.image_consumer_slots)
+            for sensor_name in self.sensor_hub.sensor_names
+        }
         camera_rgb_bp = self.agent_model_manager.get_blueprint_from_name("sensor.camera.rgb")
         camera_rgb_bp.set_attribute("image_size_x", str(FRONT_CAMERA["image_size_x"]))
         camera_rgb_bp.set_attribute("image_size_y", str(FRONT_CAMERA["image_size_y"]))
@@ -257,9 +313,7 @@ class CarlaClient:
         self.front_camera = self.world.spawn_actor(
             camera_rgb_bp, front_transform, attach_to=self.vehicle_manager.vehicles[0]
         )
-        self.front_camera.listen(
-            lambda image: self.parse_image(weak_self, image, "front_image_queue")
-        )
+        self.front_camera.listen(lambda image: self.parse_image(weak_self, image, "front_image"))
         camera_rgb_bp.set_attribute("image_size_x", str(BEV_CAMERA["image_size_x"]))
         camera_rgb_bp.set_attribute("image_size_y", str(BEV_CAMERA["image_size_y"]))
         camera_rgb_bp.set_attribute("fov", str(BEV_CAMERA["fov"]))
@@ -278,7 +332,7 @@ class CarlaClient:
         self.bev_camera = self.world.spawn_actor(
             camera_rgb_bp, bev_transform, attach_to=self.vehicle_manager.vehicles[0]
         )
-        self.bev_camera.listen(lambda image: self.parse_image(weak_self, image, "bev_image_queue"))
+        self.bev_camera.listen(lambda image: self.parse_image(weak_self, image, "bev_image"))
         self.world.tick()
 
     def spawn_all_agent(
@@ -315,6 +369,8 @@ class CarlaClient:
 
         if ego_waypoint is not None:
             self.spawn_ego_monitor()
+            # Cars, pedestrians and cyclists are sent to the server together
+            self.world_manager.start_spawn_batch()
             self.vehicle_manager.spawn_other_cars(agent_info, self.vehicle_manager.vehicles[0])
 
             self.pedestrian_manager.set_pos_id_to_waypoints(self.vehicle_manager)
@@ -326,23 +382,32 @@ class CarlaClient:
             self.cyclist_manager.spawn_cyclists(
                 cyclist_agents, ego_agent=self.vehicle_manager.vehicle_agent[0]
             )
+            self.world_manager.flush_spawn_batch()
         return ego_waypoint
 
-    def check_finish(self, timeout=10.0, tick_world=True):
+    def check_finish(self, timeout=1.0, tick_world=True):
+        """Run the agents for one tick and return the BGRA images of the tick, which are only
+        valid until a few more ticks (see `ImageRing`). Waits up to `timeout` seconds for the
+        images, only if every camera is still alive"""
         vehicle_done = self.vehicle_manager.run_step()
         self.cyclist_manager.run_step()
         self.pedestrian_manager.run_step()
+        frame = None
         if tick_world:
-            self.world.tick()
-        if not self.front_image_queue.empty():
-            _, front_image = self.front_image_queue.get(True, timeout)
-        else:
-            front_image = None
-        if not self.bev_image_queue.empty():
-            _, bev_image = self.bev_image_queue.get(True, timeout)
-        else:
-            bev_image = None
-        return vehicle_done, {"front_image": front_image, "bev_image": bev_image}
+            frame = self.world.tick()
+        images = {"front_image": None, "bev_image": None}
+        if self.sensor_hub is not None:
+            # Wait for the images of this tick, or take the oldest complete frame if another
+            # process ticks the world
+            cameras_alive = all(
+                camera is not None and camera.is_alive
+                for camera in (self.front_camera, self.bev_camera)
+            )
+            wait = timeout if tick_world and cameras_alive else 0.0
+            sensor_frame = self.sensor_hub.get(frame, wait)
+            if sensor_frame is not None:
+                images.update(sensor_frame[1])
+        return vehicle_done, images
 
     def destroy(self, set_sync=True):
         self.clean()
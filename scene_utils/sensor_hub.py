@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SensorHub:
+    """Group the data of several sensors by simulator frame.
+
+    Sensor callbacks call `put(name, frame, data)` from the CARLA threads, and `get` returns
+    `(frame, {name: data})` once every sensor has delivered that frame, in frame order. At most
+    `max_pending` frames are kept; when a new frame does not fit, the oldest one is dropped. Frames
+    arriving after a newer frame was returned are dropped as well. The number of dropped frames is
+    kept per reason in `dropped`:
+    - overflow: the buffer was full, the oldest of the pending and incoming frames is dropped
+    - late: the frame arrived after a newer frame was returned
+    - incomplete: a newer frame was returned before every sensor delivered this one
+    - skipped: the frame was complete but `get` asked for a newer one
+    """
+
+    def __init__(self, sensor_names, max_pending=8):
+        self.sensor_names = tuple(sensor_names)
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # frame -> {name: data}, in frame order
+        self.last_frame = None
+        self.dropped = {"overflow": 0, "late": 0, "incomplete": 0, "skipped": 0}
+        self.condition = threading.Condition()
+
+    def put(self, name, frame, data):
+        with self.condition:
+            if self.last_frame is not None and frame <= self.last_frame:
+                self.dropped["late"] += 1
+                return
+            if frame not in self.pending:
+                if len(self.pending) >= self.max_pending and frame < next(iter(self.pending)):
+                    # Older than every pending frame: keep the newer ones
+                    self.dropped["overflow"] += 1
+                    return
+                while len(self.pending) >= self.max_pending:
+                    self.pending.popitem(last=False)
+                    self.dropped["overflow"] += 1
+                # Callbacks of different sensors are not ordered, keep the frames sorted
+                out_of_order = len(self.pending) > 0 and frame < next(reversed(self.pending))
+                self.pending[frame] = {}
+                if out_of_order:
+                    for other_frame in sorted(self.pending):
+                        self.pending.move_to_end(other_frame)
+            self.pending[frame][name] = data
+            if len(self.pending[frame]) == len(self.sensor_names):
+                self.condition.notify_all()
+
+    def _oldest_complete_frame(self, frame=None):
+        for pending_frame, sensor_data in self.pending.items():
+            if frame is not None and pending_frame < frame:
+                continue
+            if len(sensor_data) == len(self.sensor_names):
+                return pending_frame
+        return None
+
+    def get(self, frame=None, timeout=0.0):
+        """Return the oldest complete frame, or `frame` itself when given, waiting up to `timeout`.
+
+        When `frame` is lost, a newer complete frame is returned instead. Return None if nothing
+        is complete in time.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self._oldest_complete_frame(frame) is not None, timeout=timeout
+            )
+            complete_frame = self._oldest_complete_frame(frame)
+            if complete_frame is None:
+                return None
+            while True:
+                pending_frame, sensor_data = self.pending.popitem(last=False)
+                if pending_frame == complete_frame:
+                    break
+                if len(sensor_data) == len(self.sensor_names):
+                    self.dropped["skipped"] += 1
+                else:
+                    self.dropped["incomplete"] += 1
+            self.last_frame = complete_frame
+            return complete_frame, sensor_data
+
+    def num_dropped(self):
+        with self.condition:
+            return sum(self.dropped.values())
+
+
+class ImageRing:
+    """Preallocated BGRA buffers that a camera callback decodes its images into.
+
+    `write` copies the raw data of a `carla.Image` into the next slot and returns it, without any
+    allocation once the slots exist. A slot is overwritten `num_slots` images later, so consumers
+    must be done with it by then (e.g. `FrameWriter` decodes it from its workers).
+    """
+
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self.slots = None
+        self.next_slot = 0
+
+    def write(self, carla_image):
+        shape = (carla_image.height, carla_image.width, 4)
+        if self.slots is None or self.slots.shape[1:] != shape:
+            self.slots = np.empty((self.num_slots, *shape), dtype=np.uint8)
+        slot = self.slots[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % self.num_slots
+        slot[...] = np.frombuffer(carla_image.raw_data, dtype=np.uint8).reshape(shape)
+        return slot
+
@@ -70,6 +70,24 @@ if __name__ == "__main__":
     parser.add_argument("--tm_port", type=int, default=8000, help="traffic manager port")
     parser.add_argument("--fixed_delta_seconds", type=float, default=0.1)
     parser.add_argument("--scenario_id", type=int, default=None)
+    parser.add_argument(
+        "--env_backend",
+        type=str,
+        default="serial",
+        choices=["serial", "process"],
+        help="build the observations in this process or in worker processes",
+    )
+    parser.add_argument("--num_env_workers", type=int, default=4)
+    parser.add_argument(
+        "--map_cache_dir", type=str, default="map_cache", help="cache of the rendered town maps"
+    )
+    parser.add_argument(
+        "--birdeye_backend",
+        type=str,
+        default="pygame",
+        choices=["pygame", "array"],
+        help="render the birdeye view with pygame surfaces or with NumPy/OpenCV arrays",
+    )
     args = parser.parse_args()
     args_dict = vars(args)
 
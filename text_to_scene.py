@@ -2,6 +2,7 @@ import argparse
 import json
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 import dotenv
 import numpy as np
@@ -23,6 +24,7 @@ from prompt.format import (
     ROAD_RETREIVAL_FORMAT,
     ROAD_RETREIVAL_FORMAT_WITH_ERROR,
 )
+from prompt.llm_cache import LLMResponseCache, create_chat_completion
 
 dotenv.load_dotenv()
 
@@ -95,6 +97,24 @@ def parse_args():
         default=3,
         help="The maximum retry for each stage",
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="The seed passed to the LLM",
+    )
+    parser.add_argument(
+        "--llm-cache-dir",
+        type=str,
+        default=None,
+        help="Store the LLM responses in this directory and reuse them",
+    )
+    parser.add_argument(
+        "--llm-replay",
+        action="store_true",
+        help="Only use the cached LLM responses, never call the API",
+        default=False,
+    )
     return parser.parse_args()
 
 
@@ -103,6 +123,67 @@ def split_planning_response(response):
     return eval(road_condition.strip()), eval(agent_info.strip())
 
 
+def run_stage(
+    stage_name,
+    chat_client,
+    input_format,
+    input_format_with_error,
+    format_kwargs,
+    check_output,
+    model_name,
+    max_retry,
+    seed=None,
+    llm_cache=None,
+    print_error=False,
+    log=None,
+):
+    """Query the LLM until `check_output` accepts the response, at most `max_retry` times.
+
+    Return the output of the last check, which is the parsed response on success. The messages
+    are printed, or appended to `log` when it is a list, e.g. to print them once the stage is
+    done when several stages run concurrently.
+    """
+    emit = print if log is None else log.append
+    success = False
+    check_message = None
+    output = None
+    count_retry = 0
+    while not success and count_retry < max_retry:
+        if check_message is None or output is None:
+            stage_input = input_format.format(**format_kwargs)
+        else:
+            stage_input = input_format_with_error.format(
+                **format_kwargs,
+                error=check_message,
+                previous_output=output,
+            )
+        output = create_chat_completion(
+            chat_client,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": stage_input},
+            ],
+            model=model_name,
+            temperature=0.9,
+            seed=seed,
+            cache=llm_cache,
+            attempt=count_retry,
+        )
+        try:
+            success, check_message = check_output(output)
+            emit(f"{Style.BRIGHT}{stage_name} input{Style.RESET_ALL}: {stage_input}")
+            emit(f"{Style.BRIGHT}{stage_name} output{Style.RESET_ALL}: {output}")
+            emit(
+                f"{Style.BRIGHT}{stage_name} check message{Style.RESET_ALL}: {Fore.GREEN + 'success' + Style.RESET_ALL if success else Fore.RED + check_message + Style.RESET_ALL}"
+            )
+        except Exception as e:
+            if print_error:
+                emit(str(e))
+            output = None
+        count_retry += 1
+    return check_message, output
+
+
 def text_to_scene(
     input_prompt: str,
     model_name: str = "gpt-4o",
@@ -115,123 +196,69 @@ def text_to_scene(
     cache_dir: str = "graph_cache",
     return_ego: bool = False,
     max_retry: int = 3,
+    seed: int = None,
+    llm_cache_dir: str = None,
+    llm_replay: bool = False,
 ):
     chat_client = OpenAI()
-    analysis_success = False
-    analysis_check_output = None
-    analysis_output = None
-    count_analysis_retry = 0
-    while not analysis_success and count_analysis_retry < max_retry:
-        if analysis_check_output is None or analysis_output is None:
-            analysis_input = ANALYSIS_FORMAT.format(
-                description=input_prompt,
-                return_ego="True" if return_ego else "False",
-            )
-        else:
-            analysis_input = ANALYSIS_FORMAT_WITH_ERROR.format(
-                description=input_prompt,
-                return_ego="True" if return_ego else "False",
-                error=analysis_check_output,
-                previous_output=analysis_output,
-            )
-        analysis_response = chat_client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": analysis_input},
-            ],
-            temperature=0.9,
-        )
-        try:
-            analysis_output = analysis_response.choices[0].message.content
-            analysis_success, analysis_check_output = check_analysis_output(analysis_output)
-            print(f"{Style.BRIGHT}Analysis input{Style.RESET_ALL}: {analysis_input}")
-            print(f"{Style.BRIGHT}Analysis output{Style.RESET_ALL}: {analysis_output}")
-            print(
-                f"{Style.BRIGHT}Analysis check message{Style.RESET_ALL}: {Fore.GREEN + 'success' + Style.RESET_ALL if analysis_success else Fore.RED + analysis_check_output + Style.RESET_ALL}"
-            )
-        except Exception as e:
-            print(str(e))
-            analysis_output = None
-        count_analysis_retry += 1
+    llm_cache = LLMResponseCache(llm_cache_dir, replay=llm_replay) if llm_cache_dir else None
+    stage_kwargs = dict(
+        chat_client=chat_client,
+        model_name=model_name,
+        max_retry=max_retry,
+        seed=seed,
+        llm_cache=llm_cache,
+    )
 
-    retreival_success = False
-    retreival_check_output = None
-    retreival_output = None
-    count_retreival_retry = 0
-    while not retreival_success and count_retreival_retry < max_retry:
-        if retreival_check_output is None or retreival_output is None:
-            retreival_input = ROAD_RETREIVAL_FORMAT.format(
-                description=input_prompt,
-                analysis_context=analysis_output,
-                return_ego="True" if return_ego else "False",
-            )
-        else:
-            retreival_input = ROAD_RETREIVAL_FORMAT_WITH_ERROR.format(
+    # analysis -> (retreival, planning): the last two only depend on the analysis output
+    analysis_check_output, analysis_output = run_stage(
+        "Analysis",
+        input_format=ANALYSIS_FORMAT,
+        input_format_with_error=ANALYSIS_FORMAT_WITH_ERROR,
+        format_kwargs=dict(
+            description=input_prompt,
+            return_ego="True" if return_ego else "False",
+        ),
+        check_output=check_analysis_output,
+        print_error=True,
+        **stage_kwargs,
+    )
+
+    # each stage keeps its messages, printed once it is done so that they do not interleave
+    retreival_log, planning_log = [], []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        retreival_future = executor.submit(
+            run_stage,
+            "Retreival",
+            input_format=ROAD_RETREIVAL_FORMAT,
+            input_format_with_error=ROAD_RETREIVAL_FORMAT_WITH_ERROR,
+            format_kwargs=dict(
                 description=input_prompt,
                 analysis_context=analysis_output,
                 return_ego="True" if return_ego else "False",
-                error=retreival_check_output,
-                previous_output=retreival_output,
-            )
-        retreival_response = chat_client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": retreival_input},
-            ],
-            temperature=0.9,
+            ),
+            check_output=check_retreival_output,
+            log=retreival_log,
+            **stage_kwargs,
         )
-        try:
-            retreival_output = retreival_response.choices[0].message.content
-            retreival_success, retreival_check_output = check_retreival_output(retreival_output)
-            print(f"{Style.BRIGHT}Retreival input{Style.RESET_ALL}: {retreival_input}")
-            print(f"{Style.BRIGHT}Retreival output{Style.RESET_ALL}: {retreival_output}")
-            print(
-                f"{Style.BRIGHT}Retreival check message{Style.RESET_ALL}: {Fore.GREEN + 'success' + Style.RESET_ALL if retreival_success else Fore.RED + retreival_check_output + Style.RESET_ALL}"
-            )
-        except Exception:
-            retreival_output = None
-        count_retreival_retry += 1
-
-    planning_success = False
-    planning_check_output = None
-    planning_output = None
-    count_planning_retry = 0
-    while not planning_success and count_planning_retry < max_retry:
-        if planning_check_output is None or planning_output is None:
-            planning_input = PLANNING_FORMAT.format(
-                description=input_prompt,
-                analysis_context=analysis_output,
-                return_ego={"True" if return_ego else "False"},
-            )
-        else:
-            planning_input = PLANNING_FORMAT_WITH_ERROR.format(
+        planning_future = executor.submit(
+            run_stage,
+            "Planning",
+            input_format=PLANNING_FORMAT,
+            input_format_with_error=PLANNING_FORMAT_WITH_ERROR,
+            format_kwargs=dict(
                 description=input_prompt,
                 analysis_context=analysis_output,
                 return_ego={"True" if return_ego else "False"},
-                error=planning_check_output,
-                previous_output=planning_output,
-            )
-        planning_response = chat_client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": planning_input},
-            ],
-            temperature=0.9,
+            ),
+            check_output=check_planning_output,
+            log=planning_log,
+            **stage_kwargs,
         )
-        try:
-            planning_output = planning_response.choices[0].message.content
-            planning_success, planning_check_output = check_planning_output(planning_output)
-            print(f"{Style.BRIGHT}Planning input{Style.RESET_ALL}: {planning_input}")
-            print(f"{Style.BRIGHT}Planning output{Style.RESET_ALL}: {planning_output}")
-            print(
-                f"{Style.BRIGHT}Planning check message{Style.RESET_ALL}: {Fore.GREEN  + 'success' + Style.RESET_ALL if planning_success else Fore.RED  + planning_check_output + Style.RESET_ALL}"
-            )
-        except Exception:
-            planning_output = None
-        count_planning_retry += 1
+        retreival_check_output, _ = retreival_future.result()
+        print("\n".join(retreival_log))
+        planning_check_output, _ = planning_future.result()
+        print("\n".join(planning_log))
 
     os.makedirs(save_dir, exist_ok=True)
     with open(f"{save_dir}/agent_output.json", "w") as f:
@@ -276,4 +303,7 @@ if __name__ == "__main__":
         cache_dir=args.cache_dir,
         return_ego=args.return_ego,
         max_retry=args.max_retry,
+        seed=args.seed,
+        llm_cache_dir=args.llm_cache_dir,
+        llm_replay=args.llm_replay,
     )